@@ -0,0 +1,91 @@
+"""Микробенчмарк MMR: стандартный путь LangChain (FAISS + maximal_marginal_relevance) против NumpyMMRRetriever.
+
+Эмбеддинг запроса не считается: оба варианта получают готовый вектор, сравнивается только CPU-часть.
+
+    python -m benchmarks.bench_mmr --sizes 1000 10000 100000 --dim 1536 --queries 50
+"""
+import time
+import argparse
+import statistics
+import numpy as np
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+from src.knowledge_base.mmr_retriever import normalize_rows, mmr_select
+
+K = 10
+FETCH_K = 20
+LAMBDA_MULT = 0.25
+
+
+def build_faiss(vectors: np.ndarray) -> FAISS:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    ids = [str(i) for i in range(len(vectors))]
+    docstore = InMemoryDocstore({i: Document(page_content=f"chunk {i}") for i in ids})
+    return FAISS(FakeEmbeddings(size=vectors.shape[1]), index, docstore, dict(enumerate(ids)))
+
+
+def timed(fn, queries) -> list:
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run(size: int, dim: int, n_queries: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(rng.standard_normal((size, dim), dtype=np.float32))
+    queries = normalize_rows(rng.standard_normal((n_queries, dim), dtype=np.float32))
+
+    vs = build_faiss(vectors)
+    matrix = normalize_rows(vs.index.reconstruct_n(0, vs.index.ntotal))
+
+    def langchain_mmr(q):
+        return vs.max_marginal_relevance_search_by_vector(q.tolist(), k=K, fetch_k=FETCH_K, lambda_mult=LAMBDA_MULT)
+
+    def numpy_mmr(q):
+        return mmr_select(matrix, q, K, FETCH_K, LAMBDA_MULT)
+
+    # Прогрев и проверка, что выдача совпадает
+    same = 0
+    for q in queries[:5]:
+        expected = [d.page_content for d in langchain_mmr(q)]
+        actual = [f"chunk {i}" for i in numpy_mmr(q)]
+        same += expected == actual
+
+    baseline = timed(langchain_mmr, queries)
+    numpy_times = timed(numpy_mmr, queries)
+    return {
+        "size": size,
+        "langchain_p50": statistics.median(baseline),
+        "numpy_p50": statistics.median(numpy_times),
+        "langchain_mean": statistics.fmean(baseline),
+        "numpy_mean": statistics.fmean(numpy_times),
+        "identical": f"{same}/{min(5, n_queries)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8} {'langchain p50 ms':>17} {'numpy p50 ms':>13} {'langchain mean':>15} "
+          f"{'numpy mean':>11} {'speedup':>8} {'same':>5}")
+    for size in args.sizes:
+        r = run(size, args.dim, args.queries, args.seed)
+        speedup = r["langchain_mean"] / r["numpy_mean"] if r["numpy_mean"] else float("inf")
+        print(f"{r['size']:>8} {r['langchain_p50']:>17.3f} {r['numpy_p50']:>13.3f} {r['langchain_mean']:>15.3f} "
+              f"{r['numpy_mean']:>11.3f} {speedup:>7.1f}x {r['identical']:>5}")
+
+
+if __name__ == "__main__":
+    main()
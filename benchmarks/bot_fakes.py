@@ -0,0 +1,129 @@
+"""Telegram без сети для нагрузочного бенчмарка: бот-заглушка, синтетические апдейты и учёт их обработки"""
+import time
+import asyncio
+from collections import Counter
+from typing import Dict, List
+from telegram import Update
+from telegram.ext import ExtBot
+from src.bot.update_processor import ChatOrderedUpdateProcessor
+from src.tracing.exporters import SpanExporter
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "AQP bench", "username": "aqp_bench_bot"}
+
+
+class BotApiStats:
+    def __init__(self):
+        self.calls = Counter()
+        self.inflight = 0
+        self.inflight_max = 0
+        self.message_ids = 0
+
+
+class FakeTelegramBot(ExtBot):
+    """ExtBot, у которого каждый вызов Bot API отвечает локально после api_latency секунд"""
+
+    def __init__(self, api_latency: float = 0.0, token: str = "100000:bench-offline"):
+        super().__init__(token)
+        # Атрибуты Bot заморожены после __init__; счётчики живут в отдельном объекте
+        with self._unfrozen():
+            self.api_latency = api_latency
+            self.api = BotApiStats()
+
+    def _message(self, data: dict, message_id: int = None) -> dict:
+        if message_id is None:
+            self.api.message_ids += 1
+            message_id = self.api.message_ids
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(data["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": data.get("text", ""),
+        }
+
+    async def _do_post(self, endpoint: str, data: dict, **kwargs):
+        self.api.calls[endpoint] += 1
+        self.api.inflight += 1
+        self.api.inflight_max = max(self.api.inflight_max, self.api.inflight)
+        try:
+            if endpoint != "getMe":
+                await asyncio.sleep(self.api_latency)
+        finally:
+            self.api.inflight -= 1
+
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "sendMessage":
+            return self._message(data)
+        if endpoint == "editMessageText":
+            return self._message(data, int(data["message_id"]))
+        return True
+
+
+class TrackingUpdateProcessor(ChatOrderedUpdateProcessor):
+    """Тот же порядок обработки, что у бота, плюс время ожидания в очереди и обработки апдейта"""
+
+    def __init__(self, max_concurrent_updates: int, ordered: bool = True):
+        super().__init__(max_concurrent_updates, ordered)
+        self.enqueued_at: Dict[int, float] = {}
+        self.done: Dict[int, asyncio.Future] = {}
+        self.queue_wait_ms: List[float] = []
+        self.handle_ms: List[float] = []
+        self.active = 0
+
+    def expect(self, update_id: int) -> asyncio.Future:
+        self.enqueued_at[update_id] = time.perf_counter()
+        self.done[update_id] = asyncio.get_running_loop().create_future()
+        return self.done[update_id]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        update_id = getattr(update, "update_id", None)
+        start = time.perf_counter()
+        enqueued = self.enqueued_at.pop(update_id, None)
+        if enqueued is not None:
+            self.queue_wait_ms.append((start - enqueued) * 1000)
+        self.active += 1
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            self.active -= 1
+            self.handle_ms.append((time.perf_counter() - start) * 1000)
+            done = self.done.pop(update_id, None)
+            if done is not None and not done.done():
+                done.set_result(None)
+
+    def reset(self) -> None:
+        self.queue_wait_ms.clear()
+        self.handle_ms.clear()
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self):
+        self.spans: List[dict] = []
+
+    def export(self, spans: List[dict]) -> None:
+        self.spans.extend(spans)
+
+
+class UpdateFactory:
+    """Апдейты личного чата так, как их присылает Telegram: текст и команды с entity bot_command"""
+
+    def __init__(self, bot: ExtBot):
+        self.bot = bot
+        self._update_ids = 0
+        self._message_ids = 0
+
+    def text(self, user_id: int, text: str) -> Update:
+        self._update_ids += 1
+        self._message_ids += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "language_code": "uk"}
+        message = {
+            "message_id": self._message_ids,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": self._update_ids, "message": message}, self.bot)
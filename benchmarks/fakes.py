@@ -0,0 +1,123 @@
+"""Детерминированные заглушки LLM и embeddings с настраиваемой задержкой — для бенчмарков без сети"""
+import time
+import zlib
+import asyncio
+from typing import Dict, List
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_VOCAB = (
+    "басейн вода хлор дозування таблетка гранули фільтр pH рівень обробка тиждень кубометр "
+    "препарат концентрація шок очищення водорості стабілізатор коагулянт флокулянт розчин "
+    "рекомендовано додати залишити годин перевірити тест дозу кожні регулярно"
+).split()
+
+
+class LatencyEmbeddings(Embeddings):
+    """DeterministicFakeEmbedding + задержка на вызов и на каждый текст (как у батча OpenAI)"""
+
+    def __init__(self, size: int, call_latency: float = 0.0, per_text_latency: float = 0.0):
+        self.size = size
+        self.call_latency = call_latency
+        self.per_text_latency = per_text_latency
+        self._fake = DeterministicFakeEmbedding(size=size)
+        self.calls = 0
+        self.texts = 0
+
+    def _delay(self, n_texts: int) -> float:
+        self.calls += 1
+        self.texts += n_texts
+        return self.call_latency + self.per_text_latency * n_texts
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(len(texts)))
+        return self._fake.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self._delay(1))
+        return self._fake.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return self._fake.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self._delay(1))
+        return self._fake.embed_query(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Чат-модель с детерминированным ответом и задержкой до первого токена и между токенами.
+
+    responses: начало системного промта → фиксированный ответ (например, «0» для STEP 1);
+    иначе ответ — answer_words слов, зависящих только от последнего сообщения.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 60
+    responses: Dict[str, str] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake-chat"
+
+    def _answer(self, messages) -> str:
+        system = next((m.content for m in messages if m.type == "system"), "").lstrip()
+        for prefix, answer in self.responses.items():
+            if system.startswith(prefix):
+                return answer
+        seed = zlib.crc32(str(messages[-1].content).encode("utf-8"))
+        return " ".join(_VOCAB[(seed + i * 7919) % len(_VOCAB)] for i in range(self.answer_words))
+
+    @staticmethod
+    def _usage(messages, text: str) -> dict:
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(text.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _result(self, messages, text: str) -> ChatResult:
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self, text: str) -> float:
+        return self.latency + self.token_latency * len(text.split())
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._answer(messages)
+        time.sleep(self._delay(text))
+        return self._result(messages, text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._answer(messages)
+        await asyncio.sleep(self._delay(text))
+        return self._result(messages, text)
+
+    def _chunks(self, messages):
+        text = self._answer(messages)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=self._usage(messages, text) if last else None
+            ))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for chunk in self._chunks(messages):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(messages):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,158 @@
+"""Общие части бенчмарков: изолированное окружение, синтетический каталог, замеры и отчёт"""
+import os
+import csv
+import json
+import time
+import random
+import asyncio
+import tracemalloc
+import statistics
+from typing import Awaitable, Callable, List, Optional
+from psycopg.conninfo import conninfo_to_dict
+
+CODES = ["C", "CH", "MC", "SM", "SMe", "PM", "AC", "AB", "FL", "O2", "CW", "WC", "SC", "SF"]
+FORMS = ["таблетках 200 г", "гранулах", "рідкий", "таблетках 20 г"]
+
+
+def prepare_environment(workdir: str, database_url: Optional[str] = None) -> None:
+    """Пути, таблица истории и БД бенчмарка — через env, до первого импорта src.config.settings"""
+    paths = {
+        "CSV_DIR": os.path.join(workdir, "csv"),
+        "FAISS_INDEX_PATH": os.path.join(workdir, "faiss_index"),
+        "FAISS_INDEX_TMP": os.path.join(workdir, "faiss_index_tmp"),
+        "TEMP_CSV_DIR": os.path.join(workdir, "csv", "temp"),
+        "BACKUP_CSV_DIR": os.path.join(workdir, "csv", "backup"),
+        "EMBEDDINGS_CACHE_PATH": os.path.join(workdir, "embeddings_cache"),
+    }
+    os.environ.update(paths)
+    os.environ["CSV_FILE_PATH"] = os.path.join(paths["CSV_DIR"], "knowledge.csv")
+    os.environ["MAX_CSV_SIZE_MB"] = "4096"
+    os.environ["TRACING_EXPORTERS"] = "none"
+    # Бенчмарк меряет локальную пересборку индекса, без публикации поколения в БД
+    os.environ["KB_SYNC_ENABLED"] = "false"
+    # Сетевые клиенты не создаются, но AQPAssistant выставляет ключ в окружение
+    os.environ.setdefault("OPENAI_API_KEY", "bench-offline")
+    os.environ["LC_CHAT_HISTORY_TABLE_NAME"] = f"bench_chat_history_{os.getpid()}"
+
+    if database_url:
+        params = conninfo_to_dict(database_url)
+        os.environ.update({
+            "DB_HOST": params.get("host", "localhost"),
+            "DB_PORT": str(params.get("port", "5432")),
+            "DB_NAME": params.get("dbname", ""),
+            "DB_USER": params.get("user", ""),
+            "DB_PASSWORD": params.get("password", ""),
+        })
+
+
+def write_synthetic_catalog(path: str, rows: int, seed: int = 0) -> List[str]:
+    """CSV в формате рабочего каталога; возвращает названия препаратов"""
+    rng = random.Random(seed)
+    names = []
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Препарат", "Фасування", "Форма випуску", "посилання на сайт", "Дозування",
+                         "Інструкція з використання"])
+        for i in range(rows):
+            code = f"{rng.choice(CODES)}-{i}{rng.choice('TLM')}"
+            name = f"AquaDoctor {code} в {rng.choice(FORMS)}"
+            names.append(name)
+            packaging = "\n".join(f"AquaDoctor {code} {kg} кг" for kg in rng.sample([1, 5, 25, 50], 2))
+            dosage = (f"Регулярна обробка: {rng.randint(1, 5)} таблетка AquaDoctor {code} на "
+                      f"{rng.randint(10, 50)} м³ води кожні {rng.randint(3, 14)} днів")
+            instruction = " ".join(rng.choice(FORMS + CODES + ["вода", "pH", "фільтр", "басейн"])
+                                   for _ in range(rng.randint(20, 60)))
+            writer.writerow([name, packaging, f"AquaDoctor {code} у вигляді таблеток",
+                             f"https://aquapolis.ua/ua/{code.lower()}.html", dosage, instruction])
+    return names
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize(name: str, size: int, timings_ms: List[float], wall_s: float, peak_mb: float, **extra) -> dict:
+    return {
+        "bench": name,
+        "size": size,
+        "n": len(timings_ms),
+        "throughput_per_s": round(len(timings_ms) / wall_s, 2) if wall_s else 0.0,
+        "p50_ms": round(percentile(timings_ms, 50), 3),
+        "p95_ms": round(percentile(timings_ms, 95), 3),
+        "peak_mb": round(peak_mb, 2),
+        **extra,
+    }
+
+
+def peak_memory_mb(fn: Callable[[], object]) -> float:
+    """Пик памяти Python-объектов за один вызов; отдельный прогон — tracemalloc искажает время"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name: str, size: int, fn: Callable[[int], object], iterations: int,
+            setup: Callable[[int], object] = None, **extra) -> dict:
+    """Последовательные вызовы fn(i); setup(i) выполняется перед каждым вызовом и не входит в замер"""
+    timings = []
+    busy = 0.0
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        fn(i)
+        elapsed = time.perf_counter() - start
+        busy += elapsed
+        timings.append(elapsed * 1000)
+    if setup:
+        setup(iterations)
+    peak = peak_memory_mb(lambda: fn(iterations))
+    return summarize(name, size, timings, busy, peak, **extra)
+
+
+def measure_async(name: str, size: int, fn: Callable[[int], Awaitable], iterations: int,
+                  concurrency: int = 1, **extra) -> dict:
+    """iterations вызовов fn(i) не более чем concurrency одновременно; throughput — по общему времени"""
+    async def run() -> tuple:
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                await fn(i)
+                timings.append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(iterations)))
+        wall = time.perf_counter() - started
+
+        # Замер памяти в том же event loop: async-пулы БД привязаны к нему
+        tracemalloc.start()
+        try:
+            await fn(iterations)
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+        return timings, wall, peak
+
+    timings, wall, peak = asyncio.run(run())
+    return summarize(name, size, timings, wall, peak, concurrency=concurrency, **extra)
+
+
+def print_report(results: List[dict]) -> None:
+    print(f"{'bench':<22} {'size':>7} {'n':>5} {'ops/s':>9} {'p50 ms':>10} {'p95 ms':>10} {'peak MB':>9}")
+    for r in results:
+        print(f"{r['bench']:<22} {r['size']:>7} {r['n']:>5} {r['throughput_per_s']:>9.2f} "
+              f"{r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} {r['peak_mb']:>9.2f}")
+
+
+def save_report(results: List[dict], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
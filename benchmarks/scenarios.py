@@ -0,0 +1,228 @@
+"""Сценарии бенчмарков поверх кода бота; импортируется после prepare_environment()"""
+import os
+import shutil
+import asyncio
+import logging
+from typing import Callable, List, Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+from src.config.settings import settings
+from src.auth.auth_service import ADMIN, ANONYMOUS, AuthService, AuthStatus
+from src.prompt.prompt_service import PromptService
+from src.database.db_connection import get_pool
+from src.knowledge_base.csv_manager import _csv_to_texts, update_knowledge_base_atomic
+from src.knowledge_base.embedding_cache import set_embeddings_factory
+from src.knowledge_base.knowledge_service import (
+    AQPAssistant, ColabKnowledgeService, CustomPostgresChatMessageHistory, ensure_history_schema
+)
+from benchmarks.fakes import FakeChatModel, LatencyEmbeddings
+from benchmarks.harness import CODES, measure, measure_async
+
+logger = logging.getLogger(__name__)
+
+
+class StaticPromptService(PromptService):
+    def __init__(self, prompt: str = None):
+        self.prompt = prompt or settings.INITIAL_SYSTEM_PROMPT
+
+    def get_current_prompt(self) -> str:
+        return self.prompt
+
+    async def aget_current_prompt(self) -> str:
+        return self.prompt
+
+    def update_prompt(self, new_prompt: str) -> bool:
+        self.prompt = new_prompt
+        return True
+
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        return self.update_prompt(new_prompt)
+
+    def validate_prompt(self, prompt: str) -> bool:
+        return bool(prompt)
+
+    def get_current_version(self):
+        return 1
+
+    def add_change_listener(self, listener):
+        pass
+
+
+class InMemoryHistoryAssistant(AQPAssistant):
+    """AQPAssistant без Postgres: история в памяти процесса"""
+
+    def _init_history_storage(self):
+        self.postgres_table_name = None
+        self._histories = {}
+
+    def _session_history(self, session_uuid: str) -> BaseChatMessageHistory:
+        return self._histories.setdefault(session_uuid, ChatMessageHistory())
+
+
+class InMemoryAuthService(AuthService):
+    """Статусы пользователей в памяти процесса — для прогона хендлеров без Postgres"""
+
+    def __init__(self):
+        self._statuses = {}
+
+    def login(self, telegram_id: int, password: str) -> bool:
+        if password != settings.ADMIN_PASSWORD:
+            return False
+        self._statuses[telegram_id] = ADMIN
+        return True
+
+    def get_status(self, telegram_id: int) -> AuthStatus:
+        return self._statuses.get(telegram_id, ANONYMOUS)
+
+    def is_authorized(self, telegram_id: int) -> bool:
+        return self.get_status(telegram_id).is_authorized
+
+    def is_admin(self, telegram_id: int) -> bool:
+        return self.get_status(telegram_id).is_admin
+
+    def logout(self, telegram_id: int) -> bool:
+        self._statuses.pop(telegram_id, None)
+        return True
+
+    async def alogin(self, telegram_id: int, password: str) -> bool:
+        return self.login(telegram_id, password)
+
+    async def aget_status(self, telegram_id: int) -> AuthStatus:
+        return self.get_status(telegram_id)
+
+    async def ais_authorized(self, telegram_id: int) -> bool:
+        return self.is_authorized(telegram_id)
+
+    async def ais_admin(self, telegram_id: int) -> bool:
+        return self.is_admin(telegram_id)
+
+    async def alogout(self, telegram_id: int) -> bool:
+        return self.logout(telegram_id)
+
+
+class BenchKnowledgeService(ColabKnowledgeService):
+    """ColabKnowledgeService вокруг уже собранного AQPAssistant"""
+
+    def __init__(self, assistant: AQPAssistant):
+        self.prompt_service = assistant.prompt_service
+        self.assistant = assistant
+
+
+def install_fake_embeddings(dim: int, call_latency: float, per_text_latency: float) -> None:
+    set_embeddings_factory(lambda model: LatencyEmbeddings(dim, call_latency, per_text_latency))
+
+
+def fake_llm(latency: float, token_latency: float, answer_words: int) -> FakeChatModel:
+    # STEP 1 для общих вопросов: «0» — препараты не нужны
+    return FakeChatModel(
+        latency=latency,
+        token_latency=token_latency,
+        answer_words=answer_words,
+        responses={settings.PRODUCTS_PROMPT.strip()[:60]: "0"}
+    )
+
+
+def chat_queries(names: List[str], count: int) -> List[str]:
+    """Поровну запросов с кодом препарата (каталог, без STEP 1) и общих вопросов (STEP 1 → «0»)"""
+    queries = []
+    for i in range(count):
+        if i % 2 == 0:
+            code = names[(i * 7919) % len(names)].split()[1]
+            queries.append(f"Яке дозування {code} для басейну {10 + i % 40} м³?")
+        else:
+            queries.append(f"Як часто промивати фільтр басейну, питання {i}?")
+    return queries
+
+
+def bench_csv_to_texts(size: int, csv_path: str, iterations: int) -> dict:
+    return measure("csv_to_texts", size, lambda i: _csv_to_texts(csv_path), iterations)
+
+
+def bench_kb_update(size: int, csv_path: str, iterations: int, warm_cache: bool = False) -> dict:
+    """Полный update_knowledge_base_atomic: CSV → FAISS (фейковые embeddings) → каталог → установка"""
+    temp_paths = {}
+
+    def setup(i: int):
+        if not warm_cache:
+            shutil.rmtree(settings.EMBEDDINGS_CACHE_PATH, ignore_errors=True)
+            os.makedirs(settings.EMBEDDINGS_CACHE_PATH, exist_ok=True)
+        os.makedirs(settings.TEMP_CSV_DIR, exist_ok=True)
+        temp_paths[i] = os.path.join(settings.TEMP_CSV_DIR, f"{i}_bench_{size}.csv")
+        shutil.copy2(csv_path, temp_paths[i])
+
+    def run(i: int):
+        ok, message, _ = asyncio.run(update_knowledge_base_atomic(temp_paths[i]))
+        if not ok:
+            raise RuntimeError(f"Knowledge base update failed: {message}")
+
+    return measure("kb_update", size, run, iterations, setup=setup, warm_embeddings_cache=warm_cache)
+
+
+def build_assistant(csv_path: str, llm, database: bool) -> AQPAssistant:
+    cls = AQPAssistant if database else InMemoryHistoryAssistant
+    return cls(csv_path, StaticPromptService(), llm=llm)
+
+
+def bench_chat(size: int, assistant: AQPAssistant, queries: List[str], sessions: int) -> dict:
+    def run(i: int):
+        assistant.chat(queries[i % len(queries)], f"bench-session-{i % sessions}")
+
+    return measure("chat", size, run, len(queries), sessions=sessions)
+
+
+def bench_achat(size: int, assistant: AQPAssistant, queries: List[str], sessions: int, concurrency: int) -> dict:
+    async def run(i: int):
+        await assistant.achat(queries[i % len(queries)], f"bench-async-session-{i % sessions}")
+
+    return measure_async("achat", size, run, len(queries), concurrency=concurrency, sessions=sessions)
+
+
+def _words(count: int, seed: int) -> str:
+    return " ".join(f"{CODES[(seed + j) % len(CODES)]}{j}" for j in range(count))
+
+
+def bench_history(turns: int, sessions: int, question_words: int = 40, answer_words: int = 250) -> List[dict]:
+    """Добавление ходов в CustomPostgresChatMessageHistory (с обрезкой по WORD_WINDOW) и чтение истории"""
+    table = settings.LC_CHAT_HISTORY_TABLE_NAME
+    pool = get_pool("bench_history", row_factory=None)
+    with pool.connection() as conn:
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id SERIAL PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                content TEXT,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_session_idx ON {table} (session_id, id)")
+        ensure_history_schema(conn, table)
+
+    histories = [
+        CustomPostgresChatMessageHistory(table, f"bench-history-{s}", pool)
+        for s in range(sessions)
+    ]
+    try:
+        def append(i: int):
+            histories[i % sessions].add_messages([
+                HumanMessage(content=_words(question_words, i)),
+                AIMessage(content=_words(answer_words, i + 1)),
+            ])
+
+        def read(i: int):
+            return histories[i % sessions].messages
+
+        n = turns * sessions
+        return [
+            measure("history_append", sessions, append, n,
+                    words_per_turn=question_words + answer_words),
+            measure("history_read", sessions, read, n),
+        ]
+    finally:
+        with pool.connection() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"DROP TABLE IF EXISTS {table}_totals")
+        pool.close()
@@ -25,4 +25,21 @@ CREATE TABLE IF NOT EXISTS langchain_chat_history (
 );
 
 -- Индекс для быстрого поиска истории чата по session_id
-CREATE INDEX IF NOT EXISTS idx_langchain_chat_history_session_id ON langchain_chat_history (session_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_langchain_chat_history_session_id ON langchain_chat_history (session_id);
+
+-- Количество слов в сообщении и текущая сумма слов по сессии (для обрезки истории без чтения всей сессии)
+ALTER TABLE langchain_chat_history ADD COLUMN IF NOT EXISTS word_count INTEGER;
+
+CREATE TABLE IF NOT EXISTS langchain_chat_history_totals (
+    session_id TEXT PRIMARY KEY,
+    total_words INTEGER NOT NULL DEFAULT 0
+);
+
+-- Поколения базы знаний: архив индекса и CSV, из которого реплики ставят новый индекс по NOTIFY
+CREATE TABLE IF NOT EXISTS kb_generations (
+    id SERIAL PRIMARY KEY,
+    checksum TEXT NOT NULL,
+    meta JSONB NOT NULL,
+    artifacts BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
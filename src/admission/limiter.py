@@ -0,0 +1,284 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from enum import IntEnum
+from threading import Event, Lock
+from typing import Callable, Dict, Optional, Tuple
+from src.config.settings import settings
+from src.tracing.tracer import span
+
+logger = logging.getLogger(__name__)
+
+# Не первый в очереди ждёт, пока его не разбудят; таймаут — страховка от потерянного пробуждения
+QUEUED_RECHECK = 0.5
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class AdmissionRejected(Exception):
+    """Интерактивному запросу пришлось бы ждать бюджета дольше допустимого"""
+
+    def __init__(self, resource: str, wait: float):
+        super().__init__(f"{resource}: estimated wait {wait:.1f}s exceeds the admission limit")
+        self.resource = resource
+        self.wait = wait
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 символа на токен — достаточно для бюджета, точный счёт приходит в usage ответа
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class _Ticket:
+    __slots__ = ("priority", "requests", "tokens", "wake")
+
+    def __init__(self, priority: Priority, requests: int, tokens: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.requests = requests
+        self.tokens = tokens
+        self.wake = wake
+
+
+class RateLimiter:
+    """Бюджет запросов и токенов в минуту к одному провайдеру (token bucket) с очередью по приоритетам.
+
+    Бюджет получает только первый в очереди: интерактивные запросы обгоняют фоновые (пересборку индекса),
+    внутри приоритета — по порядку прихода. Интерактивный запрос, которому пришлось бы ждать дольше
+    max_wait, отклоняется сразу (AdmissionRejected), фоновые ждут сколько нужно.
+    """
+
+    def __init__(self, name: str, rpm: int, tpm: int, max_wait: float):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_wait = max_wait
+        self._lock = Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.rejected = 0
+        self.waited = 0
+        self.wait_max_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+
+    def _time_until(self, requests: float, tokens: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.time_until(requests)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until(tokens))
+        return wait
+
+    def _estimate_locked(self, priority: Priority, requests: int, tokens: int) -> float:
+        ahead = [t for _, _, t in self._queue if t.priority <= priority]
+        return self._time_until(requests + sum(t.requests for t in ahead), tokens + sum(t.tokens for t in ahead))
+
+    def estimated_wait(self, priority: Priority = Priority.INTERACTIVE, requests: int = 1, tokens: int = 0) -> float:
+        """Сколько ждал бы запрос, поставленный в очередь сейчас"""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill()
+            return self._estimate_locked(priority, requests, tokens)
+
+    def overloaded(self, requests: int = 1, tokens: int = 0) -> bool:
+        return self.max_wait > 0 and self.estimated_wait(Priority.INTERACTIVE, requests, tokens) > self.max_wait
+
+    def _enqueue(self, priority: Priority, requests: int, tokens: int, wake: Callable[[], None]) -> _Ticket:
+        with self._lock:
+            self._refill()
+            if priority == Priority.INTERACTIVE and self.max_wait > 0:
+                wait = self._estimate_locked(priority, requests, tokens)
+                if wait > self.max_wait:
+                    self.rejected += 1
+                    raise AdmissionRejected(self.name, wait)
+            ticket = _Ticket(priority, requests, tokens, wake)
+            heapq.heappush(self._queue, (priority, next(self._seq), ticket))
+            return ticket
+
+    def _wake_head(self) -> None:
+        if self._queue:
+            self._queue[0][2].wake()
+
+    def _try_grant(self, ticket: _Ticket) -> Tuple[bool, float]:
+        """(True, 0) — бюджет списан; иначе (False, сколько ждать до следующей попытки)"""
+        with self._lock:
+            if self._queue[0][2] is not ticket:
+                return False, QUEUED_RECHECK
+            self._refill()
+            # Запрос больше ёмкости ведра ждёт полного ведра и уводит его в минус
+            wait = self._time_until(
+                min(ticket.requests, self.requests.capacity) if self.requests else 0,
+                min(ticket.tokens, self.tokens.capacity) if self.tokens else 0
+            )
+            if wait > 0:
+                return False, wait
+            if self.requests is not None:
+                self.requests.level -= ticket.requests
+            if self.tokens is not None:
+                self.tokens.level -= ticket.tokens
+            heapq.heappop(self._queue)
+            self.granted += 1
+            self._wake_head()
+            return True, 0.0
+
+    def _cancel(self, ticket: _Ticket) -> None:
+        with self._lock:
+            self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+            heapq.heapify(self._queue)
+            self._wake_head()
+
+    def _record_wait(self, started: float) -> None:
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.waited += 1
+            self.wait_max_ms = max(self.wait_max_ms, waited_ms)
+
+    def acquire(self, priority: Priority = Priority.INTERACTIVE, requests: int = 1, tokens: int = 0) -> None:
+        """Блокирует поток до выдачи бюджета (индекс собирается в потоках executor'а)"""
+        if not self.enabled:
+            return
+        event = Event()
+        ticket = self._enqueue(priority, requests, tokens, event.set)
+        granted, wait = self._try_grant(ticket)
+        if granted:
+            return
+        started = time.monotonic()
+        try:
+            with span("admission.wait", resource=self.name, priority=priority.name.lower(), tokens=tokens):
+                while not granted:
+                    event.wait(wait)
+                    event.clear()
+                    granted, wait = self._try_grant(ticket)
+        finally:
+            if not granted:
+                self._cancel(ticket)
+        self._record_wait(started)
+
+    async def aacquire(self, priority: Priority = Priority.INTERACTIVE, requests: int = 1, tokens: int = 0) -> None:
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop ожидающего уже закрыт
+                pass
+
+        ticket = self._enqueue(priority, requests, tokens, wake)
+        granted, wait = self._try_grant(ticket)
+        if granted:
+            return
+        started = time.monotonic()
+        try:
+            with span("admission.wait", resource=self.name, priority=priority.name.lower(), tokens=tokens):
+                while not granted:
+                    try:
+                        await asyncio.wait_for(event.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    event.clear()
+                    granted, wait = self._try_grant(ticket)
+        finally:
+            if not granted:
+                self._cancel(ticket)
+        self._record_wait(started)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Поправка бюджета токенов по фактическому usage ответа"""
+        if self.tokens is None or actual_tokens == estimated_tokens:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level - (actual_tokens - estimated_tokens))
+            self._wake_head()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill()
+            return {
+                "queued": len(self._queue),
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "waited": self.waited,
+                "wait_max_ms": round(self.wait_max_ms, 2),
+                "requests_available": round(self.requests.level, 2) if self.requests else None,
+                "tokens_available": round(self.tokens.level, 2) if self.tokens else None,
+            }
+
+
+_LIMITERS: Dict[str, RateLimiter] = {}
+_LIMITERS_LOCK = Lock()
+
+
+def _limits(resource: str) -> Tuple[int, int]:
+    if resource == "llm":
+        return settings.LLM_RPM, settings.LLM_TPM
+    if resource == "embeddings":
+        return settings.EMBEDDINGS_RPM, settings.EMBEDDINGS_TPM
+    raise ValueError(f"Unknown rate-limited resource '{resource}'")
+
+
+def _replica_share(per_minute: int) -> int:
+    # Доля реплики в бюджете аккаунта; 0 (без ограничения) так и остаётся 0
+    if per_minute <= 0:
+        return per_minute
+    return max(1, per_minute // settings.ADMISSION_REPLICAS)
+
+
+def get_limiter(resource: str) -> RateLimiter:
+    """Общий для процесса лимитер провайдера: llm или embeddings (доля этой реплики в бюджете)"""
+    with _LIMITERS_LOCK:
+        if resource not in _LIMITERS:
+            rpm, tpm = _limits(resource)
+            _LIMITERS[resource] = RateLimiter(
+                resource, _replica_share(rpm), _replica_share(tpm), settings.ADMISSION_MAX_WAIT
+            )
+        return _LIMITERS[resource]
+
+
+def admission_overloaded() -> Optional[str]:
+    """Имя ресурса, интерактивная очередь к которому уже длиннее ADMISSION_MAX_WAIT, или None"""
+    if get_limiter("llm").overloaded(tokens=settings.LLM_EXPECTED_OUTPUT_TOKENS):
+        return "llm"
+    if get_limiter("embeddings").overloaded():
+        return "embeddings"
+    return None
+
+
+def limiter_stats() -> dict:
+    with _LIMITERS_LOCK:
+        limiters = dict(_LIMITERS)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
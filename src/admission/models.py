@@ -0,0 +1,101 @@
+import math
+from typing import Any, List, Mapping
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+from src.config.settings import settings
+from src.admission.limiter import Priority, estimate_tokens, get_limiter
+
+
+class AdmissionChatModel(BaseChatModel):
+    """Обёртка чат-модели: каждый вызов сначала получает бюджет лимитера llm, затем идёт в inner.
+
+    Колбэки (трейсинг) срабатывают на обёртке, inner вызывается напрямую через _generate/_stream.
+    """
+
+    inner: BaseChatModel
+    priority: Priority = Priority.INTERACTIVE
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return self.inner._identifying_params
+
+    @staticmethod
+    def _estimate(messages) -> int:
+        return sum(estimate_tokens(str(m.content)) for m in messages) + settings.LLM_EXPECTED_OUTPUT_TOKENS
+
+    @staticmethod
+    def _settle(estimate: int, message) -> None:
+        usage = getattr(message, "usage_metadata", None)
+        if usage and usage.get("total_tokens"):
+            get_limiter("llm").settle(estimate, usage["total_tokens"])
+
+    @staticmethod
+    def _settle_result(estimate: int, result: ChatResult) -> None:
+        if result.generations:
+            AdmissionChatModel._settle(estimate, result.generations[0].message)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        estimate = self._estimate(messages)
+        get_limiter("llm").acquire(self.priority, tokens=estimate)
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._settle_result(estimate, result)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        estimate = self._estimate(messages)
+        await get_limiter("llm").aacquire(self.priority, tokens=estimate)
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self._settle_result(estimate, result)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimate = self._estimate(messages)
+        get_limiter("llm").acquire(self.priority, tokens=estimate)
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            # usage приходит в последнем чанке (stream_usage)
+            self._settle(estimate, chunk.message)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimate = self._estimate(messages)
+        await get_limiter("llm").aacquire(self.priority, tokens=estimate)
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            self._settle(estimate, chunk.message)
+            yield chunk
+
+
+class AdmissionEmbeddings(Embeddings):
+    """Обёртка embeddings: запросы к провайдеру идут через лимитер embeddings с заданным приоритетом"""
+
+    def __init__(self, inner: Embeddings, priority: Priority = Priority.INTERACTIVE):
+        self.inner = inner
+        self.priority = priority
+
+    def _cost(self, texts: List[str]) -> dict:
+        # OpenAIEmbeddings режет список на запросы по chunk_size текстов
+        chunk_size = getattr(self.inner, "chunk_size", None) or len(texts) or 1
+        return {
+            "requests": max(1, math.ceil(len(texts) / chunk_size)),
+            "tokens": sum(estimate_tokens(t) for t in texts),
+        }
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        get_limiter("embeddings").acquire(self.priority, **self._cost(texts))
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await get_limiter("embeddings").aacquire(self.priority, **self._cost(texts))
+        return await self.inner.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        get_limiter("embeddings").acquire(self.priority, tokens=estimate_tokens(text))
+        return self.inner.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await get_limiter("embeddings").aacquire(self.priority, tokens=estimate_tokens(text))
+        return await self.inner.aembed_query(text)
@@ -1,15 +1,123 @@
+import time
 import logging
 from abc import ABC, abstractmethod
-from src.database.db_connection import DatabaseConnection
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple, Optional
+from src.database.db_connection import get_pool, get_async_pool
+from src.database.notifications import get_listener
 from src.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+LOGIN_SQL = """
+    INSERT INTO users (telegram_id, is_authorized, role)
+    VALUES (%s, TRUE, 'admin')
+    ON CONFLICT (telegram_id)
+    DO UPDATE SET is_authorized = TRUE, role = 'admin'
+    RETURNING id
+"""
+
+LOGOUT_SQL = """
+    UPDATE users
+    SET is_authorized = FALSE, role = 'user'
+    WHERE telegram_id = %s
+    RETURNING telegram_id
+"""
+
+STATUS_SQL = "SELECT is_authorized, role FROM users WHERE telegram_id = %s"
+
+# login/logout на одной реплике сбрасывают закэшированный статус пользователя на остальных
+AUTH_CHANNEL = "users_auth_changed"
+
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+
+class AuthStatus(NamedTuple):
+    is_authorized: bool = False
+    is_admin: bool = False
+
+
+ANONYMOUS = AuthStatus()
+ADMIN = AuthStatus(is_authorized=True, is_admin=True)
+
+
+class AuthCache:
+    """Кэш статусов пользователей с TTL; login/logout записывают новый статус сразу"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        # Увеличивается при каждой записи: не даёт чтению, начатому до login/logout, вернуть старый статус
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int) -> Optional[AuthStatus]:
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(telegram_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[1]
+
+    def _put(self, telegram_id: int, status: AuthStatus):
+        self._entries[telegram_id] = (time.monotonic() + self.ttl, status)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set(self, telegram_id: int, status: AuthStatus):
+        with self._lock:
+            self.epoch += 1
+            self._put(telegram_id, status)
+
+    def fill(self, telegram_id: int, status: AuthStatus, epoch: int):
+        with self._lock:
+            if epoch == self.epoch:
+                self._put(telegram_id, status)
+
+    def invalidate(self, telegram_id: int):
+        with self._lock:
+            self.epoch += 1
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _status_from_row(row) -> AuthStatus:
+    if not row:
+        return ANONYMOUS
+    return AuthStatus(is_authorized=bool(row['is_authorized']), is_admin=row['role'] == 'admin')
+
+
 class AuthService(ABC):
     @abstractmethod
     def login(self, telegram_id: int, password: str) -> bool:
         pass
 
+    @abstractmethod
+    def get_status(self, telegram_id: int) -> AuthStatus:
+        pass
+
     @abstractmethod
     def is_authorized(self, telegram_id: int) -> bool:
         pass
@@ -22,88 +130,160 @@ class AuthService(ABC):
     def logout(self, telegram_id: int) -> bool:
         pass
 
+    @abstractmethod
+    async def alogin(self, telegram_id: int, password: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def aget_status(self, telegram_id: int) -> AuthStatus:
+        pass
+
+    @abstractmethod
+    async def ais_authorized(self, telegram_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def ais_admin(self, telegram_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def alogout(self, telegram_id: int) -> bool:
+        pass
+
+
 class PostgresAuthService(AuthService):
     def __init__(self):
-        self.db = DatabaseConnection()
+        self.pool = get_pool()
+        self.async_pool = get_async_pool()
+        self.cache = AuthCache(settings.AUTH_CACHE_TTL, settings.AUTH_CACHE_MAX_SIZE)
+
+        listener = get_listener()
+        listener.subscribe(AUTH_CHANNEL, self._on_notify)
+        listener.on_reconnect(self._on_reconnect)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    async def _on_notify(self, payload: str):
+        try:
+            self.cache.invalidate(int(payload))
+        except ValueError:
+            logger.warning(f"Ignoring malformed auth notification '{payload}'")
+
+    async def _on_reconnect(self):
+        # Уведомления, пришедшие пока слушатель был отключён, потеряны
+        self.cache.clear()
 
     def login(self, telegram_id: int, password: str) -> bool:
         if password != settings.ADMIN_PASSWORD:
             logger.warning(f"Failed login attempt for telegram_id {telegram_id}")
             return False
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO users (telegram_id, is_authorized, role)
-                    VALUES (%s, TRUE, 'admin')
-                    ON CONFLICT (telegram_id)
-                    DO UPDATE SET is_authorized = TRUE, role = 'admin'
-                    RETURNING id
-                    """,
-                    (telegram_id,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                logger.info(f"User {telegram_id} logged in successfully")
-                return result is not None
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(LOGIN_SQL, (telegram_id,))
+                    result = cur.fetchone()
+                    cur.execute(NOTIFY_SQL, (AUTH_CHANNEL, str(telegram_id)))
+                    conn.commit()
+            self.cache.set(telegram_id, ADMIN)
+            logger.info(f"User {telegram_id} logged in successfully")
+            return result is not None
         except Exception as e:
+            self.cache.invalidate(telegram_id)
             logger.error(f"Error during login for telegram_id {telegram_id}: {e}")
             return False
-        finally:
-            self.db.close()
+
+    def get_status(self, telegram_id: int) -> AuthStatus:
+        status = self.cache.get(telegram_id)
+        if status is not None:
+            return status
+        epoch = self.cache.epoch
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(STATUS_SQL, (telegram_id,))
+                    status = _status_from_row(cur.fetchone())
+        except Exception as e:
+            logger.error(f"Error checking auth status for telegram_id {telegram_id}: {e}")
+            return ANONYMOUS
+        self.cache.fill(telegram_id, status, epoch)
+        return status
 
     def is_authorized(self, telegram_id: int) -> bool:
+        return self.get_status(telegram_id).is_authorized
+
+    def is_admin(self, telegram_id: int) -> bool:
+        return self.get_status(telegram_id).is_admin
+
+    def logout(self, telegram_id: int) -> bool:
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT is_authorized FROM users WHERE telegram_id = %s",
-                    (telegram_id,)
-                )
-                result = cur.fetchone()
-                return result['is_authorized'] if result else False
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(LOGOUT_SQL, (telegram_id,))
+                    result = cur.fetchone()
+                    cur.execute(NOTIFY_SQL, (AUTH_CHANNEL, str(telegram_id)))
+                    conn.commit()
+            self.cache.set(telegram_id, ANONYMOUS)
+            logger.info(f"User {telegram_id} logged out successfully")
+            return result is not None
         except Exception as e:
-            logger.error(f"Error checking authorization for telegram_id {telegram_id}: {e}")
+            self.cache.invalidate(telegram_id)
+            logger.error(f"Error during logout for telegram_id {telegram_id}: {e}")
             return False
-        finally:
-            self.db.close()
 
-    def is_admin(self, telegram_id: int) -> bool:
+    async def alogin(self, telegram_id: int, password: str) -> bool:
+        if password != settings.ADMIN_PASSWORD:
+            logger.warning(f"Failed login attempt for telegram_id {telegram_id}")
+            return False
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT role FROM users WHERE telegram_id = %s",
-                    (telegram_id,)
-                )
-                result = cur.fetchone()
-                return result['role'] == 'admin' if result else False
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(LOGIN_SQL, (telegram_id,))
+                    result = await cur.fetchone()
+                    await cur.execute(NOTIFY_SQL, (AUTH_CHANNEL, str(telegram_id)))
+                    await conn.commit()
+            self.cache.set(telegram_id, ADMIN)
+            logger.info(f"User {telegram_id} logged in successfully")
+            return result is not None
         except Exception as e:
-            logger.error(f"Error checking admin status for telegram_id {telegram_id}: {e}")
+            self.cache.invalidate(telegram_id)
+            logger.error(f"Error during login for telegram_id {telegram_id}: {e}")
             return False
-        finally:
-            self.db.close()
 
-    def logout(self, telegram_id: int) -> bool:
+    async def aget_status(self, telegram_id: int) -> AuthStatus:
+        status = self.cache.get(telegram_id)
+        if status is not None:
+            return status
+        epoch = self.cache.epoch
+        try:
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(STATUS_SQL, (telegram_id,))
+                    status = _status_from_row(await cur.fetchone())
+        except Exception as e:
+            logger.error(f"Error checking auth status for telegram_id {telegram_id}: {e}")
+            return ANONYMOUS
+        self.cache.fill(telegram_id, status, epoch)
+        return status
+
+    async def ais_authorized(self, telegram_id: int) -> bool:
+        return (await self.aget_status(telegram_id)).is_authorized
+
+    async def ais_admin(self, telegram_id: int) -> bool:
+        return (await self.aget_status(telegram_id)).is_admin
+
+    async def alogout(self, telegram_id: int) -> bool:
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    UPDATE users
-                    SET is_authorized = FALSE, role = 'user'
-                    WHERE telegram_id = %s
-                    RETURNING telegram_id
-                    """,
-                    (telegram_id,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                logger.info(f"User {telegram_id} logged out successfully")
-                return result is not None
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(LOGOUT_SQL, (telegram_id,))
+                    result = await cur.fetchone()
+                    await cur.execute(NOTIFY_SQL, (AUTH_CHANNEL, str(telegram_id)))
+                    await conn.commit()
+            self.cache.set(telegram_id, ANONYMOUS)
+            logger.info(f"User {telegram_id} logged out successfully")
+            return result is not None
         except Exception as e:
+            self.cache.invalidate(telegram_id)
             logger.error(f"Error during logout for telegram_id {telegram_id}: {e}")
             return False
-        finally:
-            self.db.close()
\ No newline at end of file
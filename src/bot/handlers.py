@@ -8,17 +8,27 @@ from telegram.ext import ContextTypes, ConversationHandler
 from src.knowledge_base.knowledge_service import KnowledgeService
 from src.auth.auth_service import AuthService
 from src.bot.middleware import admin_required
+from src.bot.streaming import StreamingReply
+from src.bot.session_scheduler import SessionScheduler, Turn
 from src.bot.states import BotState, WAITING_CSV
-from src.prompt.prompt_service import PostgresPromptService
+from src.prompt.prompt_service import PromptService
 from src.config.settings import settings
+from src.tracing.tracer import span
+from src.admission.limiter import AdmissionRejected, admission_overloaded
 
 logger = logging.getLogger(__name__)
 
+HIGH_LOAD_MESSAGE = "Зараз дуже високе навантаження 🙏 Будь ласка, повторіть запитання за хвилину."
+
+
+def user_session_id(user_id: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"telegram-user-{user_id}"))
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     auth_service: AuthService = context.bot_data["auth_service"]
-    auth_service.logout(user_id)
+    await auth_service.alogout(user_id)
     context.user_data.clear()
     await update.message.reply_text(
         "Вітаємо в чат-боті Aquapolis! Напишіть, що вас цікавить",
@@ -244,6 +254,8 @@ async def kb_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"🔨 Індекс створено: `{built_at}`\n"
                 f"📅 CSV змінено: `{csv_mtime}`\n"
             )
+            if meta.get("generation"):
+                status_text += f"🔢 Версія: `{meta['generation']}`\n"
         
         await update.message.reply_text(
             status_text,
@@ -257,17 +269,36 @@ async def kb_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def _reply_when_ready(update: Update, query_coro):
+    """Ответ целиком одним сообщением; пока он готовится — «печатает…»"""
+    query_task = asyncio.create_task(query_coro)
+
+    while not query_task.done():
+        await update.message.chat.send_action("typing")
+        await asyncio.wait({query_task}, timeout=4)
+
+    response = await query_task
+    await update.message.chat.send_action("typing")
+    with span("telegram.send", chars=len(response)) as send_span:
+        try:
+            await update.message.reply_text(response, parse_mode="Markdown")
+        except Exception as e:
+            logger.error(f"Failed to send response: {e}")
+            send_span.set_attribute("markdown_fallback", True)
+            await update.message.reply_text(response)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     query = update.message.text
-    session_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"telegram-user-{user_id}"))
+    session_id = user_session_id(user_id)
     logger.info(f"Processing message from user {user_id}: {query}")
 
     auth_service: AuthService = context.bot_data["auth_service"]
 
     if query == "Повернутися до помічника":
         logger.info(f"User {user_id} requested to return to assistant")
-        auth_service.logout(user_id)
+        await auth_service.alogout(user_id)
         context.user_data.clear()
         await start(update, context)
         return
@@ -300,8 +331,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Обработка кнопки "Переглянути промт"
     if query == "Переглянути промт":
-        prompt_service = PostgresPromptService()
-        current_prompt = prompt_service.get_current_prompt()
+        prompt_service: PromptService = context.bot_data["prompt_service"]
+        current_prompt = await prompt_service.aget_current_prompt()
         reply_keyboard = get_admin_keyboard()
         
         if len(current_prompt) > 4000:
@@ -323,9 +354,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if context.user_data.get(BotState.AWAITING_PASSWORD.value):
-        if auth_service.login(user_id, query):
+        if await auth_service.alogin(user_id, query):
             context.user_data.clear()
-            logger.info(f"User {user_id} logged in as admin: {auth_service.is_admin(user_id)}")
+            logger.info(f"User {user_id} logged in as admin: {await auth_service.ais_admin(user_id)}")
             reply_keyboard = get_admin_keyboard()
             await update.message.reply_text(
                 "Авторизація успішна! Ви отримали права адміністратора.",
@@ -366,7 +397,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             knowledge_service: KnowledgeService = context.bot_data["knowledge_service"]
             try:
-                if knowledge_service.update_prompt(formatted_prompt):
+                if await knowledge_service.aupdate_prompt(formatted_prompt):
                     context.user_data.clear()
                     reply_keyboard = get_admin_keyboard()
                     await update.message.reply_text(
@@ -416,8 +447,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if auth_service.is_authorized(user_id) and auth_service.is_admin(user_id):
-        logger.info(f"User {user_id} is admin: {auth_service.is_admin(user_id)}")
+    auth_status = await auth_service.aget_status(user_id)
+    if auth_status.is_authorized and auth_status.is_admin:
+        logger.info(f"User {user_id} is admin: {auth_status.is_admin}")
         reply_keyboard = get_admin_keyboard()
         await update.message.reply_text(
             "Будь ласка, оберіть дію:",
@@ -425,40 +457,60 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    # Ход выполняется в очереди сессии: хендлер не ждёт ответа, и следующие сообщения пользователя
+    # успевают склеиться с ходом, который ещё не начат
+    scheduler: SessionScheduler = context.bot_data["session_scheduler"]
+    if scheduler.submit(session_id, query, update, context):
+        logger.info(f"Message from user {user_id} merged into the queued turn of session {session_id}")
+
+
+async def answer_turn(session_id: str, turn: Turn):
+    """Отвечает на ход из SessionScheduler: STEP 1–3 по склеенному тексту, ответ — на последнее сообщение"""
+    update, context = turn.update, turn.context
+    user_id = update.effective_user.id
+    query = turn.text
     knowledge_service: KnowledgeService = context.bot_data["knowledge_service"]
-    loop = asyncio.get_event_loop()
-    query_task = loop.run_in_executor(
-        None,
-        lambda: knowledge_service.process_query(query, session_id)
-    )
 
-    while not query_task.done():
-        await update.message.chat.send_action("typing")
-        await asyncio.sleep(4)
+    # Корневой span хода диалога: STEP 1–3, история, LLM и отправка в Telegram — дочерние
+    with span("telegram.turn", user_id=user_id, session_id=session_id, query_chars=len(query),
+              messages=len(turn.texts), streaming=settings.STREAM_RESPONSES) as turn_span:
+        # Очередь к провайдеру уже длиннее допустимого — отвечаем сразу, не начиная STEP 1
+        overloaded = admission_overloaded()
+        if overloaded:
+            turn_span.set_attribute("rejected", overloaded)
+            logger.warning(f"Rejecting turn for user {user_id}: {overloaded} queue is over the admission limit")
+            await update.message.reply_text(HIGH_LOAD_MESSAGE)
+            return
 
-    try:
-        response = await query_task
-        await update.message.chat.send_action("typing")
         try:
-            await update.message.reply_text(response, parse_mode="Markdown")
-        except Exception as e:
-            logger.error(f"Failed to send response: {e}")
-            await update.message.reply_text(response)
+            if settings.STREAM_RESPONSES:
+                response = await StreamingReply(update.message).run(
+                    knowledge_service.astream_query(query, session_id)
+                )
+                if not response:
+                    raise RuntimeError("Empty streamed response")
+            else:
+                await _reply_when_ready(update, knowledge_service.aprocess_query(query, session_id))
             
-        if settings.DEBUG_CONTEXT_TRIM_NOTIFY:
-            try:
-                trimmed = await knowledge_service.get_and_clear_trim_count(session_id)
-            except (AttributeError, TypeError):
-                trimmed = 0
-            if trimmed > 0:
-                note = "⚠️ Контекстне вікно досягло ліміту та було очищено (видалено перші 500 слів)"
-                if trimmed > 1:
-                    note += f" ×{trimmed}"
-                await update.message.reply_text(note)
+            if settings.DEBUG_CONTEXT_TRIM_NOTIFY:
+                try:
+                    trimmed = await knowledge_service.get_and_clear_trim_count(session_id)
+                except (AttributeError, TypeError):
+                    trimmed = 0
+                if trimmed > 0:
+                    note = "⚠️ Контекстне вікно досягло ліміту та було очищено (видалено перші 500 слів)"
+                    if trimmed > 1:
+                        note += f" ×{trimmed}"
+                    await update.message.reply_text(note)
                 
-    except Exception as e:
-        logger.error(f"Error processing query for user {user_id}: {e}")
-        await update.message.reply_text("Вибачте, сталася помилка. Спробуйте ще раз.")
+        except AdmissionRejected as e:
+            turn_span.set_attribute("rejected", e.resource)
+            logger.warning(f"Turn for user {user_id} rejected mid-pipeline: {e}")
+            await update.message.reply_text(HIGH_LOAD_MESSAGE)
+        except Exception as e:
+            turn_span.record_exception(e)
+            logger.error(f"Error processing query for user {user_id}: {e}")
+            await update.message.reply_text("Вибачте, сталася помилка. Спробуйте ще раз.")
 
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -482,9 +534,9 @@ async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     password = args[0]
     auth_service: AuthService = context.bot_data["auth_service"]
-    if auth_service.login(telegram_id, password):
+    if await auth_service.alogin(telegram_id, password):
         context.user_data.clear()
-        logger.info(f"User {telegram_id} logged in as admin: {auth_service.is_admin(telegram_id)}")
+        logger.info(f"User {telegram_id} logged in as admin: {await auth_service.ais_admin(telegram_id)}")
         reply_keyboard = get_admin_keyboard()
         await update.message.reply_text(
             "Авторизація успішна! Ви отримали права адміністратора.",
@@ -507,7 +559,7 @@ async def change_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @admin_required
 async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    session_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"telegram-user-{user_id}"))
+    session_id = user_session_id(user_id)
     logger.info(f"Clearing history for user {user_id} with session_id {session_id}")
 
     try:
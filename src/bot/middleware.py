@@ -8,7 +8,8 @@ def admin_required(handler):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         auth_service: AuthService = context.bot_data["auth_service"]
         telegram_id = update.effective_user.id
-        if not auth_service.is_authorized(telegram_id) or not auth_service.is_admin(telegram_id):
+        auth_status = await auth_service.aget_status(telegram_id)
+        if not auth_status.is_authorized or not auth_status.is_admin:
             await update.message.reply_text("Ви не авторизовані або не маєте прав адміністратора.")
             return
         return await handler(update, context)
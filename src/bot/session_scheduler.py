@@ -0,0 +1,101 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """Один ход диалога: одно сообщение пользователя или несколько, склеенных пока ход ждал очереди"""
+
+    def __init__(self, text: str, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        self.texts: List[str] = [text]
+        self.update = update
+        self.context = context
+        self.created_at = time.monotonic()
+
+    def add(self, text: str, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self.texts.append(text)
+        # Отвечаем на последнее сообщение пачки
+        self.update = update
+        self.context = context
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+
+class _SessionQueue:
+    def __init__(self):
+        self.pending: Deque[Turn] = deque()
+        self.worker: Optional[asyncio.Task] = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+class SessionScheduler:
+    """Ходы одной сессии выполняются строго по очереди, разные сессии — параллельно.
+
+    Сообщение, пришедшее пока предыдущий ход сессии ещё не начат, дописывается в него (не позже
+    coalesce_window секунд от первого сообщения хода и не больше max_messages сообщений) —
+    LLM-конвейер и запись в историю выполняются один раз на всю пачку.
+    """
+
+    def __init__(self, runner: Callable[[str, Turn], Awaitable[None]], coalesce_window: float, max_messages: int,
+                 create_task: Callable[[Awaitable], asyncio.Task] = asyncio.create_task):
+        self.runner = runner
+        self.coalesce_window = coalesce_window
+        self.max_messages = max_messages
+        self._create_task = create_task
+        self._sessions: Dict[str, _SessionQueue] = {}
+        self.turns = 0
+        self.coalesced = 0
+
+    def submit(self, session_id: str, text: str, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Ставит сообщение в очередь сессии; True, если оно склеено с ожидающим ходом"""
+        session = self._sessions.setdefault(session_id, _SessionQueue())
+        queued = session.pending[-1] if session.pending else None
+        if (queued is not None
+                and len(queued.texts) < self.max_messages
+                and time.monotonic() - queued.created_at <= self.coalesce_window):
+            queued.add(text, update, context)
+            self.coalesced += 1
+            return True
+
+        session.pending.append(Turn(text, update, context))
+        if session.worker is None:
+            session.idle.clear()
+            session.worker = self._create_task(self._drain(session_id, session))
+        return False
+
+    async def _drain(self, session_id: str, session: _SessionQueue) -> None:
+        try:
+            while session.pending:
+                turn = session.pending.popleft()
+                self.turns += 1
+                try:
+                    await self.runner(session_id, turn)
+                except Exception as e:
+                    logger.error(f"Turn for session {session_id} failed: {e}")
+        finally:
+            session.worker = None
+            session.idle.set()
+            if self._sessions.get(session_id) is session and not session.pending:
+                del self._sessions[session_id]
+
+    async def wait_idle(self, session_id: str) -> None:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            await session.idle.wait()
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self._sessions),
+            "queued_turns": sum(len(s.pending) for s in self._sessions.values()),
+            "turns": self.turns,
+            "coalesced_messages": self.coalesced,
+        }
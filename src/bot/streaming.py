@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List
+from telegram import Message, constants
+from telegram.error import BadRequest, RetryAfter
+from src.config.settings import settings
+from src.tracing.tracer import span
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = constants.MessageLimit.MAX_TEXT_LENGTH
+TYPING_INTERVAL = 4
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Части не длиннее limit, по возможности по границе абзаца или строки"""
+    parts = []
+    while len(text) > limit:
+        cut = max(text.rfind("\n\n", 0, limit), text.rfind("\n", 0, limit))
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """Ответ, который дописывается редактированием сообщения по мере генерации.
+
+    Правки идут не чаще раза в edit_interval секунд, текст длиннее лимита Telegram
+    продолжается в новых сообщениях, Markdown применяется только в финальной правке
+    (незакрытая разметка в середине генерации не парсится).
+    """
+
+    def __init__(self, message: Message, edit_interval: float = None):
+        self.message = message
+        self.edit_interval = edit_interval if edit_interval is not None else settings.STREAM_EDIT_INTERVAL
+        self._sent: List[Message] = []
+        self._shown: List[str] = []
+        self._paused_until = 0.0
+
+    async def _send_or_edit(self, i: int, text: str, parse_mode=None) -> None:
+        edit = i < len(self._sent)
+        with span("telegram.edit" if edit else "telegram.send", part=i, chars=len(text), markdown=parse_mode is not None):
+            if edit:
+                await self._sent[i].edit_text(text, parse_mode=parse_mode)
+            else:
+                self._sent.append(await self.message.reply_text(text, parse_mode=parse_mode))
+        if i < len(self._shown):
+            self._shown[i] = text
+        else:
+            self._shown.append(text)
+
+    async def _update(self, text: str) -> None:
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._paused_until:
+            return
+        for i, part in enumerate(split_message(text)):
+            if i < len(self._shown) and self._shown[i] == part:
+                continue
+            try:
+                await self._send_or_edit(i, part)
+            except RetryAfter as e:
+                logger.warning(f"Telegram flood control, pausing message edits for {e.retry_after}s")
+                self._paused_until = loop.time() + float(e.retry_after)
+                return
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+
+    async def _send_final(self, i: int, part: str, retry: bool = True) -> None:
+        try:
+            await self._send_or_edit(i, part, parse_mode=constants.ParseMode.MARKDOWN)
+        except RetryAfter as e:
+            if not retry:
+                raise
+            await asyncio.sleep(float(e.retry_after))
+            await self._send_final(i, part, retry=False)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            logger.error(f"Failed to apply Markdown to streamed response: {e}")
+            if i >= len(self._shown) or self._shown[i] != part:
+                await self._send_or_edit(i, part)
+
+    async def _finalize(self, text: str) -> None:
+        for i, part in enumerate(split_message(text)):
+            try:
+                await self._send_final(i, part)
+            except Exception as e:
+                logger.error(f"Failed to finalize streamed response part {i + 1}: {e}")
+
+    async def run(self, chunks: AsyncIterator[str]) -> str:
+        """Читает chunks до конца и возвращает полный текст; исключение генерации пробрасывается"""
+        parts: List[str] = []
+        has_text = asyncio.Event()
+
+        async def consume():
+            async for chunk in chunks:
+                parts.append(chunk)
+                has_text.set()
+
+        task = asyncio.create_task(consume())
+        first_chunk = asyncio.create_task(has_text.wait())
+        try:
+            while not task.done():
+                if parts:
+                    await self._update("".join(parts))
+                    await asyncio.wait({task}, timeout=self.edit_interval)
+                else:
+                    # До первого токена (STEP 1–2) показываем «печатает…»
+                    await self.message.chat.send_action(constants.ChatAction.TYPING)
+                    await asyncio.wait({task, first_chunk}, timeout=TYPING_INTERVAL,
+                                       return_when=asyncio.FIRST_COMPLETED)
+            await task
+        finally:
+            for pending in (task, first_chunk):
+                if not pending.done():
+                    pending.cancel()
+
+        text = "".join(parts)
+        if text:
+            await self._finalize(text)
+        return text
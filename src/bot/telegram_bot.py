@@ -1,21 +1,57 @@
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, filters
+import signal
+import asyncio
+import logging
+from telegram import Bot, Update
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CommandHandler, MessageHandler, ConversationHandler, filters
+)
 from src.bot.handlers import (
     start, handle_message, handle_document, login, change_prompt, clear_history,
-    kb_upload, kb_status, handle_csv_document, cancel_upload
+    kb_upload, kb_status, handle_csv_document, cancel_upload, answer_turn
 )
+from src.bot.session_scheduler import SessionScheduler
+from src.bot.update_processor import create_update_processor
+from src.bot.webhook import WebhookServer
 from src.bot.states import WAITING_CSV
 from src.knowledge_base.knowledge_service import KnowledgeService
 from src.auth.auth_service import AuthService, PostgresAuthService
+from src.prompt.prompt_service import PromptService
+from src.database.db_connection import close_pools, pool_stats
+from src.database.notifications import get_listener
+from src.config.settings import settings
+from src.tracing.tracer import shutdown_tracing
+from src.admission.limiter import limiter_stats
+
+logger = logging.getLogger(__name__)
+
 
 class TelegramBot:
-    def __init__(self, token: str, knowledge_service: KnowledgeService, auth_service: AuthService):
-        self.app = Application.builder().token(token).build()
+    def __init__(self, token: str, knowledge_service: KnowledgeService, auth_service: AuthService,
+                 prompt_service: PromptService, bot: Bot = None, update_processor: BaseUpdateProcessor = None):
+        builder = (
+            Application.builder()
+            .post_init(self._startup)
+            .post_shutdown(self._shutdown)
+        )
+        # Готовый bot и свой обработчик очереди апдейтов подставляет нагрузочный бенчмарк
+        builder = builder.bot(bot) if bot is not None else builder.token(token)
+        self.update_processor = update_processor or create_update_processor()
+        self.app = builder.concurrent_updates(self.update_processor).build()
         self.knowledge_service = knowledge_service
         self.auth_service = auth_service
+        self.prompt_service = prompt_service
 
     def setup(self):
         self.app.bot_data["knowledge_service"] = self.knowledge_service
         self.app.bot_data["auth_service"] = self.auth_service
+        self.app.bot_data["prompt_service"] = self.prompt_service
+        # Ходы запускаются задачами Application: stop() дождётся их завершения
+        self.app.bot_data["session_scheduler"] = SessionScheduler(
+            answer_turn,
+            settings.SESSION_COALESCE_WINDOW,
+            settings.SESSION_COALESCE_MAX_MESSAGES,
+            create_task=self.app.create_task
+        )
         self.app.add_handler(CommandHandler("start", start))
         self.app.add_handler(CommandHandler("login", login))
         self.app.add_handler(CommandHandler("change_prompt", change_prompt))
@@ -39,6 +75,75 @@ class TelegramBot:
         
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    async def _startup(self, app: Application):
+        await get_listener().start()
+
+    async def _shutdown(self, app: Application):
+        await get_listener().stop()
+        await close_pools()
+        shutdown_tracing()
+
+    def health(self) -> dict:
+        stats = {"ok": self.app.running, "mode": settings.BOT_MODE, "update_queue": self.app.update_queue.qsize()}
+        if hasattr(self.update_processor, "stats"):
+            stats["updates"] = self.update_processor.stats()
+        stats["sessions"] = self.app.bot_data["session_scheduler"].stats()
+        stats["admission"] = limiter_stats()
+        kb_sync = getattr(self.knowledge_service, "kb_sync", None)
+        if kb_sync is not None:
+            stats["knowledge_base"] = kb_sync.stats()
+        try:
+            stats["db_pools"] = pool_stats()
+        except Exception as e:
+            stats["db_pools"] = {"error": str(e)}
+        return stats
+
+    async def _run_webhook(self):
+        """Жизненный цикл как у run_polling, но апдейты приходят через HTTP-сервер"""
+        if not settings.WEBHOOK_SECRET_TOKEN:
+            if not settings.WEBHOOK_ALLOW_UNAUTHENTICATED:
+                raise RuntimeError(
+                    "WEBHOOK_SECRET_TOKEN is required in webhook mode "
+                    "(set WEBHOOK_ALLOW_UNAUTHENTICATED=true to accept unauthenticated requests)"
+                )
+            logger.warning("WEBHOOK_SECRET_TOKEN is empty: webhook requests are not authenticated")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = WebhookServer(
+            self.app,
+            settings.WEBHOOK_PATH,
+            settings.WEBHOOK_SECRET_TOKEN,
+            self.health,
+            settings.HEALTH_PATH
+        )
+        await self.app.initialize()
+        try:
+            await self._startup(self.app)
+            await self.app.start()
+            server.start(settings.WEBHOOK_LISTEN, settings.WEBHOOK_PORT)
+            if settings.WEBHOOK_URL:
+                # Все реплики регистрируют один и тот же адрес — повторный вызов ничего не меняет
+                await self.app.bot.set_webhook(
+                    url=f"{settings.WEBHOOK_URL.rstrip('/')}/{settings.WEBHOOK_PATH.strip('/')}",
+                    secret_token=settings.WEBHOOK_SECRET_TOKEN or None,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                )
+            await stop.wait()
+        finally:
+            await server.stop()
+            if self.app.running:
+                await self.app.stop()
+            await self.app.shutdown()
+            await self._shutdown(self.app)
+
     def run(self):
         self.setup()
-        self.app.run_polling()
\ No newline at end of file
+        if settings.BOT_MODE == "webhook":
+            asyncio.run(self._run_webhook())
+        else:
+            self.app.run_polling()
\ No newline at end of file
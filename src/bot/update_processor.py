@@ -0,0 +1,63 @@
+import asyncio
+from typing import Dict, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from src.config.settings import settings
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """До max_concurrent_updates апдейтов обрабатываются параллельно; при ordered апдейты
+    одного чата — строго в порядке получения, чтобы многошаговые сценарии (ввод промта частями,
+    загрузка CSV) не перемешивались. Долгий ход одного пользователя не задерживает остальных.
+    """
+
+    def __init__(self, max_concurrent_updates: int, ordered: bool = True):
+        super().__init__(max_concurrent_updates)
+        self.ordered = ordered
+        # chat_id → [lock, сколько апдейтов чата в обработке или ожидании]
+        self._chats: Dict[int, list] = {}
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # Апдейт ждёт своей очереди в чате до того, как занять слот семафора: иначе долгий сценарий
+        # одного чата (загрузка CSV) с пачкой сообщений за ним выбрал бы все UPDATE_CONCURRENCY слотов
+        chat_id = self._chat_id(update) if self.ordered else None
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent_updates": self.max_concurrent_updates,
+            "ordered": self.ordered,
+            "chats_in_flight": len(self._chats),
+            "waiting_for_chat": sum(entry[1] - 1 for entry in self._chats.values()),
+        }
+
+
+def create_update_processor() -> ChatOrderedUpdateProcessor:
+    return ChatOrderedUpdateProcessor(settings.UPDATE_CONCURRENCY, settings.UPDATE_CHAT_ORDERING)
@@ -0,0 +1,71 @@
+import hmac
+import json
+import logging
+from typing import Callable
+from tornado.httpserver import HTTPServer
+from tornado.web import Application as WebApplication, RequestHandler
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class TelegramWebhookHandler(RequestHandler):
+    """Принимает апдейт от Telegram и ставит его в очередь Application; обработка — асинхронно"""
+
+    def initialize(self, app: Application, secret_token: str):
+        self.app = app
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and not hmac.compare_digest(
+            self.request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            logger.warning(f"Rejected webhook request from {self.request.remote_ip}: bad secret token")
+            self.set_status(403)
+            return
+
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.app.bot)
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook payload: {e}")
+            self.set_status(400)
+            return
+
+        await self.app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(RequestHandler):
+    def initialize(self, health: Callable[[], dict]):
+        self.health = health
+
+    def get(self):
+        status = self.health()
+        self.set_status(200 if status.get("ok") else 503)
+        self.write(status)
+
+
+class WebhookServer:
+    """HTTP-сервер webhook-режима: POST /<path> от Telegram и GET /health для балансировщика"""
+
+    def __init__(self, app: Application, path: str, secret_token: str, health: Callable[[], dict],
+                 health_path: str = "/health"):
+        self.web_app = WebApplication([
+            (f"/{path.strip('/')}", TelegramWebhookHandler, {"app": app, "secret_token": secret_token}),
+            (health_path, HealthHandler, {"health": health}),
+        ])
+        self._server = None
+
+    def start(self, listen: str, port: int) -> None:
+        self._server = HTTPServer(self.web_app, xheaders=True)
+        self._server.listen(port, address=listen)
+        logger.info(f"Webhook server listening on {listen}:{port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
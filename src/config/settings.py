@@ -5,6 +5,24 @@ load_dotenv()
 
 class Settings:
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+    # polling — getUpdates из одного процесса; webhook — HTTP-сервер, можно несколько реплик за балансировщиком
+    BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+    # Публичный адрес без пути; пусто — webhook в Telegram регистрируется вне бота
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    # Без секрета любой, кто достучится до адреса, подделает апдейт от имени администратора —
+    # webhook-режим без него не стартует, если явно не разрешено WEBHOOK_ALLOW_UNAUTHENTICATED
+    WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+    WEBHOOK_ALLOW_UNAUTHENTICATED = os.getenv("WEBHOOK_ALLOW_UNAUTHENTICATED", "false").lower() == "true"
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    HEALTH_PATH = os.getenv("HEALTH_PATH", "/health")
+
+    # Параллельная обработка апдейтов; UPDATE_CHAT_ORDERING — апдейты одного чата по порядку
+    UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+    UPDATE_CHAT_ORDERING = os.getenv("UPDATE_CHAT_ORDERING", "true").lower() == "true"
     DB_CONFIG = {
         "host": os.getenv("DB_HOST"),
         "port": os.getenv("DB_PORT"),
@@ -14,6 +32,19 @@ class Settings:
     }
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+    DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+    DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+    DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+    HISTORY_POOL_MIN_SIZE = int(os.getenv("HISTORY_POOL_MIN_SIZE", "2"))
+    HISTORY_POOL_MAX_SIZE = int(os.getenv("HISTORY_POOL_MAX_SIZE", "20"))
+
+    AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+    AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "10000"))
+
+    LISTEN_RECONNECT_DELAY = float(os.getenv("LISTEN_RECONNECT_DELAY", "5"))
+
     CSV_DIR = os.getenv("CSV_DIR", "/pdf_files")
     CSV_FILE_NAME = os.getenv("CSV_FILE_NAME", "knowledge.csv")
     CSV_FILE_PATH = os.getenv("CSV_FILE_PATH", os.path.join(CSV_DIR, CSV_FILE_NAME))
@@ -21,17 +52,69 @@ class Settings:
     FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "/app/faiss_index")
     FAISS_INDEX_TMP = os.getenv("FAISS_INDEX_TMP", "/app/faiss_index_tmp")
 
+    # Поколения базы знаний в Postgres: пересборка под advisory lock, остальные реплики подхватывают
+    # новый индекс по NOTIFY. KB_GENERATIONS_KEEP — сколько последних поколений хранить в БД
+    KB_SYNC_ENABLED = os.getenv("KB_SYNC_ENABLED", "true").lower() == "true"
+    KB_REBUILD_LOCK_TIMEOUT = float(os.getenv("KB_REBUILD_LOCK_TIMEOUT", "600"))
+    KB_GENERATIONS_KEEP = int(os.getenv("KB_GENERATIONS_KEEP", "3"))
+
     TEMP_CSV_DIR = os.getenv("TEMP_CSV_DIR", os.path.join(CSV_DIR, "temp"))
     BACKUP_CSV_DIR = os.getenv("BACKUP_CSV_DIR", os.path.join(CSV_DIR, "backup"))
 
     MAX_CSV_SIZE_MB = int(os.getenv("MAX_CSV_SIZE_MB", "10"))
     EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "text-embedding-3-small")
 
+    EMBEDDINGS_CACHE_ENABLED = os.getenv("EMBEDDINGS_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDINGS_CACHE_PATH = os.getenv("EMBEDDINGS_CACHE_PATH", "/app/embeddings_cache")
+    EMBEDDINGS_CACHE_MAX_MB = int(os.getenv("EMBEDDINGS_CACHE_MAX_MB", "512"))
+    QUERY_EMBEDDINGS_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDINGS_CACHE_SIZE", "2000"))
+
+    # hybrid — BM25 + FAISS (RRF), vector — только FAISS, lexical — только BM25 (без эмбеддингов)
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+    RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+    RETRIEVAL_VECTOR_TIMEOUT = float(os.getenv("RETRIEVAL_VECTOR_TIMEOUT", "5"))
+    RETRIEVAL_LEXICAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_LEXICAL_MAX_TOKENS", "3"))
+
     LC_CHAT_HISTORY_TABLE_NAME = os.getenv("LC_CHAT_HISTORY_TABLE_NAME")
     LC_DATABASE_URL = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
     ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
     DEBUG_CONTEXT_TRIM_NOTIFY = False
+
+    STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+    # Сообщения, пришедшие пока ход сессии ждёт очереди, склеиваются в один запрос (0 — не склеивать)
+    SESSION_COALESCE_WINDOW = float(os.getenv("SESSION_COALESCE_WINDOW", "3"))
+    SESSION_COALESCE_MAX_MESSAGES = int(os.getenv("SESSION_COALESCE_MAX_MESSAGES", "5"))
+
+    # Трейсинг ходов диалога: none, jsonl, otlp (через запятую)
+    TRACING_EXPORTERS = [e.strip().lower() for e in os.getenv("TRACING_EXPORTERS", "none").split(",") if e.strip()]
+    TRACING_JSONL_PATH = os.getenv("TRACING_JSONL_PATH", "/app/traces/spans.jsonl")
+    TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "aqp-tg-bot")
+    TRACING_FLUSH_INTERVAL = float(os.getenv("TRACING_FLUSH_INTERVAL", "2"))
+
+    DOSAGE_MAX_CONCURRENCY = int(os.getenv("DOSAGE_MAX_CONCURRENCY", "4"))
+
+    # Бюджеты провайдера в минуту (0 — без ограничения). Интерактивный запрос, которому пришлось бы ждать
+    # бюджета дольше ADMISSION_MAX_WAIT секунд, сразу получает ответ о высокой нагрузке.
+    # Бюджет считается в каждом процессе отдельно: лимиты задаются на весь аккаунт провайдера
+    # и делятся поровну на ADMISSION_REPLICAS реплик (webhook-режим за балансировщиком)
+    ADMISSION_REPLICAS = max(1, int(os.getenv("ADMISSION_REPLICAS", "1")))
+    LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+    LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+    LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "400"))
+    EMBEDDINGS_RPM = int(os.getenv("EMBEDDINGS_RPM", "0"))
+    EMBEDDINGS_TPM = int(os.getenv("EMBEDDINGS_TPM", "0"))
+    ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "15"))
+    DOSAGE_LOOKUP_TIMEOUT = float(os.getenv("DOSAGE_LOOKUP_TIMEOUT", "30"))
+
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1000"))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+    PRODUCTS_CACHE_MAX_SIZE = int(os.getenv("PRODUCTS_CACHE_MAX_SIZE", "2000"))
     
     PRODUCTS_PROMPT =  """
         Ти є експертом з хімії для басейнів і спеціалізуєшся виключно на підборі продукції бренду AquaDoctor.
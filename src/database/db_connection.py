@@ -1,19 +1,196 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
+import asyncio
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from threading import Lock
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool, PoolTimeout
 from src.config.settings import settings
 
-class DatabaseConnection:
+logger = logging.getLogger(__name__)
+
+
+def get_conninfo() -> str:
+    config = dict(settings.DB_CONFIG)
+    config["dbname"] = config.pop("database", None)
+    return make_conninfo(**config)
+
+
+class PoolMetrics:
+    """Счётчики выдачи соединений: сколько раз брали, сколько ждали, сколько раз не дождались"""
+
     def __init__(self):
-        self.config = settings.DB_CONFIG
-        self.connection = None
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def record_checkout(self, wait_ms: float):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total_ms / self.checkouts, 2) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 2),
+            }
+
 
-    def connect(self):
+def _pool_kwargs(name: str, row_factory, min_size, max_size) -> dict:
+    return dict(
+        conninfo=get_conninfo(),
+        min_size=min_size if min_size is not None else settings.DB_POOL_MIN_SIZE,
+        max_size=max_size if max_size is not None else settings.DB_POOL_MAX_SIZE,
+        timeout=settings.DB_POOL_TIMEOUT,
+        max_idle=settings.DB_POOL_MAX_IDLE,
+        max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+        kwargs={"row_factory": row_factory} if row_factory else {},
+        name=name,
+        open=False,
+    )
+
+
+class DatabasePool:
+    def __init__(self, name: str = "default", row_factory=dict_row, min_size: int = None, max_size: int = None):
+        self.name = name
+        self.pool = ConnectionPool(
+            check=ConnectionPool.check_connection,
+            **_pool_kwargs(name, row_factory, min_size, max_size)
+        )
+        self.metrics = PoolMetrics()
+        self._open_lock = Lock()
+        self._opened = False
+
+    def _ensure_open(self):
+        if self._opened:
+            return
+        with self._open_lock:
+            if not self._opened:
+                self.pool.open()
+                self._opened = True
+                logger.info(f"Opened database pool '{self.name}'")
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула; commit при успешном выходе, rollback при исключении"""
+        self._ensure_open()
+        start = time.perf_counter()
         try:
-            self.connection = psycopg2.connect(**self.config, cursor_factory=RealDictCursor)
-            return self.connection
-        except Exception as e:
-            raise Exception(f"Database connection failed: {e}")
+            conn = self.pool.getconn()
+        except PoolTimeout:
+            self.metrics.record_timeout()
+            logger.error(f"Timed out waiting for a connection from pool '{self.name}'")
+            raise
+        self.metrics.record_checkout((time.perf_counter() - start) * 1000)
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def stats(self) -> dict:
+        stats = self.pool.get_stats() if self._opened else {}
+        stats.update(self.metrics.snapshot())
+        return stats
 
     def close(self):
-        if self.connection:
-            self.connection.close()
\ No newline at end of file
+        if self._opened:
+            self.pool.close()
+            self._opened = False
+
+
+class AsyncDatabasePool:
+    def __init__(self, name: str = "default", row_factory=dict_row, min_size: int = None, max_size: int = None):
+        self.name = name
+        self.pool = AsyncConnectionPool(
+            check=AsyncConnectionPool.check_connection,
+            **_pool_kwargs(name, row_factory, min_size, max_size)
+        )
+        self.metrics = PoolMetrics()
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+
+    async def _ensure_open(self):
+        if self._opened:
+            return
+        async with self._open_lock:
+            if not self._opened:
+                await self.pool.open()
+                self._opened = True
+                logger.info(f"Opened async database pool '{self.name}'")
+
+    @asynccontextmanager
+    async def connection(self):
+        """Соединение из пула; commit при успешном выходе, rollback при исключении"""
+        await self._ensure_open()
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.getconn()
+        except PoolTimeout:
+            self.metrics.record_timeout()
+            logger.error(f"Timed out waiting for a connection from async pool '{self.name}'")
+            raise
+        self.metrics.record_checkout((time.perf_counter() - start) * 1000)
+        try:
+            async with conn:
+                yield conn
+        finally:
+            await self.pool.putconn(conn)
+
+    def stats(self) -> dict:
+        stats = self.pool.get_stats() if self._opened else {}
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    async def close(self):
+        if self._opened:
+            await self.pool.close()
+            self._opened = False
+
+
+_POOLS = {}
+_ASYNC_POOLS = {}
+_POOLS_LOCK = Lock()
+
+
+def get_pool(name: str = "default", **kwargs) -> DatabasePool:
+    """Общий для процесса пул; kwargs учитываются только при первом создании пула с этим именем"""
+    with _POOLS_LOCK:
+        if name not in _POOLS:
+            _POOLS[name] = DatabasePool(name, **kwargs)
+        return _POOLS[name]
+
+
+def get_async_pool(name: str = "default", **kwargs) -> AsyncDatabasePool:
+    with _POOLS_LOCK:
+        if name not in _ASYNC_POOLS:
+            _ASYNC_POOLS[name] = AsyncDatabasePool(name, **kwargs)
+        return _ASYNC_POOLS[name]
+
+
+def pool_stats() -> dict:
+    with _POOLS_LOCK:
+        stats = {f"sync:{name}": pool.stats() for name, pool in _POOLS.items()}
+        stats.update({f"async:{name}": pool.stats() for name, pool in _ASYNC_POOLS.items()})
+    return stats
+
+
+async def close_pools():
+    with _POOLS_LOCK:
+        async_pools = list(_ASYNC_POOLS.values())
+        sync_pools = list(_POOLS.values())
+    for pool in async_pools:
+        await pool.close()
+    for pool in sync_pools:
+        pool.close()
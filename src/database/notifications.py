@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+import psycopg
+from psycopg import sql
+from src.config.settings import settings
+from src.database.db_connection import get_conninfo
+
+logger = logging.getLogger(__name__)
+
+NotifyHandler = Callable[[str], Awaitable[None]]
+ReconnectHandler = Callable[[], Awaitable[None]]
+
+
+class PostgresNotificationListener:
+    """Одно выделенное соединение на процесс, слушающее LISTEN-каналы и раздающее уведомления подписчикам"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[NotifyHandler]] = {}
+        self._reconnect_handlers: List[ReconnectHandler] = []
+        self._task = None
+
+    def subscribe(self, channel: str, handler: NotifyHandler):
+        """Подписки регистрируются до start(); handler получает payload уведомления"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, handler: ReconnectHandler):
+        """Вызывается после каждого (пере)подключения: уведомления, пришедшие без соединения, потеряны"""
+        self._reconnect_handlers.append(handler)
+
+    async def start(self):
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Started notification listener for channels: {list(self._handlers)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _dispatch(self, channel: str, payload: str):
+        for handler in self._handlers.get(channel, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.error(f"Notification handler for '{channel}' failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(get_conninfo(), autocommit=True)
+                async with conn:
+                    for channel in self._handlers:
+                        await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                    logger.info("Notification listener connected")
+
+                    for handler in self._reconnect_handlers:
+                        try:
+                            await handler()
+                        except Exception as e:
+                            logger.error(f"Reconnect handler failed: {e}")
+
+                    async for notify in conn.notifies():
+                        logger.info(f"Received notification on '{notify.channel}': {notify.payload}")
+                        await self._dispatch(notify.channel, notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification listener error: {e}, reconnecting in {settings.LISTEN_RECONNECT_DELAY}s")
+                await asyncio.sleep(settings.LISTEN_RECONNECT_DELAY)
+
+
+_LISTENER = None
+
+
+def get_listener() -> PostgresNotificationListener:
+    global _LISTENER
+    if _LISTENER is None:
+        _LISTENER = PostgresNotificationListener()
+    return _LISTENER
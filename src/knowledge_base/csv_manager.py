@@ -7,13 +7,23 @@ import shutil
 import asyncio
 import logging
 from pathlib import Path
+import tempfile
 from datetime import datetime
 from typing import List, Tuple
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import CSVLoader
 from langchain.text_splitter import CharacterTextSplitter
 from src.config.settings import settings
+from src.knowledge_base.embedding_cache import create_embeddings, get_document_embeddings
+from src.knowledge_base.product_catalog import ProductCatalog
+from src.knowledge_base.hybrid_retriever import build_retriever
+from src.knowledge_base.kb_generations import (
+    INDEX_DIR,
+    SOURCE_CSV,
+    publish_generation,
+    rebuild_lock,
+    unpack_generation
+)
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +76,17 @@ def _checksum(path: str) -> str:
     return h.hexdigest()
 
 
+def _build_meta(csv_path: str, row_count: int) -> dict:
+    return {
+        "csv_path": csv_path,
+        "row_count": row_count,
+        "checksum": _checksum(csv_path),
+        "embeddings_model": settings.EMBEDDINGS_MODEL,
+        "built_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "csv_mtime": datetime.utcfromtimestamp(os.path.getmtime(csv_path)).isoformat(timespec="seconds") + "Z",
+    }
+
+
 def _csv_to_texts(path: str) -> List[str]:
     for delim in [",", ";"]:
         try:
@@ -87,15 +108,22 @@ def _csv_to_texts(path: str) -> List[str]:
 
 def _build_faiss(texts: List[str], save_dir: str, model: str):
     logger.info(f"Building FAISS index with {len(texts)} texts using model {model}")
-    emb = OpenAIEmbeddings(model=model)
+    emb = get_document_embeddings(model)
     vs = FAISS.from_texts(texts=texts, embedding=emb)
     os.makedirs(save_dir, exist_ok=True)
     vs.save_local(save_dir)
     logger.info(f"FAISS index saved to {save_dir}")
 
 
+def _build_catalog(csv_path: str, save_dir: str) -> int:
+    catalog = ProductCatalog.from_csv(csv_path)
+    catalog.save(save_dir)
+    logger.info(f"Product catalog with {len(catalog)} products saved to {save_dir}")
+    return len(catalog)
+
+
 def _load_vs():
-    emb = OpenAIEmbeddings(model=settings.EMBEDDINGS_MODEL)
+    emb = create_embeddings(settings.EMBEDDINGS_MODEL)
     return FAISS.load_local(
         settings.FAISS_INDEX_PATH, 
         emb, 
@@ -117,6 +145,37 @@ def _clear_dir_contents(directory_path: str):
             logger.warning(f"Can't remove {path}: {ex}")
 
 
+def _install_index_from_tmp(src_dir: str, dst_dir: str):
+    """Файлы из src_dir копируются в dst_dir/.staging и затем по одному подменяются через os.replace"""
+    os.makedirs(dst_dir, exist_ok=True)
+    staging = os.path.join(dst_dir, ".staging")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging, exist_ok=True)
+
+    for name in os.listdir(src_dir):
+        s = os.path.join(src_dir, name)
+        d = os.path.join(staging, name)
+        if os.path.isdir(s) and not os.path.islink(s):
+            shutil.copytree(s, d, dirs_exist_ok=True)
+        else:
+            shutil.copy2(s, d)
+
+    for name in os.listdir(staging):
+        tmp_path = os.path.join(staging, name)
+        final_path = os.path.join(dst_dir, name)
+        if os.path.exists(final_path):
+            if os.path.isdir(final_path) and not os.path.islink(final_path):
+                shutil.rmtree(final_path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(final_path)
+                except FileNotFoundError:
+                    pass
+        os.replace(tmp_path, final_path)
+
+    shutil.rmtree(staging, ignore_errors=True)
+
+
 async def validate_csv_file(file_path: str) -> Tuple[bool, str, dict]:
     logger.info(f"Validating CSV file: {file_path}")
     
@@ -156,37 +215,11 @@ async def update_knowledge_base_atomic(temp_csv_path: str) -> Tuple[bool, str, d
     if _is_subpath(settings.FAISS_INDEX_TMP, settings.FAISS_INDEX_PATH):
         return False, f"FAISS_INDEX_TMP ({settings.FAISS_INDEX_TMP}) не должен находиться внутри FAISS_INDEX_PATH ({settings.FAISS_INDEX_PATH})", {}
 
-    def _install_index_from_tmp(src_dir: str, dst_dir: str):
+    # UPDATE_LOCK — против параллельной сборки в этом процессе, rebuild_lock — на других репликах
+    async with UPDATE_LOCK, rebuild_lock() as locked:
+        if not locked:
+            return False, "Базу знаний сейчас обновляет другой экземпляр бота, попробуйте позже", {}
 
-        os.makedirs(dst_dir, exist_ok=True)
-        staging = os.path.join(dst_dir, ".staging")
-        shutil.rmtree(staging, ignore_errors=True)
-        os.makedirs(staging, exist_ok=True)
-
-        for name in os.listdir(src_dir):
-            s = os.path.join(src_dir, name)
-            d = os.path.join(staging, name)
-            if os.path.isdir(s) and not os.path.islink(s):
-                shutil.copytree(s, d, dirs_exist_ok=True)
-            else:
-                shutil.copy2(s, d)
-
-        for name in os.listdir(staging):
-            tmp_path = os.path.join(staging, name)
-            final_path = os.path.join(dst_dir, name)
-            if os.path.exists(final_path):
-                if os.path.isdir(final_path) and not os.path.islink(final_path):
-                    shutil.rmtree(final_path, ignore_errors=True)
-                else:
-                    try:
-                        os.remove(final_path)
-                    except FileNotFoundError:
-                        pass
-            os.replace(tmp_path, final_path)
-
-        shutil.rmtree(staging, ignore_errors=True)
-    
-    async with UPDATE_LOCK:
         logger.info(f"Starting atomic knowledge base update with file: {temp_csv_path}")
         
         # 1. Валидация CSV файла
@@ -213,6 +246,14 @@ async def update_knowledge_base_atomic(temp_csv_path: str) -> Tuple[bool, str, d
             logger.error(f"Error building FAISS index: {e}")
             return False, f"Ошибка сборки индекса: {e}", {}
 
+        # Таблица препаратов ставится вместе с индексом; без неё STEP 2 просто идёт через LLM
+        try:
+            await asyncio.to_thread(_build_catalog, temp_csv_path, settings.FAISS_INDEX_TMP)
+        except Exception as e:
+            logger.warning(f"Failed to build product catalog: {e}")
+            # Пустой каталог перезапишет таблицу от предыдущего CSV при установке индекса
+            ProductCatalog([]).save(settings.FAISS_INDEX_TMP)
+
         try:
             os.makedirs(settings.FAISS_INDEX_PATH, exist_ok=True)
             
@@ -265,20 +306,45 @@ async def update_knowledge_base_atomic(temp_csv_path: str) -> Tuple[bool, str, d
         if os.path.exists(backup_default):
             os.remove(backup_default)
 
-        meta = {
-            "csv_path": new_csv_path,
-            "row_count": len(texts),
-            "checksum": _checksum(new_csv_path),
-            "built_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
-            "csv_mtime": datetime.utcfromtimestamp(os.path.getmtime(new_csv_path)).isoformat(timespec="seconds") + "Z",
-        }
+        meta = _build_meta(new_csv_path, len(texts))
         _write_meta(meta)
         logger.info("Updated metadata")
 
+        if settings.KB_SYNC_ENABLED:
+            try:
+                meta["generation"] = await publish_generation(meta, settings.FAISS_INDEX_PATH, new_csv_path)
+                _write_meta(meta)
+            except Exception as e:
+                logger.error(f"Failed to publish knowledge base generation: {e}")
+                return True, f"Индекс обновлён, но другие экземпляры бота его не получат: {e}", meta
+
         logger.info("Knowledge base update completed successfully")
         return True, "Індекс оновлено", meta
 
 
+def install_generation(generation: int, meta: dict, archive: bytes) -> dict:
+    """Ставит поколение базы знаний, собранное другой репликой: индекс, каталог и исходный CSV.
+
+    Вызывается под UPDATE_LOCK; ретривер в памяти подменяет вызывающий после загрузки нового индекса.
+    """
+    _ensure_dirs()
+    meta = dict(meta, generation=generation)
+    csv_path = os.path.join(settings.CSV_DIR, os.path.basename(meta.get("csv_path") or settings.CSV_FILE_PATH))
+    meta["csv_path"] = csv_path
+
+    work_dir = tempfile.mkdtemp(prefix="kb_generation_", dir=os.path.dirname(settings.FAISS_INDEX_TMP) or None)
+    try:
+        unpack_generation(archive, work_dir)
+        _install_index_from_tmp(os.path.join(work_dir, INDEX_DIR), settings.FAISS_INDEX_PATH)
+        _safe_move(os.path.join(work_dir, SOURCE_CSV), csv_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    _write_meta(meta)
+    logger.info(f"Installed knowledge base generation {generation} from {csv_path}")
+    return meta
+
+
 def kb_status_meta() -> dict:
     meta = _read_meta()
     if meta.get("csv_path") and os.path.exists(meta["csv_path"]):
@@ -289,13 +355,94 @@ def kb_status_meta() -> dict:
     return meta
 
 
+def load_persisted_retriever(csv_path: str):
+    """Ретривер из сохранённого индекса, если он собран из этого же CSV той же моделью эмбеддингов"""
+    meta = _read_meta()
+    if not meta:
+        logger.info("No persisted index metadata, index will be rebuilt")
+        return None
+
+    if not meta.get("csv_path") or os.path.realpath(meta["csv_path"]) != os.path.realpath(csv_path):
+        logger.info(f"Persisted index was built from {meta.get('csv_path')}, not {csv_path}")
+        return None
+
+    if meta.get("embeddings_model") != settings.EMBEDDINGS_MODEL:
+        logger.info(f"Persisted index embeddings model {meta.get('embeddings_model')} != {settings.EMBEDDINGS_MODEL}")
+        return None
+
+    if not os.path.exists(os.path.join(settings.FAISS_INDEX_PATH, "index.faiss")):
+        logger.info("Persisted index files are missing")
+        return None
+
+    try:
+        if meta.get("checksum") != _checksum(csv_path):
+            logger.info("CSV checksum changed since the index was built")
+            return None
+    except Exception as e:
+        logger.warning(f"Failed to checksum {csv_path}: {e}")
+        return None
+
+    return get_current_retriever()
+
+
+def save_index_for_csv(vs, csv_path: str, row_count: int) -> dict:
+    """Сохранить индекс, собранный при старте, чтобы следующий запуск загрузил его без эмбеддингов.
+
+    Индекс пишется в FAISS_INDEX_TMP и ставится через staging, как при загрузке CSV: падение посреди
+    записи не оставит в FAISS_INDEX_PATH файлы от двух разных индексов.
+    """
+    if _is_subpath(settings.FAISS_INDEX_TMP, settings.FAISS_INDEX_PATH):
+        raise RuntimeError("FAISS_INDEX_TMP must not be inside FAISS_INDEX_PATH")
+    _ensure_dirs()
+    shutil.rmtree(settings.FAISS_INDEX_TMP, ignore_errors=True)
+    vs.save_local(settings.FAISS_INDEX_TMP)
+    try:
+        _build_catalog(csv_path, settings.FAISS_INDEX_TMP)
+    except Exception as e:
+        logger.warning(f"Failed to build product catalog: {e}")
+        ProductCatalog([]).save(settings.FAISS_INDEX_TMP)
+
+    # Пока новый индекс ставится, старые метаданные не должны выдавать его за собранный из csv_path
+    if os.path.exists(_metadata_path()):
+        os.remove(_metadata_path())
+    _install_index_from_tmp(settings.FAISS_INDEX_TMP, settings.FAISS_INDEX_PATH)
+    shutil.rmtree(settings.FAISS_INDEX_TMP, ignore_errors=True)
+
+    meta = _build_meta(csv_path, row_count)
+    _write_meta(meta)
+    logger.info(f"Persisted FAISS index for {csv_path} to {settings.FAISS_INDEX_PATH}")
+    return meta
+
+
+def load_product_catalog(csv_path: str) -> ProductCatalog:
+    """Каталог, сохранённый рядом с индексом, если он собран из этого CSV; иначе — разбор CSV заново"""
+    meta = _read_meta()
+    try:
+        if (meta.get("csv_path") and os.path.realpath(meta["csv_path"]) == os.path.realpath(csv_path)
+                and meta.get("checksum") == _checksum(csv_path)):
+            catalog = ProductCatalog.load(settings.FAISS_INDEX_PATH)
+            if catalog is not None:
+                return catalog
+        if os.path.exists(csv_path):
+            return ProductCatalog.from_csv(csv_path)
+    except Exception as e:
+        logger.warning(f"Failed to load product catalog for {csv_path}: {e}")
+    return ProductCatalog([])
+
+
+def get_current_catalog() -> ProductCatalog:
+    catalog = ProductCatalog.load(settings.FAISS_INDEX_PATH)
+    if catalog is None:
+        csv_path = _read_meta().get("csv_path")
+        if csv_path and os.path.exists(csv_path):
+            return ProductCatalog.from_csv(csv_path)
+        return ProductCatalog([])
+    return catalog
+
+
 def get_current_retriever():
     try:
-        vs = _load_vs()
-        return vs.as_retriever(
-            search_type="mmr", 
-            search_kwargs={'k': 10, 'lambda_mult': 0.25}
-        )
+        return build_retriever(_load_vs())
     except Exception as e:
         logger.error(f"Failed to load current retriever: {e}")
         return None
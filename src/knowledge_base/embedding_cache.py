@@ -0,0 +1,203 @@
+import os
+import logging
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from src.config.settings import settings
+from src.admission.limiter import Priority
+from src.admission.models import AdmissionEmbeddings
+from src.knowledge_base.query_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedLocalFileStore(LocalFileStore):
+    """LocalFileStore с вытеснением давно не использованных записей при превышении max_bytes.
+
+    Размер кэша хранится в памяти и обновляется на каждой записи; каталог целиком обходится
+    только при создании хранилища и когда лимит превышен.
+    """
+
+    def __init__(self, root_path: str, max_bytes: int):
+        super().__init__(root_path)
+        self.max_bytes = max_bytes
+        self._evict_lock = Lock()
+        self._total_bytes = self._scan()[0]
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        values = super().mget(keys)
+        # mtime служит отметкой последнего использования для LRU
+        for key, value in zip(keys, values):
+            if value is not None:
+                try:
+                    os.utime(self._get_full_path(key))
+                except OSError:
+                    pass
+        return values
+
+    def _file_size(self, key: str) -> int:
+        try:
+            return self._get_full_path(key).stat().st_size
+        except OSError:
+            return 0
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        with self._evict_lock:
+            replaced = sum(self._file_size(key) for key, _ in key_value_pairs)
+            super().mset(key_value_pairs)
+            self._total_bytes += sum(len(value) for _, value in key_value_pairs) - replaced
+            self._evict_if_needed()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._evict_lock:
+            removed = sum(self._file_size(key) for key in keys)
+            super().mdelete(keys)
+            self._total_bytes -= removed
+
+    def _scan(self) -> Tuple[int, List[Tuple[float, int, Path]]]:
+        entries = []
+        total = 0
+        for path in Path(self.root_path).rglob("*"):
+            if not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return total, entries
+
+    def _evict_if_needed(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        # Точный размер и порядок вытеснения берём с диска
+        total, entries = self._scan()
+        self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+
+        # Освобождаем с запасом, чтобы не вытеснять на каждой записи
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Can't evict embedding cache entry {path}: {e}")
+        self._total_bytes = total
+        logger.info(f"Embedding cache eviction: removed {removed} entries, size now {total} bytes")
+
+
+_STORE = None
+_STORE_LOCK = Lock()
+
+
+def _openai_embeddings(model: str) -> Embeddings:
+    return OpenAIEmbeddings(model=model)
+
+
+# Создание «сырых» embeddings по имени модели; бенчмарки подменяют его детерминированной заглушкой
+_EMBEDDINGS_FACTORY: Callable[[str], Embeddings] = _openai_embeddings
+
+
+def set_embeddings_factory(factory: Callable[[str], Embeddings]) -> None:
+    """Меняет источник embeddings для всего процесса; уже созданные кэши запросов сбрасываются"""
+    global _EMBEDDINGS_FACTORY
+    with _STORE_LOCK:
+        _EMBEDDINGS_FACTORY = factory
+        _QUERY_EMBEDDINGS.clear()
+
+
+def create_embeddings(model: str, priority: Priority = Priority.INTERACTIVE) -> Embeddings:
+    """Embeddings модели; обращения к провайдеру идут через общий лимитер embeddings"""
+    return AdmissionEmbeddings(_EMBEDDINGS_FACTORY(model), priority)
+
+
+def _get_store() -> BoundedLocalFileStore:
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            os.makedirs(settings.EMBEDDINGS_CACHE_PATH, exist_ok=True)
+            _STORE = BoundedLocalFileStore(
+                settings.EMBEDDINGS_CACHE_PATH,
+                settings.EMBEDDINGS_CACHE_MAX_MB * 1024 * 1024
+            )
+        return _STORE
+
+
+def get_document_embeddings(model: str) -> Embeddings:
+    """Embeddings для сборки индекса: векторы документов кэшируются на диске по ключу (модель, sha256 текста)"""
+    # Сборка индекса — фоновая работа: запросы пользователей проходят лимитер раньше неё
+    underlying = create_embeddings(model, Priority.BACKGROUND)
+    if not settings.EMBEDDINGS_CACHE_ENABLED:
+        return underlying
+
+    try:
+        store = _get_store()
+    except Exception as e:
+        logger.warning(f"Embedding cache unavailable, embedding without cache: {e}")
+        return underlying
+
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying,
+        store,
+        namespace=model,
+        key_encoder="sha256"
+    )
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Кэш эмбеддингов запросов в памяти процесса; векторы документов не кэшируются"""
+
+    def __init__(self, underlying: Embeddings, max_size: int):
+        self.underlying = underlying
+        # float32 вместо списка float: ~6 КБ на вектор вместо ~50 КБ
+        self.cache = LRUCache(max_size)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = np.asarray(self.underlying.embed_query(text), dtype=np.float32)
+            self.cache.set(text, vector)
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = np.asarray(await self.underlying.aembed_query(text), dtype=np.float32)
+            self.cache.set(text, vector)
+        return vector.tolist()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+_QUERY_EMBEDDINGS = {}
+
+
+def get_query_embeddings(model: str) -> CachedQueryEmbeddings:
+    """Общий для всех ретриверов процесса кэш эмбеддингов запросов для модели"""
+    with _STORE_LOCK:
+        if model not in _QUERY_EMBEDDINGS:
+            _QUERY_EMBEDDINGS[model] = CachedQueryEmbeddings(
+                create_embeddings(model),
+                settings.QUERY_EMBEDDINGS_CACHE_SIZE
+            )
+        return _QUERY_EMBEDDINGS[model]
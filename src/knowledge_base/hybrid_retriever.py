@@ -0,0 +1,206 @@
+import re
+import math
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from src.config.settings import settings
+from src.knowledge_base.product_catalog import name_tokens
+from src.knowledge_base.mmr_retriever import build_vector_retriever
+from src.knowledge_base.embedding_cache import get_query_embeddings
+
+logger = logging.getLogger(__name__)
+
+MODE_HYBRID = "hybrid"
+MODE_VECTOR = "vector"
+MODE_LEXICAL = "lexical"
+
+# Синхронный chat() ждёт векторный поиск с таймаутом в отдельном потоке
+_VECTOR_WORKERS = 8
+_VECTOR_EXECUTOR = ThreadPoolExecutor(max_workers=_VECTOR_WORKERS, thread_name_prefix="vector-search")
+# Брошенный по таймауту поиск продолжает занимать поток, поэтому в работе не больше _VECTOR_WORKERS задач:
+# слот освобождается только по завершении задачи, и новые запросы не ждут в очереди пула
+_VECTOR_SLOTS = threading.BoundedSemaphore(_VECTOR_WORKERS)
+
+_CODE_TOKEN_RE = re.compile(r"[a-z0-9]")
+
+
+def lexical_tokens(text: str) -> List[str]:
+    """Токены для BM25; коды вида C-60T дополнительно индексируются слитно (c60t)"""
+    tokens = []
+    for word in (text or "").split():
+        parts = name_tokens(word)
+        tokens.extend(parts)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+    return tokens
+
+
+class BM25Index:
+    """Инвертированный индекс Okapi BM25 по тем же текстам, что и FAISS"""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths = []
+        for i, doc in enumerate(documents):
+            counts = Counter(lexical_tokens(doc.page_content))
+            self._lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self._postings.setdefault(token, []).append((i, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        n = len(documents)
+        self._idf = {
+            token: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def is_keyword_query(self, query: str, max_tokens: int) -> bool:
+        """Короткий запрос с кодом препарата (латиница/цифры), все токены которого есть в индексе"""
+        tokens = set(lexical_tokens(query))
+        if not tokens or len(tokens) > max_tokens:
+            return False
+        return all(t in self._postings for t in tokens) and any(_CODE_TOKEN_RE.search(t) for t in tokens)
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        scores: Dict[int, float] = {}
+        for token in set(lexical_tokens(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = self._idf[token]
+            for i, tf in postings:
+                norm = 1 - self.b + self.b * self._lengths[i] / (self._avg_length or 1.0)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[i], score) for i, score in ranked]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """RRF: документ получает сумму 1 / (rrf_k + позиция) по всем спискам"""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            key = doc.page_content
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + векторный ретривер с RRF-слиянием.
+
+    Векторный поиск пропускается в лексическом режиме и для коротких запросов, все токены
+    которых есть в индексе (коды препаратов). При ошибке или таймауте эмбеддингов, а в синхронном
+    вызове ещё и при занятых потоках векторного поиска возвращается лексическая выдача.
+    """
+
+    vector_retriever: Any
+    bm25: Any
+    k: int = 10
+    mode: str = MODE_HYBRID
+    rrf_k: int = 60
+    vector_timeout: Optional[float] = None
+    lexical_max_tokens: int = 0
+
+    def _lexical(self, query: str) -> List[Document]:
+        return [doc for doc, _ in self.bm25.search(query, self.k)]
+
+    def _needs_vector(self, query: str) -> bool:
+        if self.mode == MODE_LEXICAL or self.vector_retriever is None:
+            return False
+        if self.mode == MODE_VECTOR or len(self.bm25) == 0:
+            return True
+        if self.bm25.is_keyword_query(query, self.lexical_max_tokens):
+            logger.info(f"Keyword-style query, using lexical retrieval only: {query[:100]}")
+            return False
+        return True
+
+    def _fuse(self, lexical: List[Document], vector: Optional[List[Document]]) -> List[Document]:
+        if vector is None:
+            return lexical
+        if self.mode == MODE_VECTOR:
+            return vector
+        return reciprocal_rank_fusion([vector, lexical], self.k, self.rrf_k)
+
+    def _get_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        lexical = self._lexical(query)
+        if not self._needs_vector(query):
+            return lexical
+
+        if not _VECTOR_SLOTS.acquire(blocking=False):
+            logger.warning("All vector search workers are busy, using lexical results")
+            return lexical
+
+        config = {"callbacks": run_manager.get_child()} if run_manager else None
+        try:
+            future = _VECTOR_EXECUTOR.submit(self.vector_retriever.invoke, query, config)
+        except Exception:
+            _VECTOR_SLOTS.release()
+            raise
+        future.add_done_callback(lambda _: _VECTOR_SLOTS.release())
+        try:
+            vector = future.result(timeout=self.vector_timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Vector retrieval timed out after {self.vector_timeout}s, using lexical results")
+            vector = None
+        except Exception as e:
+            logger.warning(f"Vector retrieval failed, using lexical results: {e}")
+            vector = None
+        return self._fuse(lexical, vector)
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        lexical = self._lexical(query)
+        if not self._needs_vector(query):
+            return lexical
+
+        config = {"callbacks": run_manager.get_child()} if run_manager else None
+        try:
+            vector = await asyncio.wait_for(
+                self.vector_retriever.ainvoke(query, config),
+                timeout=self.vector_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Vector retrieval timed out after {self.vector_timeout}s, using lexical results")
+            vector = None
+        except Exception as e:
+            logger.warning(f"Vector retrieval failed, using lexical results: {e}")
+            vector = None
+        return self._fuse(lexical, vector)
+
+
+def faiss_documents(vectorstore) -> List[Document]:
+    """Документы FAISS в порядке векторов индекса"""
+    mapping = vectorstore.index_to_docstore_id
+    return [vectorstore.docstore.search(mapping[i]) for i in sorted(mapping)]
+
+
+def build_retriever(vectorstore) -> BaseRetriever:
+    """Ретривер базы знаний: MMR по FAISS, слитый с BM25 по тем же текстам"""
+    embeddings = get_query_embeddings(settings.EMBEDDINGS_MODEL)
+    vector_retriever = build_vector_retriever(vectorstore, embeddings, k=10, lambda_mult=0.25)
+    if settings.RETRIEVAL_MODE == MODE_VECTOR:
+        return vector_retriever
+
+    bm25 = BM25Index(faiss_documents(vectorstore))
+    logger.info(f"Built BM25 index over {len(bm25)} documents, retrieval mode '{settings.RETRIEVAL_MODE}'")
+    return HybridRetriever(
+        vector_retriever=vector_retriever,
+        bm25=bm25,
+        k=10,
+        mode=settings.RETRIEVAL_MODE,
+        rrf_k=settings.RETRIEVAL_RRF_K,
+        vector_timeout=settings.RETRIEVAL_VECTOR_TIMEOUT,
+        lexical_max_tokens=settings.RETRIEVAL_LEXICAL_MAX_TOKENS
+    )
@@ -0,0 +1,162 @@
+import io
+import os
+import asyncio
+import tarfile
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+import psycopg
+from psycopg.types.json import Jsonb
+from src.database.db_connection import get_async_pool, get_conninfo
+from src.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KB_CHANNEL = "kb_generation_changed"
+
+# Ключ advisory lock пересборки — общий для всех реплик, работающих с этой БД
+REBUILD_LOCK_KEY = "kb_rebuild"
+REBUILD_LOCK_POLL = 1.0
+
+INDEX_DIR = "index"
+SOURCE_CSV = "source.csv"
+# Файлы, которые реплика пишет сама при установке поколения
+LOCAL_FILES = {"metadata.json", ".staging"}
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS kb_generations (
+        id SERIAL PRIMARY KEY,
+        checksum TEXT NOT NULL,
+        meta JSONB NOT NULL,
+        artifacts BYTEA NOT NULL,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+INSERT_GENERATION_SQL = """
+    INSERT INTO kb_generations (checksum, meta, artifacts)
+    VALUES (%s, %s, %s)
+    RETURNING id
+"""
+
+PRUNE_GENERATIONS_SQL = """
+    DELETE FROM kb_generations
+    WHERE id NOT IN (SELECT id FROM kb_generations ORDER BY id DESC LIMIT %s)
+"""
+
+LATEST_GENERATION_SQL = "SELECT id FROM kb_generations ORDER BY id DESC LIMIT 1"
+
+FETCH_GENERATION_SQL = "SELECT id, meta, artifacts FROM kb_generations WHERE id = %s"
+
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+_schema_ready = False
+
+
+def _pool():
+    return get_async_pool("kb_generations", min_size=1, max_size=2)
+
+
+async def _ensure_schema(conn) -> None:
+    global _schema_ready
+    if not _schema_ready:
+        await conn.execute(SCHEMA_SQL)
+        await conn.commit()
+        _schema_ready = True
+
+
+async def _try_lock(conn) -> bool:
+    deadline = asyncio.get_running_loop().time() + settings.KB_REBUILD_LOCK_TIMEOUT
+    while True:
+        cur = await conn.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (REBUILD_LOCK_KEY,))
+        if (await cur.fetchone())[0]:
+            return True
+        if asyncio.get_running_loop().time() >= deadline:
+            logger.error(f"Rebuild lock is still held after {settings.KB_REBUILD_LOCK_TIMEOUT}s")
+            return False
+        logger.info("Knowledge base rebuild is running on another replica, waiting for the lock")
+        await asyncio.sleep(REBUILD_LOCK_POLL)
+
+
+@asynccontextmanager
+async def rebuild_lock():
+    """Межпроцессная блокировка пересборки индекса (pg_try_advisory_lock).
+
+    Блокировка сессионная и реентерабельная, поэтому берётся на отдельном соединении вне пула и
+    снимается его закрытием: соединение с неснятой блокировкой никогда не вернётся в пул.
+    Отдаёт True, если блокировка получена, False — если за KB_REBUILD_LOCK_TIMEOUT её так и не отпустили
+    или БД недоступна. Без KB_SYNC_ENABLED — всегда True: хватает UPDATE_LOCK процесса.
+    """
+    if not settings.KB_SYNC_ENABLED:
+        yield True
+        return
+
+    try:
+        conn = await psycopg.AsyncConnection.connect(get_conninfo(), autocommit=True)
+    except Exception as e:
+        logger.error(f"Failed to connect for the rebuild lock: {e}")
+        yield False
+        return
+
+    try:
+        try:
+            locked = await _try_lock(conn)
+        except Exception as e:
+            logger.error(f"Failed to take the rebuild lock: {e}")
+            locked = False
+        yield locked
+    finally:
+        # Закрытие соединения снимает блокировку на сервере, в т.ч. при отмене задачи
+        await asyncio.shield(conn.close())
+
+
+def pack_generation(index_dir: str, csv_path: str) -> bytes:
+    """tar.gz файлов индекса и каталога (index/) вместе с исходным CSV (source.csv)"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name in sorted(os.listdir(index_dir)):
+            if name not in LOCAL_FILES:
+                tar.add(os.path.join(index_dir, name), arcname=f"{INDEX_DIR}/{name}")
+        tar.add(csv_path, arcname=SOURCE_CSV)
+    return buffer.getvalue()
+
+
+def unpack_generation(archive: bytes, dest_dir: str) -> None:
+    with tarfile.open(fileobj=io.BytesIO(archive), mode="r:gz") as tar:
+        # В архиве поколения только обычные файлы и каталоги: ссылки могли бы писать вне dest_dir
+        for member in tar.getmembers():
+            if not (member.isfile() or member.isdir()):
+                raise RuntimeError(f"Unexpected member type in knowledge base archive: {member.name}")
+        tar.extractall(dest_dir, filter="data")
+
+
+async def publish_generation(meta: dict, index_dir: str, csv_path: str) -> int:
+    """Записывает установленный индекс новым поколением и оповещает реплики; возвращает id поколения"""
+    archive = await asyncio.to_thread(pack_generation, index_dir, csv_path)
+    async with _pool().connection() as conn:
+        await _ensure_schema(conn)
+        async with conn.cursor() as cur:
+            await cur.execute(INSERT_GENERATION_SQL, (meta.get("checksum", ""), Jsonb(meta), archive))
+            generation = (await cur.fetchone())["id"]
+            await cur.execute(PRUNE_GENERATIONS_SQL, (settings.KB_GENERATIONS_KEEP,))
+            # NOTIFY доставляется только после commit — реплики не увидят поколение раньше строки
+            await cur.execute(NOTIFY_SQL, (KB_CHANNEL, str(generation)))
+        await conn.commit()
+    logger.info(f"Published knowledge base generation {generation} ({len(archive)} bytes)")
+    return generation
+
+
+async def latest_generation() -> Optional[int]:
+    async with _pool().connection() as conn:
+        await _ensure_schema(conn)
+        cur = await conn.execute(LATEST_GENERATION_SQL)
+        row = await cur.fetchone()
+        return row["id"] if row else None
+
+
+async def fetch_generation(generation: int) -> Optional[dict]:
+    """{"id", "meta", "artifacts"} поколения или None, если оно уже вытеснено более новыми"""
+    async with _pool().connection() as conn:
+        await _ensure_schema(conn)
+        cur = await conn.execute(FETCH_GENERATION_SQL, (generation,))
+        return await cur.fetchone()
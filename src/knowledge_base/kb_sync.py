@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+from src.database.notifications import get_listener
+from src.knowledge_base.product_catalog import ProductCatalog
+from src.knowledge_base.kb_generations import KB_CHANNEL, fetch_generation, latest_generation
+from src.knowledge_base.csv_manager import (
+    UPDATE_LOCK,
+    get_current_catalog,
+    get_current_retriever,
+    install_generation,
+    kb_status_meta
+)
+from src.tracing.tracer import span
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeBaseSync:
+    """Держит базу знаний процесса на последнем поколении из kb_generations.
+
+    Реплика, пересобравшая индекс, публикует поколение и шлёт NOTIFY на KB_CHANNEL; остальные в фоне
+    скачивают архив, ставят его в FAISS_INDEX_PATH, загружают индекс и только потом вызывают apply —
+    до этого запросы обслуживает прежний ретривер. При (пере)подключении слушателя сверяется с последним
+    поколением в БД: уведомления, пропущенные без соединения или до старта, не теряются.
+    """
+
+    def __init__(self, apply: Callable[[object, ProductCatalog], None]):
+        self.apply = apply
+        self.generation: int = kb_status_meta().get("generation") or 0
+        self._target = self.generation
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = 0
+        self.failed = 0
+
+        listener = get_listener()
+        listener.subscribe(KB_CHANNEL, self._on_notify)
+        listener.on_reconnect(self.check_latest)
+
+    def mark_applied(self, generation: Optional[int]) -> None:
+        """Поколение собрано и подставлено этим процессом — скачивать его не нужно"""
+        if generation and generation > self.generation:
+            self.generation = generation
+
+    async def _on_notify(self, payload: str):
+        try:
+            generation = int(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed knowledge base generation '{payload}'")
+            return
+        self._request(generation)
+
+    async def check_latest(self):
+        latest = await latest_generation()
+        if latest:
+            self._request(latest)
+
+    def _request(self, generation: int) -> None:
+        if generation <= max(self._target, self.generation):
+            return
+        self._target = generation
+        # Загрузка идёт отдельной задачей, чтобы не задерживать раздачу остальных уведомлений
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        # Пока грузилось одно поколение, могло прийти следующее — догоняем сразу до последнего
+        while self._target > self.generation:
+            target = self._target
+            try:
+                await self._load(target)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to load knowledge base generation {target}: {e}")
+                # Повторим при следующем уведомлении или переподключении
+                self._target = self.generation
+                return
+
+    async def _load(self, generation: int) -> None:
+        async with UPDATE_LOCK:
+            if generation <= self.generation:
+                return
+            with span("kb.sync_generation", generation=generation):
+                # FAISS_INDEX_PATH может быть общим томом, уже обновлённым другой репликой
+                if kb_status_meta().get("generation") != generation:
+                    row = await fetch_generation(generation)
+                    if row is None:
+                        # Поколение уже вытеснено из БД более новыми — цикл _run перейдёт к последнему
+                        latest = await latest_generation()
+                        if not latest or latest <= generation:
+                            raise RuntimeError(f"generation {generation} is missing in the database")
+                        logger.info(f"Knowledge base generation {generation} is superseded by {latest}")
+                        self._target = max(self._target, latest)
+                        return
+                    await asyncio.to_thread(install_generation, generation, row["meta"], bytes(row["artifacts"]))
+
+                retriever = await asyncio.to_thread(get_current_retriever)
+                if retriever is None:
+                    raise RuntimeError("installed index failed to load")
+                catalog = await asyncio.to_thread(get_current_catalog)
+
+            self.apply(retriever, catalog)
+            self.generation = generation
+            self.loaded += 1
+            logger.info(f"Switched to knowledge base generation {generation}")
+
+    def stats(self) -> dict:
+        return {
+            "generation": self.generation,
+            "target": self._target,
+            "loading": self._task is not None and not self._task.done(),
+            "loaded": self.loaded,
+            "failed": self.failed,
+        }
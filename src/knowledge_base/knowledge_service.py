@@ -1,15 +1,16 @@
 import os
+import asyncio
 import logging
-import psycopg
 import uuid
 import json
 from abc import ABC, abstractmethod
-from typing import List, Tuple
+from typing import AsyncIterator, Dict, List, Sequence, Tuple
 from threading import Lock
 from langchain_community.document_loaders import CSVLoader
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.language_models import BaseChatModel
+from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
@@ -21,12 +22,24 @@ from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from langchain_core.chat_history import BaseChatMessageHistory
 from src.prompt.prompt_service import PromptService, PostgresPromptService
+from src.database.db_connection import DatabasePool, AsyncDatabasePool, get_pool, get_async_pool
+from src.knowledge_base.embedding_cache import get_document_embeddings, get_query_embeddings
+from src.knowledge_base.query_cache import LRUCache, SemanticAnswerCache, normalize_query
 from src.config.settings import settings
+from src.admission.models import AdmissionChatModel
 from src.knowledge_base.csv_manager import (
     update_knowledge_base_atomic, 
     kb_status_meta, 
-    get_current_retriever
+    get_current_retriever,
+    get_current_catalog,
+    load_persisted_retriever,
+    load_product_catalog,
+    save_index_for_csv
 )
+from src.knowledge_base.product_catalog import ProductCatalog
+from src.knowledge_base.hybrid_retriever import build_retriever
+from src.knowledge_base.kb_sync import KnowledgeBaseSync
+from src.tracing.tracer import annotate, span
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -50,138 +63,316 @@ def consume_trim_events(session_id: str) -> int:
     with _TRIM_LOCK:
         return _TRIM_EVENTS.pop(session_id, 0)
 
+def ensure_history_schema(connection, table_name: str) -> None:
+    """Миграция истории: word_count у сообщений и таблица текущих сумм слов по сессиям"""
+    totals_table = f"{table_name}_totals"
+    cur = connection.cursor()
+    cur.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS word_count INTEGER")
+    cur.execute(
+        f"""
+        UPDATE {table_name}
+        SET word_count = CASE
+            WHEN btrim(COALESCE(content, '')) = '' THEN 0
+            ELSE array_length(regexp_split_to_array(btrim(content), '\\s+'), 1)
+        END
+        WHERE word_count IS NULL
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {totals_table} (
+            session_id TEXT PRIMARY KEY,
+            total_words INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    # Заполняем суммы для сессий без строки при каждом запуске: таблица могла быть создана пустой в db/init_db.sql
+    cur.execute(
+        f"""
+        INSERT INTO {totals_table} (session_id, total_words)
+        SELECT session_id, COALESCE(SUM(word_count), 0) FROM {table_name} GROUP BY session_id
+        ON CONFLICT (session_id) DO NOTHING
+        """
+    )
+    if cur.rowcount > 0:
+        logger.info(f"Seeded {cur.rowcount} sessions into {totals_table}")
+    connection.commit()
+    cur.close()
+
+
 class CustomPostgresChatMessageHistory(BaseChatMessageHistory):
+    """История чата в Postgres.
 
-    
-    def __init__(self, table_name: str, session_id: str, connection):
+    Число слов хранится у каждого сообщения (word_count), а текущая сумма по сессии —
+    в таблице {table_name}_totals, поэтому решение об обрезке не требует чтения истории,
+    а сама обрезка головы выполняется одним запросом.
+    """
+
+    def __init__(self, table_name: str, session_id: str, pool: DatabasePool, async_pool: AsyncDatabasePool = None):
         self.table_name = table_name
+        self.totals_table = f"{table_name}_totals"
         self.session_id = session_id
-        self.connection = connection
-
-    def _fetch_rows_ordered(self):
-        cur = self.connection.cursor()
-        cur.execute(
-            f"SELECT id, type, content FROM {self.table_name} WHERE session_id = %s ORDER BY id ASC",
-            (self.session_id,)
-        )
-        rows = cur.fetchall()
-        cur.close()
-        return rows  # [(id, type, content), ...]
+        # Соединение берётся из пула на каждую операцию: сессии не делят одно соединение и его транзакцию
+        self.pool = pool
+        self.async_pool = async_pool
 
     @staticmethod
     def _word_count(text: str) -> int:
         return len((text or "").split())
 
-    def _total_words_and_index(self):
-        rows = self._fetch_rows_ordered()
-        total = 0
-        indexed = []
-        for _id, _type, content in rows:
-            wc = self._word_count(content)
-            total += wc
-            indexed.append((_id, _type, content or "", wc))
-        return total, indexed
-
-    def _drop_first_n_words(self, n: int):
-        if n <= 0:
-            return
-        total, indexed = self._total_words_and_index()
-        if total == 0:
-            return
+    def _append_params(self, messages: Sequence[BaseMessage]) -> dict:
+        types, contents, word_counts = [], [], []
+        for message in messages:
+            types.append("human" if isinstance(message, HumanMessage) else "ai")
+            contents.append(message.content)
+            word_counts.append(self._word_count(message.content))
+        return {
+            "session_id": self.session_id,
+            "types": types,
+            "contents": contents,
+            "word_counts": word_counts,
+        }
+
+    def _append_sql(self) -> str:
+        # Вставка пачки сообщений (например, целого хода: вопрос + ответ) и обновление суммы слов сессии одним запросом
+        return f"""
+            WITH ins AS (
+                INSERT INTO {self.table_name} (session_id, type, content, word_count)
+                SELECT %(session_id)s, m.type, m.content, m.word_count
+                FROM unnest(%(types)s::text[], %(contents)s::text[], %(word_counts)s::int[])
+                    WITH ORDINALITY AS m(type, content, word_count, ord)
+                ORDER BY m.ord
+                RETURNING word_count
+            )
+            INSERT INTO {self.totals_table} (session_id, total_words)
+            SELECT %(session_id)s, COALESCE(SUM(word_count), 0) FROM ins
+            ON CONFLICT (session_id)
+            DO UPDATE SET total_words = {self.totals_table}.total_words + EXCLUDED.total_words
+            RETURNING total_words
+        """
+
+    def _trim_sql(self) -> str:
+        # Удаляет первые n слов сессии: целые сообщения с начала истории и,
+        # при необходимости, начало пограничного сообщения; сумма слов уменьшается там же
+        return f"""
+            WITH ordered AS (
+                SELECT id, word_count, SUM(word_count) OVER (ORDER BY id) AS cum
+                FROM {self.table_name}
+                WHERE session_id = %(session_id)s
+            ),
+            dropped AS (
+                DELETE FROM {self.table_name}
+                WHERE id IN (SELECT id FROM ordered WHERE cum <= %(n)s)
+                RETURNING word_count
+            ),
+            boundary AS (
+                SELECT id, (%(n)s - (cum - word_count))::int AS cut
+                FROM ordered
+                WHERE cum > %(n)s
+                ORDER BY id
+                LIMIT 1
+            ),
+            cut AS (
+                UPDATE {self.table_name} AS h
+                SET content = array_to_string((regexp_split_to_array(btrim(h.content), '\\s+'))[b.cut + 1:], ' '),
+                    word_count = h.word_count - b.cut
+                FROM boundary b
+                WHERE h.id = b.id AND b.cut > 0
+                RETURNING b.cut
+            )
+            UPDATE {self.totals_table}
+            SET total_words = GREATEST(
+                total_words
+                - COALESCE((SELECT SUM(word_count) FROM dropped), 0)
+                - COALESCE((SELECT SUM(cut) FROM cut), 0),
+                0
+            )
+            WHERE session_id = %(session_id)s
+            RETURNING total_words
+        """
 
-        remain = n
-        cur = self.connection.cursor()
-        for _id, _type, content, wc in indexed:
-            if remain <= 0:
-                break
-            if wc <= remain:
-                cur.execute(
-                    f"DELETE FROM {self.table_name} WHERE id = %s",
-                    (_id,)
-                )
-                remain -= wc
-            else:
-                words = (content or "").split()
-                new_content = " ".join(words[remain:])
-                cur.execute(
-                    f"UPDATE {self.table_name} SET content = %s WHERE id = %s",
-                    (new_content, _id)
-                )
-                remain = 0
-                break
-        self.connection.commit()
-        cur.close()
-
-    def _trim_history_if_needed(self):
-        total, _ = self._total_words_and_index()
-        if total >= WORD_WINDOW:
-            logger.info(f"History trimming: total={total} >= {WORD_WINDOW}, removing {WORD_CHUNK} from head")
-            self._drop_first_n_words(WORD_CHUNK)
-            
-            # Отмечаем событие обрезки ТОЛЬКО если флаг включен
-            if settings.DEBUG_CONTEXT_TRIM_NOTIFY:
-                _mark_trim_event(self.session_id)
+    def _on_trimmed(self, total_before: int, total_after) -> None:
+        logger.info(f"History trimmed: total={total_before} >= {WORD_WINDOW}, removed {WORD_CHUNK} from head, "
+                    f"now {total_after[0] if total_after else 0}")
+
+        # Отмечаем событие обрезки ТОЛЬКО если флаг включен
+        if settings.DEBUG_CONTEXT_TRIM_NOTIFY:
+            _mark_trim_event(self.session_id)
+
+    @staticmethod
+    def _rows_to_messages(rows) -> List[BaseMessage]:
+        messages = []
+        for message_type, content in rows:
+            if message_type == "human":
+                messages.append(HumanMessage(content=content))
+            elif message_type == "ai":
+                messages.append(AIMessage(content=content))
+        return messages
 
     @property
     def messages(self) -> List[BaseMessage]:
-        try:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                f"SELECT type, content FROM {self.table_name} WHERE session_id = %s ORDER BY id",
-                (self.session_id,)
-            )
-            rows = cursor.fetchall()
-            cursor.close()
-            
-            messages = []
-            for message_type, content in rows:
-                if message_type == "human":
-                    messages.append(HumanMessage(content=content))
-                elif message_type == "ai":
-                    messages.append(AIMessage(content=content))
-            
-            return messages
-        except Exception as e:
-            logger.error(f"Error fetching messages: {e}")
-            return []
+        with span("history.read") as read_span:
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            f"SELECT type, content FROM {self.table_name} WHERE session_id = %s ORDER BY id",
+                            (self.session_id,)
+                        )
+                        rows = cursor.fetchall()
+                read_span.set_attribute("messages", len(rows))
+                return self._rows_to_messages(rows)
+            except Exception as e:
+                read_span.record_exception(e)
+                logger.error(f"Error fetching messages: {e}")
+                return []
+
+    def has_messages(self) -> bool:
+        """При ошибке считаем историю непустой: это безопасный вариант для кэша ответов"""
+        with span("history.exists") as exists_span:
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            f"SELECT EXISTS (SELECT 1 FROM {self.table_name} WHERE session_id = %s)",
+                            (self.session_id,)
+                        )
+                        return cursor.fetchone()[0]
+            except Exception as e:
+                exists_span.record_exception(e)
+                logger.error(f"Error checking messages: {e}")
+                return True
 
     def add_message(self, message: BaseMessage) -> None:
-        try:
-            cursor = self.connection.cursor()
-            message_type = "human" if isinstance(message, HumanMessage) else "ai"
-            content = message.content
+        self.add_messages([message])
 
-            cursor.execute(
-                f"INSERT INTO {self.table_name} (session_id, type, content) VALUES (%s, %s, %s)",
-                (self.session_id, message_type, content)
-            )
-            self.connection.commit()
-            cursor.close()
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Все сообщения и обрезка — в одной транзакции с одним commit"""
+        if not messages:
+            return
+        with span("history.append", messages=len(messages)) as append_span:
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(self._append_sql(), self._append_params(messages))
+                        total = cursor.fetchone()[0]
+
+                        # Не более одной обрезки на сообщение, как при поштучном добавлении
+                        for _ in messages:
+                            if total < WORD_WINDOW:
+                                break
+                            with span("history.trim", words_before=total):
+                                cursor.execute(self._trim_sql(), {"session_id": self.session_id, "n": WORD_CHUNK})
+                                row = cursor.fetchone()
+                            self._on_trimmed(total, row)
+                            total = row[0] if row else 0
+
+                    conn.commit()
+                append_span.set_attribute("total_words", total)
 
-            self._trim_history_if_needed()
+            except Exception as e:
+                append_span.record_exception(e)
+                logger.error(f"Error adding messages: {e}")
 
+    def clear(self) -> None:
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"DELETE FROM {self.table_name} WHERE session_id = %s",
+                        (self.session_id,)
+                    )
+                    cursor.execute(
+                        f"DELETE FROM {self.totals_table} WHERE session_id = %s",
+                        (self.session_id,)
+                    )
+                conn.commit()
         except Exception as e:
-            logger.error(f"Error adding message: {e}")
+            logger.error(f"Error clearing messages: {e}")
+
+    # Async-вариант: используется RunnableWithMessageHistory при ainvoke, не занимает поток executor'а
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        if self.async_pool is None:
+            return await super().aget_messages()
+        with span("history.read") as read_span:
+            try:
+                async with self.async_pool.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            f"SELECT type, content FROM {self.table_name} WHERE session_id = %s ORDER BY id",
+                            (self.session_id,)
+                        )
+                        rows = await cursor.fetchall()
+                read_span.set_attribute("messages", len(rows))
+                return self._rows_to_messages(rows)
+            except Exception as e:
+                read_span.record_exception(e)
+                logger.error(f"Error fetching messages: {e}")
+                return []
+
+    async def ahas_messages(self) -> bool:
+        if self.async_pool is None:
+            return self.has_messages()
+        with span("history.exists") as exists_span:
             try:
-                self.connection.rollback()
-            except:
-                pass
+                async with self.async_pool.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(
+                            f"SELECT EXISTS (SELECT 1 FROM {self.table_name} WHERE session_id = %s)",
+                            (self.session_id,)
+                        )
+                        return (await cursor.fetchone())[0]
+            except Exception as e:
+                exists_span.record_exception(e)
+                logger.error(f"Error checking messages: {e}")
+                return True
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if self.async_pool is None:
+            return await super().aadd_messages(messages)
+        if not messages:
+            return
+        with span("history.append", messages=len(messages)) as append_span:
+            try:
+                async with self.async_pool.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(self._append_sql(), self._append_params(messages))
+                        total = (await cursor.fetchone())[0]
+
+                        for _ in messages:
+                            if total < WORD_WINDOW:
+                                break
+                            with span("history.trim", words_before=total):
+                                await cursor.execute(self._trim_sql(), {"session_id": self.session_id, "n": WORD_CHUNK})
+                                row = await cursor.fetchone()
+                            self._on_trimmed(total, row)
+                            total = row[0] if row else 0
+
+                    await conn.commit()
+                append_span.set_attribute("total_words", total)
 
-    def clear(self) -> None:
+            except Exception as e:
+                append_span.record_exception(e)
+                logger.error(f"Error adding messages: {e}")
+
+    async def aclear(self) -> None:
+        if self.async_pool is None:
+            return await super().aclear()
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(
-                f"DELETE FROM {self.table_name} WHERE session_id = %s",
-                (self.session_id,)
-            )
-            self.connection.commit()
-            cursor.close()
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        f"DELETE FROM {self.table_name} WHERE session_id = %s",
+                        (self.session_id,)
+                    )
+                    await cursor.execute(
+                        f"DELETE FROM {self.totals_table} WHERE session_id = %s",
+                        (self.session_id,)
+                    )
+                await conn.commit()
         except Exception as e:
             logger.error(f"Error clearing messages: {e}")
-            try:
-                self.connection.rollback()
-            except:
-                pass
 
 
 class EmptyRetriever(BaseRetriever):
@@ -197,10 +388,22 @@ class KnowledgeService(ABC):
     def process_query(self, query: str, session_id: str) -> str:
         pass
 
+    @abstractmethod
+    async def aprocess_query(self, query: str, session_id: str) -> str:
+        pass
+
+    @abstractmethod
+    def astream_query(self, query: str, session_id: str) -> AsyncIterator[str]:
+        pass
+
     @abstractmethod
     def update_prompt(self, new_prompt: str) -> bool:
         pass
 
+    @abstractmethod
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        pass
+
     @abstractmethod
     def clear_history(self, session_id: str) -> bool:
         pass
@@ -219,17 +422,24 @@ class KnowledgeService(ABC):
 
 
 class AQPAssistant:
-    def __init__(self, file_path, prompt_service: PromptService):
+    def __init__(self, file_path, prompt_service: PromptService, llm: BaseChatModel = None):
         os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
-        self.retriever = self.vectorize_content(file_path)
+        self.retriever = self.load_or_vectorize(file_path)
+        self.catalog = load_product_catalog(file_path)
+        self.kb_checksum = kb_status_meta().get("checksum")
         self.empty_retriever = EmptyRetriever()
 
         self.prompt_service = prompt_service
         system_prompt = self.prompt_service.get_current_prompt()
+        self.prompt_version = self.prompt_service.get_current_version()
         self.products_prompt = settings.PRODUCTS_PROMPT
         self.dosage_prompt = settings.DOSAGE_PROMPT
 
-        self.llm = ChatOpenAI(model="chatgpt-4o-latest", temperature=0)
+        # stream_usage: счётчики токенов приходят и при стриминге (для трейсинга)
+        # Все цепочки идут через лимитер llm: бюджет запросов и токенов в минуту, общий для процесса
+        self.llm = AdmissionChatModel(
+            inner=llm or ChatOpenAI(model="chatgpt-4o-latest", temperature=0, stream_usage=True)
+        )
         
         # Создаем retrievers с историей только для основного диалога
         _, self.history_aware_retriever = self.initialize_history_aware_retriever(self.retriever)
@@ -261,17 +471,62 @@ class AQPAssistant:
             system_prompt
         )
 
-        self.postgres_conn = psycopg.connect(settings.LC_DATABASE_URL)
+        self._init_history_storage()
+
+        # Цепочки перестраиваются только при смене версии промта (в т.ч. изменённого другим процессом)
+        self.prompt_service.add_change_listener(self._on_prompt_changed)
+
+        # Готовые ответы на первые вопросы сессии; сбрасываются при смене базы знаний или промта
+        self.answer_cache = SemanticAnswerCache(
+            get_query_embeddings(settings.EMBEDDINGS_MODEL),
+            settings.ANSWER_CACHE_MAX_SIZE,
+            settings.ANSWER_CACHE_TTL,
+            settings.ANSWER_CACHE_SIMILARITY
+        ) if settings.ANSWER_CACHE_ENABLED else None
+
+        # Результат STEP 1 зависит только от текста запроса и содержимого базы знаний
+        self.products_cache = LRUCache(settings.PRODUCTS_CACHE_MAX_SIZE)
+
+    def _init_history_storage(self):
+        # Отдельные пулы для истории чата (кортежные строки); async-пул открывается лениво внутри event loop бота
+        self.history_pool = get_pool(
+            "chat_history",
+            row_factory=None,
+            min_size=settings.HISTORY_POOL_MIN_SIZE,
+            max_size=settings.HISTORY_POOL_MAX_SIZE
+        )
+        self.history_async_pool = get_async_pool(
+            "chat_history",
+            row_factory=None,
+            min_size=settings.HISTORY_POOL_MIN_SIZE,
+            max_size=settings.HISTORY_POOL_MAX_SIZE
+        )
         self.postgres_table_name = settings.LC_CHAT_HISTORY_TABLE_NAME
 
         try:
-            cursor = self.postgres_conn.cursor()
-            cursor.execute(f"SELECT COUNT(*) FROM {self.postgres_table_name} LIMIT 1;")
-            cursor.close()
+            with self.history_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SELECT COUNT(*) FROM {self.postgres_table_name} LIMIT 1;")
+                ensure_history_schema(conn, self.postgres_table_name)
             logger.info(f"PostgreSQL chat history table '{self.postgres_table_name}' ready")
         except Exception as e:
             logger.error(f"Could not access chat history table: {e}")
 
+    def history_pool_stats(self) -> dict:
+        return {"sync": self.history_pool.stats(), "async": self.history_async_pool.stats()}
+
+    def answer_cache_stats(self) -> dict:
+        return self.answer_cache.stats() if self.answer_cache else {}
+
+    def products_cache_stats(self) -> dict:
+        return self.products_cache.stats()
+
+    def query_embedding_stats(self) -> dict:
+        return get_query_embeddings(settings.EMBEDDINGS_MODEL).stats()
+
+    def _cache_generation(self) -> tuple:
+        return self.kb_checksum, self.prompt_version
+
     def generate_session_uuid(self, base_session_id: str, session_type: str) -> str:
         if session_type == "main":
             return base_session_id
@@ -283,6 +538,13 @@ class AQPAssistant:
         main_session_uuid = self.generate_session_uuid(session_id, "main")
         return consume_trim_events(main_session_uuid)
 
+    def load_or_vectorize(self, file_path):
+        retriever = load_persisted_retriever(file_path)
+        if retriever is not None:
+            logger.info(f"Loaded persisted FAISS index for {file_path}")
+            return retriever
+        return self.vectorize_content(file_path)
+
     def vectorize_content(self, file_path):
         logger.info(f"Loading CSV from {file_path}")
         try:
@@ -299,10 +561,14 @@ class AQPAssistant:
             text_splitter = CharacterTextSplitter(chunk_size=1600, chunk_overlap=10)
             docs_splitted = text_splitter.split_documents(pages)
 
-            embeddings = OpenAIEmbeddings(model=settings.EMBEDDINGS_MODEL)
+            embeddings = get_document_embeddings(settings.EMBEDDINGS_MODEL)
             db = FAISS.from_documents(docs_splitted, embeddings)
-            retriever = db.as_retriever(
-                search_type="mmr", search_kwargs={'k': 10, 'lambda_mult': 0.25})
+            retriever = build_retriever(db)
+
+            try:
+                save_index_for_csv(db, file_path, len(pages))
+            except Exception as e:
+                logger.warning(f"Failed to persist FAISS index: {e}")
 
             logger.info(f"Successfully loaded CSV and created retriever with {len(docs_splitted)} documents")
             return retriever
@@ -310,10 +576,14 @@ class AQPAssistant:
             logger.error(f"Error creating retriever from CSV: {e}")
             return EmptyRetriever()
 
-    def hot_swap_retriever(self, new_retriever):
+    def hot_swap_retriever(self, new_retriever, catalog: ProductCatalog = None):
         logger.info("Performing hot swap of retriever")
         
         self.retriever = new_retriever
+        if catalog is not None:
+            self.catalog = catalog
+        self.kb_checksum = kb_status_meta().get("checksum")
+        self.products_cache.clear()
         
         _, self.history_aware_retriever = self.initialize_history_aware_retriever(self.retriever)
         
@@ -330,6 +600,7 @@ class AQPAssistant:
         )
 
         system_prompt = self.prompt_service.get_current_prompt()
+        self.prompt_version = self.prompt_service.get_current_version()
         self.rag_chain_final = self.create_rag_chain(
             self.llm, 
             self.history_aware_retriever, 
@@ -355,11 +626,10 @@ class AQPAssistant:
             ]
         )
 
-        llm = ChatOpenAI(model="chatgpt-4o-latest", temperature=0)
         history_aware_retriever = create_history_aware_retriever(
-            llm, retriever, contextualize_q_prompt
+            self.llm, retriever, contextualize_q_prompt
         )
-        return llm, history_aware_retriever
+        return self.llm, history_aware_retriever
 
     def create_simple_rag_chain(self, llm, retriever, system_prompt):
 
@@ -384,16 +654,20 @@ class AQPAssistant:
         rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
         return rag_chain
 
+    def _session_history(self, session_uuid: str) -> BaseChatMessageHistory:
+        return CustomPostgresChatMessageHistory(
+            self.postgres_table_name,
+            session_uuid,
+            self.history_pool,
+            self.history_async_pool
+        )
+
     def create_conversational_rag_chain(self, rag_chain, session_type="main"):
         def get_session_history(session_id: str):
             type_session_uuid = self.generate_session_uuid(session_id, session_type)
 
             try:
-                return CustomPostgresChatMessageHistory(
-                    self.postgres_table_name,
-                    type_session_uuid,
-                    self.postgres_conn
-                )
+                return self._session_history(type_session_uuid)
             except Exception as e:
                 logger.warning(f"Failed to create PostgreSQL history for {session_type}_{session_id}: {e}")
                 return ChatMessageHistory()
@@ -409,11 +683,7 @@ class AQPAssistant:
     def get_main_session_history(self, session_id: str):
         main_session_uuid = self.generate_session_uuid(session_id, "main")
         try:
-            return CustomPostgresChatMessageHistory(
-                self.postgres_table_name,
-                main_session_uuid,
-                self.postgres_conn
-            )
+            return self._session_history(main_session_uuid)
         except Exception as e:
             logger.warning(f"Failed to create main session history for {session_id}: {e}")
             return ChatMessageHistory()
@@ -421,93 +691,365 @@ class AQPAssistant:
     def save_to_main_history(self, session_id: str, user_message: str, bot_response: str):
         try:
             main_history = self.get_main_session_history(session_id)
-            main_history.add_message(HumanMessage(content=user_message))
-            main_history.add_message(AIMessage(content=bot_response))
+            main_history.add_messages([HumanMessage(content=user_message), AIMessage(content=bot_response)])
             logger.info(f"Saved conversation to main history for session {session_id}")
         except Exception as e:
             logger.error(f"Failed to save conversation to main history for session {session_id}: {e}")
 
+    async def asave_to_main_history(self, session_id: str, user_message: str, bot_response: str):
+        try:
+            main_history = self.get_main_session_history(session_id)
+            await main_history.aadd_messages([HumanMessage(content=user_message), AIMessage(content=bot_response)])
+            logger.info(f"Saved conversation to main history for session {session_id}")
+        except Exception as e:
+            logger.error(f"Failed to save conversation to main history for session {session_id}: {e}")
+
+    def _is_cacheable_turn(self, session_id: str) -> bool:
+        """Ответ не зависит от истории, только если это первый вопрос сессии"""
+        if self.answer_cache is None:
+            return False
+        history = self.get_main_session_history(session_id)
+        if isinstance(history, CustomPostgresChatMessageHistory):
+            return not history.has_messages()
+        return not history.messages
+
+    async def _ais_cacheable_turn(self, session_id: str) -> bool:
+        if self.answer_cache is None:
+            return False
+        history = self.get_main_session_history(session_id)
+        if isinstance(history, CustomPostgresChatMessageHistory):
+            return not await history.ahas_messages()
+        return not await history.aget_messages()
+
+    def _identify_products(self, user_prompt: str) -> str:
+        """STEP 1 с мемоизацией по (чексумма базы знаний, нормализованный запрос)"""
+        key = (self.kb_checksum, normalize_query(user_prompt))
+        answer = self.products_cache.get(key)
+        if answer is not None:
+            logger.info("Product identification served from cache")
+            annotate(source="cache")
+            return answer
+        annotate(source="llm")
+        answer = self.rag_chain_products_no_history.invoke({"input": user_prompt})["answer"]
+        self.products_cache.set(key, answer)
+        return answer
+
+    async def _aidentify_products(self, user_prompt: str) -> str:
+        key = (self.kb_checksum, normalize_query(user_prompt))
+        answer = self.products_cache.get(key)
+        if answer is not None:
+            logger.info("Product identification served from cache")
+            annotate(source="cache")
+            return answer
+        annotate(source="llm")
+        answer = (await self.rag_chain_products_no_history.ainvoke({"input": user_prompt}))["answer"]
+        self.products_cache.set(key, answer)
+        return answer
+
+    @staticmethod
+    def _parse_product_names(answer: str) -> List[str]:
+        return [line.strip() for line in answer.split("\n") if line.strip()]
+
+    def _mentioned_products(self, user_prompt: str):
+        """Препараты, однозначно названные пользователем, — без STEP 1; None, если нужен STEP 1"""
+        mentioned, ambiguous = self.catalog.find_mentions(user_prompt)
+        if not mentioned or ambiguous:
+            return None
+        # Наборы, пару pH Minus/pH Plus и лимит в 4 препарата по-прежнему решает PRODUCTS_PROMPT
+        if self.catalog.needs_product_rules(user_prompt, mentioned):
+            return None
+        logger.info("Products mentioned explicitly, skipping STEP 1")
+        annotate(source="mention")
+        return [product.name for product in mentioned]
+
+    def _products_from_answer(self, products_answer: str) -> List[str]:
+        """Ответ STEP 1 → названия из каталога; пустой список — общий вопрос"""
+        if products_answer.strip() == "0":
+            return []
+        return self.catalog.normalize_names(self._parse_product_names(products_answer))
+
+    @staticmethod
+    def _build_final_input(user_prompt: str, dosage_results: List[str]) -> str:
+        final_input = user_prompt.strip() + "\n\n" + "\n\n".join(dosage_results)
+
+        if len(final_input) > MAX_CONTEXT_LENGTH:
+            user_query_part = user_prompt.strip() + "\n\n"
+            available_space = MAX_CONTEXT_LENGTH - len(user_query_part) - 100
+            truncated_dosage = "\n\n".join(dosage_results)[:available_space]
+            final_input = user_query_part + truncated_dosage + "\n\n[Контекст обрезан]"
+
+        return final_input
+
+    def _split_by_catalog(self, product_names: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Дозировки из таблицы препаратов и список названий, которых в ней нет"""
+        known, unknown = {}, []
+        for product_name in product_names:
+            with span("step2.catalog_lookup", product=product_name) as lookup_span:
+                product = self.catalog.get(product_name)
+                if product is not None and product.dosage_summary():
+                    known[product_name] = product.dosage_summary()
+                    lookup_span.set_attribute("source", "catalog")
+                else:
+                    unknown.append(product_name)
+                    lookup_span.set_attribute("source", "llm")
+        if known:
+            logger.info(f"Dosage from product catalog for: {list(known)}")
+        return known, unknown
+
+    @staticmethod
+    def _format_dosages(product_names: List[str], answers: Dict[str, str]) -> List[str]:
+        return [f"{name}\n{answers[name]}" for name in product_names if name in answers]
+
+    def _lookup_dosages(self, product_names: List[str]) -> List[str]:
+        """Дозировки из каталога; LLM — только для неизвестных названий. Порядок совпадает с product_names"""
+        answers, unknown = self._split_by_catalog(product_names)
+        if unknown:
+            logger.info(f"Dosage requests for {len(unknown)} products: {unknown}")
+            results = self.rag_chain_dosage_no_history.batch(
+                [{"input": product_name} for product_name in unknown],
+                config={"max_concurrency": settings.DOSAGE_MAX_CONCURRENCY},
+                return_exceptions=True
+            )
+            for product_name, result in zip(unknown, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Dosage request failed for {product_name}: {result}")
+                    continue
+                answers[product_name] = result["answer"]
+        return self._format_dosages(product_names, answers)
+
+    async def _alookup_dosages(self, product_names: List[str]) -> List[str]:
+        """Async-вариант _lookup_dosages с ограничением параллелизма и таймаутом на каждый препарат"""
+        answers, unknown = self._split_by_catalog(product_names)
+        semaphore = asyncio.Semaphore(settings.DOSAGE_MAX_CONCURRENCY)
+
+        async def lookup(i: int, product_name: str):
+            async with semaphore:
+                logger.info(f"Dosage request {i}/{len(unknown)} for: {product_name}")
+                with span("step2.llm_lookup", product=product_name):
+                    return await asyncio.wait_for(
+                        self.rag_chain_dosage_no_history.ainvoke({"input": product_name}),
+                        timeout=settings.DOSAGE_LOOKUP_TIMEOUT
+                    )
+
+        results = await asyncio.gather(
+            *(lookup(i, product_name) for i, product_name in enumerate(unknown, 1)),
+            return_exceptions=True
+        )
+
+        for product_name, result in zip(unknown, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Dosage request failed for {product_name}: {result!r}")
+                continue
+            answers[product_name] = result["answer"]
+        return self._format_dosages(product_names, answers)
+
+    def _run_product_steps(self, user_prompt: str) -> str:
+        """STEP 1 и STEP 2: вход для финальной цепочки (сам запрос — для общего вопроса)"""
+        with span("step1.identify_products") as step1:
+            product_names = self._mentioned_products(user_prompt)
+            if product_names is None:
+                logger.info("STEP 1 - Product identification WITHOUT history")
+                product_names = self._products_from_answer(self._identify_products(user_prompt))
+            step1.set_attribute("products", len(product_names))
+
+        if not product_names:
+            logger.info("General question detected, using main conversational chain with history")
+            return user_prompt
+
+        logger.info(f"Products identified: {product_names}")
+        logger.info("STEP 2 - Dosage info WITHOUT history")
+        with span("step2.dosage", products=len(product_names)):
+            dosage_results = self._lookup_dosages(product_names)
+        logger.info(f"Generating final answer with info about {len(dosage_results)} products")
+        return self._build_final_input(user_prompt, dosage_results)
+
+    async def _arun_product_steps(self, user_prompt: str) -> str:
+        with span("step1.identify_products") as step1:
+            product_names = self._mentioned_products(user_prompt)
+            if product_names is None:
+                logger.info("STEP 1 - Product identification WITHOUT history")
+                product_names = self._products_from_answer(await self._aidentify_products(user_prompt))
+            step1.set_attribute("products", len(product_names))
+
+        if not product_names:
+            logger.info("General question detected, using main conversational chain with history")
+            return user_prompt
+
+        logger.info(f"Products identified: {product_names}")
+        logger.info("STEP 2 - Dosage info WITHOUT history")
+        with span("step2.dosage", products=len(product_names)):
+            dosage_results = await self._alookup_dosages(product_names)
+        logger.info(f"Generating final answer with info about {len(dosage_results)} products")
+        return self._build_final_input(user_prompt, dosage_results)
+
+    async def _alookup_cached_answer(self, user_prompt: str, session_id: str, generation: tuple):
+        """(можно ли кэшировать ответ, готовый ответ или None, эмбеддинг запроса)"""
+        if not await self._ais_cacheable_turn(session_id):
+            return False, None, None
+        with span("answer_cache.lookup") as lookup_span:
+            cached_answer, query_vector = await self.answer_cache.alookup(user_prompt, generation)
+            lookup_span.set_attribute("hit", cached_answer is not None)
+        if cached_answer is not None:
+            logger.info(f"Answer cache hit for session {session_id}")
+            await self.asave_to_main_history(session_id, user_prompt, cached_answer)
+        return True, cached_answer, query_vector
+
     def chat(self, user_prompt, session_id):
         logger.info(f"Processing query for session {session_id}: {user_prompt[:100]}...")
 
         main_conversational_chain = self.create_conversational_rag_chain(self.rag_chain_final, "main")
 
-        final_answer = None
+        generation = self._cache_generation()
+        cacheable = self._is_cacheable_turn(session_id)
 
         try:
-            logger.info("STEP 1 - Product identification WITHOUT history")
-            
-            result1 = self.rag_chain_products_no_history.invoke({"input": user_prompt})
-
-            if result1["answer"] == "0":
-                logger.info("General question detected, using main conversational chain with history")
-                
+            query_vector = None
+            if cacheable:
+                with span("answer_cache.lookup") as lookup_span:
+                    cached_answer, query_vector = self.answer_cache.lookup(user_prompt, generation)
+                    lookup_span.set_attribute("hit", cached_answer is not None)
+                if cached_answer is not None:
+                    logger.info(f"Answer cache hit for session {session_id}")
+                    self.save_to_main_history(session_id, user_prompt, cached_answer)
+                    return cached_answer
+
+            final_input = self._run_product_steps(user_prompt)
+
+            logger.info("STEP 3 - Final answer with history")
+            with span("step3.final_answer"):
                 result = main_conversational_chain.invoke(
-                    {"input": user_prompt},
+                    {"input": final_input},
                     config={"configurable": {"session_id": session_id}}
                 )
-                final_answer = result["answer"]
-                
-            else:
-                product_names = [line.strip() for line in result1["answer"].split("\n") if line.strip()]
-                logger.info(f"Products identified: {product_names}")
+            final_answer = result["answer"]
 
-                logger.info("STEP 2 - Dosage info WITHOUT history")
-                dosage_results = []
-                
-                for i, product_name in enumerate(product_names, 1):
-                    logger.info(f"Dosage request {i}/{len(product_names)} for: {product_name}")
-                    
-                    result = self.rag_chain_dosage_no_history.invoke({"input": product_name})
-                    dosage_results.append(f"{product_name}\n{result['answer']}")
+            if cacheable:
+                self.answer_cache.store(user_prompt, final_answer, generation, query_vector)
 
-                final_input = user_prompt.strip() + "\n\n" + "\n\n".join(dosage_results)
+            logger.info(f"Generated final answer, length: {len(final_answer)} chars")
+            return final_answer
 
-                if len(final_input) > MAX_CONTEXT_LENGTH:
-                    user_query_part = user_prompt.strip() + "\n\n"
-                    available_space = MAX_CONTEXT_LENGTH - len(user_query_part) - 100
-                    truncated_dosage = "\n\n".join(dosage_results)[:available_space]
-                    final_input = user_query_part + truncated_dosage + "\n\n[Контекст обрезан]"
+        except Exception as e:
+            logger.error(f"Error in chat processing: {e}")
+            raise e
 
-                logger.info(f"Generating final answer with info about {len(dosage_results)} products")
+    async def achat(self, user_prompt, session_id):
+        """Async-версия chat(): все цепочки через ainvoke, история через async-пул"""
+        logger.info(f"Processing async query for session {session_id}: {user_prompt[:100]}...")
 
-                logger.info("STEP 3 - Final answer with history")
-                
-                final_answer_result = main_conversational_chain.invoke(
+        main_conversational_chain = self.create_conversational_rag_chain(self.rag_chain_final, "main")
+
+        generation = self._cache_generation()
+
+        try:
+            cacheable, cached_answer, query_vector = await self._alookup_cached_answer(
+                user_prompt, session_id, generation)
+            if cached_answer is not None:
+                return cached_answer
+
+            final_input = await self._arun_product_steps(user_prompt)
+
+            logger.info("STEP 3 - Final answer with history")
+            with span("step3.final_answer"):
+                result = await main_conversational_chain.ainvoke(
                     {"input": final_input},
                     config={"configurable": {"session_id": session_id}}
                 )
-                final_answer = final_answer_result["answer"]
+            final_answer = result["answer"]
+
+            if cacheable:
+                self.answer_cache.store(user_prompt, final_answer, generation, query_vector)
 
             logger.info(f"Generated final answer, length: {len(final_answer)} chars")
             return final_answer
 
         except Exception as e:
-            logger.error(f"Error in chat processing: {e}")
+            logger.error(f"Error in async chat processing: {e}")
+            raise e
+
+    async def astream_chat(self, user_prompt, session_id) -> AsyncIterator[str]:
+        """Как achat(), но ответ STEP 3 отдаётся частями по мере генерации"""
+        logger.info(f"Processing streamed query for session {session_id}: {user_prompt[:100]}...")
+
+        main_conversational_chain = self.create_conversational_rag_chain(self.rag_chain_final, "main")
+
+        generation = self._cache_generation()
+
+        try:
+            cacheable, cached_answer, query_vector = await self._alookup_cached_answer(
+                user_prompt, session_id, generation)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+            final_input = await self._arun_product_steps(user_prompt)
+
+            logger.info("STEP 3 - Streaming final answer with history")
+            parts = []
+            with span("step3.final_answer", streaming=True) as step3:
+                async for chunk in main_conversational_chain.astream(
+                    {"input": final_input},
+                    config={"configurable": {"session_id": session_id}}
+                ):
+                    token = chunk.get("answer")
+                    if token:
+                        parts.append(token)
+                        yield token
+                step3.set_attribute("chunks", len(parts))
+            final_answer = "".join(parts)
+
+            if cacheable:
+                self.answer_cache.store(user_prompt, final_answer, generation, query_vector)
+
+            logger.info(f"Streamed final answer, length: {len(final_answer)} chars")
+
+        except Exception as e:
+            logger.error(f"Error in streamed chat processing: {e}")
             raise e
 
+    def _on_prompt_changed(self, version, system_prompt: str):
+        if version is not None and version == self.prompt_version:
+            return
+        logger.info(f"Rebuilding chains for prompt version {version}")
+
+        self.rag_chain_final_no_rag = self.create_rag_chain(self.llm, self.history_aware_retriever_limited,
+                                                            system_prompt)
+        self.rag_chain_final = self.create_rag_chain(self.llm, self.history_aware_retriever, system_prompt)
+        self.prompt_version = version
+
     def update_prompt(self, new_prompt: str) -> bool:
         if self.prompt_service.update_prompt(new_prompt):
-            system_prompt = self.prompt_service.get_current_prompt()
-
-            self.rag_chain_final_no_rag = self.create_rag_chain(self.llm, self.history_aware_retriever_limited,
-                                                                system_prompt)
-            self.rag_chain_final = self.create_rag_chain(self.llm, self.history_aware_retriever, system_prompt)
+            self._on_prompt_changed(
+                self.prompt_service.get_current_version(),
+                self.prompt_service.get_current_prompt()
+            )
+            return True
+        return False
 
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        if await self.prompt_service.aupdate_prompt(new_prompt):
+            self._on_prompt_changed(
+                self.prompt_service.get_current_version(),
+                await self.prompt_service.aget_current_prompt()
+            )
             return True
         return False
 
     def clear_history(self, session_id: str) -> bool:
         try:
             main_session_uuid = self.generate_session_uuid(session_id, "main")
-            cursor = self.postgres_conn.cursor()
-            cursor.execute(
-                f"DELETE FROM {self.postgres_table_name} WHERE session_id = %s",
-                (main_session_uuid,)
-            )
-            deleted_count = cursor.rowcount
-            self.postgres_conn.commit()
-            cursor.close()
+            with self.history_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"DELETE FROM {self.postgres_table_name} WHERE session_id = %s",
+                        (main_session_uuid,)
+                    )
+                    deleted_count = cursor.rowcount
+                    cursor.execute(
+                        f"DELETE FROM {self.postgres_table_name}_totals WHERE session_id = %s",
+                        (main_session_uuid,)
+                    )
+                conn.commit()
 
             logger.info(f"History cleared: {deleted_count} PostgreSQL records for user {session_id}")
             return True
@@ -518,8 +1060,10 @@ class AQPAssistant:
 
 
 class ColabKnowledgeService(KnowledgeService):
-    def __init__(self):
-        self.prompt_service = PostgresPromptService()
+    kb_sync: KnowledgeBaseSync = None
+
+    def __init__(self, prompt_service: PromptService = None):
+        self.prompt_service = prompt_service or PostgresPromptService()
         
         meta = kb_status_meta()
         csv_path = meta.get("csv_path")
@@ -531,12 +1075,25 @@ class ColabKnowledgeService(KnowledgeService):
             logger.info(f"Using default CSV path: {settings.CSV_FILE_PATH}")
             self.assistant = AQPAssistant(settings.CSV_FILE_PATH, self.prompt_service)
 
+        # Индекс, пересобранный другой репликой, подменяется здесь так же, как после своей загрузки CSV
+        if settings.KB_SYNC_ENABLED:
+            self.kb_sync = KnowledgeBaseSync(self.assistant.hot_swap_retriever)
+
     def process_query(self, query: str, session_id: str) -> str:
         return self.assistant.chat(query, session_id)
 
+    async def aprocess_query(self, query: str, session_id: str) -> str:
+        return await self.assistant.achat(query, session_id)
+
+    def astream_query(self, query: str, session_id: str) -> AsyncIterator[str]:
+        return self.assistant.astream_chat(query, session_id)
+
     def update_prompt(self, new_prompt: str) -> bool:
         return self.assistant.update_prompt(new_prompt)
 
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        return await self.assistant.aupdate_prompt(new_prompt)
+
     def clear_history(self, session_id: str) -> bool:
         return self.assistant.clear_history(session_id)
 
@@ -554,7 +1111,9 @@ class ColabKnowledgeService(KnowledgeService):
         try:
             new_retriever = get_current_retriever()
             if new_retriever:
-                self.assistant.hot_swap_retriever(new_retriever)
+                self.assistant.hot_swap_retriever(new_retriever, get_current_catalog())
+                if self.kb_sync is not None:
+                    self.kb_sync.mark_applied(meta.get("generation"))
                 logger.info("Successfully performed hot swap of retriever")
                 return True, "✅ " + msg, meta
             else:
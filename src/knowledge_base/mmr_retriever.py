@@ -0,0 +1,100 @@
+import logging
+from typing import Any, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(matrix: np.ndarray, query: np.ndarray, k: int, fetch_k: int, lambda_mult: float) -> List[int]:
+    """MMR по нормализованной матрице: те же формулы, что в LangChain, но матричными операциями.
+
+    Кандидаты — fetch_k ближайших по косинусу; на каждом шаге пересчитывается только
+    близость к последнему выбранному документу.
+    """
+    n = matrix.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    query = query.astype(np.float32, copy=False)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    similarity = matrix @ query
+    fetch_k = min(fetch_k, n)
+    if fetch_k < n:
+        candidates = np.argpartition(-similarity, fetch_k - 1)[:fetch_k]
+    else:
+        candidates = np.arange(n)
+    candidates = candidates[np.argsort(-similarity[candidates], kind="stable")]
+
+    vectors = matrix[candidates]
+    to_query = similarity[candidates]
+    first = 0
+    selected = [first]
+    redundancy = vectors @ vectors[first]
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+
+    for _ in range(min(k, len(candidates)) - 1):
+        scores = lambda_mult * to_query - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, vectors @ vectors[best], out=redundancy)
+
+    return [int(candidates[i]) for i in selected]
+
+
+class NumpyMMRRetriever(BaseRetriever):
+    """MMR-ретривер по векторам индекса, собранным в одну нормализованную матрицу float32"""
+
+    embeddings: Any
+    matrix: Any
+    documents: List[Document]
+    k: int = 10
+    fetch_k: int = 20
+    lambda_mult: float = 0.25
+
+    @classmethod
+    def from_faiss(cls, vectorstore, **kwargs) -> "NumpyMMRRetriever":
+        index = vectorstore.index
+        matrix = normalize_rows(index.reconstruct_n(0, index.ntotal))
+        mapping = vectorstore.index_to_docstore_id
+        documents = [vectorstore.docstore.search(mapping[i]) for i in range(index.ntotal)]
+        return cls(embeddings=vectorstore.embedding_function, matrix=matrix, documents=documents, **kwargs)
+
+    def _search(self, query_vector: List[float]) -> List[Document]:
+        ids = mmr_select(self.matrix, np.asarray(query_vector, dtype=np.float32),
+                         self.k, self.fetch_k, self.lambda_mult)
+        return [self.documents[i] for i in ids]
+
+    def _get_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        return self._search(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None, **kwargs):
+        return self._search(await self.embeddings.aembed_query(query))
+
+
+def build_vector_retriever(vectorstore, embeddings=None, k: int = 10, lambda_mult: float = 0.25) -> BaseRetriever:
+    """Векторный MMR-ретривер; если векторы из индекса не достать — стандартный MMR LangChain.
+
+    embeddings — для эмбеддинга запросов (например, с кэшем); по умолчанию — embeddings индекса.
+    """
+    if embeddings is not None:
+        vectorstore.embedding_function = embeddings
+    try:
+        retriever = NumpyMMRRetriever.from_faiss(vectorstore, k=k, lambda_mult=lambda_mult)
+        logger.info(f"Built NumPy MMR retriever over {retriever.matrix.shape[0]} vectors")
+        return retriever
+    except Exception as e:
+        logger.warning(f"Can't reconstruct FAISS vectors, using LangChain MMR: {e}")
+        return vectorstore.as_retriever(
+            search_type="mmr", search_kwargs={'k': k, 'lambda_mult': lambda_mult})
@@ -0,0 +1,321 @@
+import os
+import re
+import csv
+import json
+import difflib
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FILE_NAME = "products.json"
+
+BRAND = "aquadoctor"
+FUZZY_CUTOFF = 0.85
+# Нечёткое совпадение — только если без бренда в названии осталось хотя бы столько символов
+MIN_FUZZY_KEY = 3
+MAX_ALIAS_TOKENS = 8
+
+# Кириллические буквы, которые пишут вместо латинских в кодах препаратов (C-60Т, О2)
+_LOOKALIKES = str.maketrans("авекмнорстухі", "abekmhopctyxi")
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_LATIN_OR_DIGIT_RE = re.compile(r"[a-z0-9]")
+_PH_PLUS_RE = re.compile(r"\b(?:ph|рн)\s*\+")
+_PH_MINUS_RE = re.compile(r"\b(?:ph|рн)\s*[-–−](?!\w)")
+_WORDS = {"рн": "ph", "мінус": "minus", "минус": "minus", "плюс": "plus"}
+# Хвост названия после кода препарата: «в таблетках 200 г», «(Сірчана 35%)», «, 25 кг»
+_NAME_TAIL_RE = re.compile(r"\s+(?:в|у)\s+|[(,]")
+_LIST_MARKER_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+# «CW CleanWaterline Крок 2» → код CW2
+_STEP_RE = re.compile(r"\b(?:крок|шаг|step)\s*(\d+)\s*$", re.IGNORECASE)
+# «pH Minus HL» → код pH-HL
+_PH_VARIANT_RE = re.compile(r"^ph\s+(minus|plus)\s+(\S+)$", re.IGNORECASE)
+# Наборы «3 в 1», «5 в 1» — в STEP 1 раскладываются на отдельные препараты
+_KIT_RE = re.compile(r"\b\d\s*(?:в|у|in)\s*1\b", re.IGNORECASE)
+# Больше препаратов STEP 1 не возвращает (PRODUCTS_PROMPT)
+MAX_STEP1_PRODUCTS = 4
+
+# Приоритет алиаса: меньше — точнее
+_FULL_NAME, _SHORT_NAME, _CODE = 0, 1, 2
+
+
+def name_tokens(text: str) -> List[str]:
+    """Токены для сравнения названий: регистр, пунктуация и кириллица в латинских кодах не важны"""
+    text = (text or "").casefold()
+    text = _PH_PLUS_RE.sub(" ph plus ", text)
+    text = _PH_MINUS_RE.sub(" ph minus ", text)
+    tokens = []
+    for word in text.split():
+        # Слово без латиницы и цифр не трогаем, чтобы «мс» не стало «mc»; «С-60Т» целиком — код
+        if _LATIN_OR_DIGIT_RE.search(word):
+            word = word.translate(_LOOKALIKES)
+        tokens.extend(_WORDS.get(token, token) for token in _TOKEN_RE.findall(word))
+    return tokens
+
+
+def name_key(text: str) -> str:
+    return "".join(name_tokens(text))
+
+
+def _is_code(token: str) -> bool:
+    """C-90Т, MC-T, SMe, PM — но не pH и не обычные слова"""
+    letters = sum(1 for ch in token if ch.isalpha())
+    uppers = sum(1 for ch in token if ch.isupper())
+    return uppers >= 2 or (letters > 0 and any(ch.isdigit() for ch in token))
+
+
+def product_aliases(name: str) -> List[Tuple[str, int]]:
+    aliases = [(name, _FULL_NAME)]
+    pos = name.casefold().find(BRAND)
+    if pos < 0:
+        return aliases
+    short = _NAME_TAIL_RE.split(name[pos + len(BRAND):], maxsplit=1)[0].strip()
+    if not short:
+        return aliases
+    aliases.append((f"{name[pos:pos + len(BRAND)]} {short}", _SHORT_NAME))
+    aliases.append((short, _SHORT_NAME))
+    aliases.extend((code, _CODE) for code in _product_codes(short))
+    return aliases
+
+
+def _product_codes(short: str) -> List[str]:
+    """Коды, которыми препарат называют в инструкциях и PDF: CW2, pH-HL, O2, WC"""
+    words = short.split()
+    codes = []
+    if len(words) > 1 and _is_code(words[0]):
+        codes.append(words[0])
+        step = _STEP_RE.search(short)
+        if step:
+            codes.append(f"{words[0]}{step.group(1)}")
+    ph_variant = _PH_VARIANT_RE.match(short)
+    if ph_variant:
+        codes.append(f"pH{'-' if ph_variant.group(1).lower() == 'minus' else '+'}{ph_variant.group(2)}")
+    # «Water Shock О2» → O2; составные «O2/pH», «Cl/pH» у тестеров — не коды препаратов
+    elif len(words) > 1 and _is_code(words[-1]) and not _is_code(words[0]) and "/" not in words[-1]:
+        codes.append(words[-1])
+    if len(words) > 1 and all(w.isalpha() and w[0].isupper() and w[1:].islower() for w in words):
+        codes.append("".join(w[0] for w in words))
+    return codes
+
+
+# Колонки CSV распознаются по началу заголовка, регистр не важен
+_COLUMNS = {
+    "name": ("препарат",),
+    "packaging": ("фасування",),
+    "form": ("форма",),
+    "url": ("посилання", "url"),
+    "dosage": ("дозування",),
+}
+
+
+class Product(NamedTuple):
+    name: str
+    dosage: str = ""
+    packaging: str = ""
+    form: str = ""
+    url: str = ""
+
+    def dosage_summary(self) -> str:
+        """Текст для STEP 3 вместо ответа DOSAGE_PROMPT"""
+        lines = []
+        if self.dosage:
+            lines.append(f"Дозування: {self.dosage}")
+        if self.packaging:
+            packages = [p.strip() for p in self.packaging.splitlines() if p.strip()]
+            lines.append(f"Фасування: {'; '.join(packages)}")
+        if self.form:
+            lines.append(f"Форма випуску: {self.form}")
+        return "\n".join(lines)
+
+
+def _map_columns(header: List[str]) -> Dict[str, int]:
+    mapping = {}
+    for i, title in enumerate(header):
+        title = title.strip().lower()
+        for field, prefixes in _COLUMNS.items():
+            if field not in mapping and title.startswith(prefixes):
+                mapping[field] = i
+    return mapping
+
+
+def read_products_csv(path: str) -> List[Product]:
+    """Строки каталога из CSV; пустой список, если в файле нет колонки «Препарат»"""
+    for delim in [",", ";"]:
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                rows = list(csv.reader(f, delimiter=delim))
+        except Exception as e:
+            logger.warning(f"Failed to parse CSV with delimiter '{delim}': {e}")
+            continue
+        if not rows:
+            return []
+
+        mapping = _map_columns(rows[0])
+        if "name" not in mapping:
+            continue
+
+        products = []
+        for row in rows[1:]:
+            values = {
+                field: row[i].strip() if i < len(row) else ""
+                for field, i in mapping.items()
+            }
+            if values["name"]:
+                products.append(Product(**values))
+        logger.info(f"Parsed {len(products)} products from {path}")
+        return products
+
+    logger.info(f"No product column found in {path}, product catalog is empty")
+    return []
+
+
+class ProductCatalog:
+    """Таблица препаратов из CSV: дозировка и фасовка без LLM, разрешение названий по алиасам и нечёткому совпадению"""
+
+    def __init__(self, products: List[Product]):
+        self.products = products
+        self._aliases: Dict[str, List[Tuple[int, Product]]] = {}
+        for product in products:
+            for alias, priority in product_aliases(product.name):
+                key = name_key(alias)
+                if len(key) >= 2:
+                    self._aliases.setdefault(key, []).append((priority, product))
+        # Для нечёткого поиска бренд из ключей убран: «aquadoctor» сам по себе похож на любой препарат
+        self._fuzzy_keys: Dict[str, List[str]] = {}
+        for key in self._aliases:
+            self._fuzzy_keys.setdefault(key.replace(BRAND, ""), []).append(key)
+        self._order = {product: i for i, product in enumerate(products)}
+
+    def _candidates(self, key: str) -> List[Product]:
+        entries = self._aliases.get(key)
+        if not entries:
+            return []
+        best = min(priority for priority, _ in entries)
+        candidates = []
+        for priority, product in entries:
+            if priority == best and product not in candidates:
+                candidates.append(product)
+        return candidates
+
+    def _pick(self, candidates: List[Product], key: str) -> Product:
+        # «pH Minus» — это и гранулы, и жидкие варианты: берём самое близкое и самое короткое название,
+        # при полном равенстве — первое в каталоге, чтобы ответ не зависел от порядка алиасов
+        return max(
+            candidates,
+            key=lambda p: (
+                difflib.SequenceMatcher(None, key, name_key(p.name)).ratio(),
+                -len(p.name),
+                -self._order.get(p, 0)
+            )
+        )
+
+    def _fuzzy(self, key: str) -> Optional[Product]:
+        core = key.replace(BRAND, "")
+        if len(core) < MIN_FUZZY_KEY:
+            return None
+        matches = difflib.get_close_matches(core, list(self._fuzzy_keys), n=5, cutoff=FUZZY_CUTOFF)
+        if not matches:
+            return None
+        # Несколько ключей с одинаковым сходством — решает _pick среди всех их кандидатов
+        scores = {match: difflib.SequenceMatcher(None, core, match).ratio() for match in matches}
+        best = max(scores.values())
+        candidates = []
+        for match in matches:
+            if scores[match] == best:
+                for alias_key in self._fuzzy_keys[match]:
+                    candidates.extend(p for p in self._candidates(alias_key) if p not in candidates)
+        return self._pick(candidates, key)
+
+    def resolve(self, name: str) -> Optional[Product]:
+        """Препарат каталога по названию от пользователя или LLM; None — такого препарата нет"""
+        key = name_key(_LIST_MARKER_RE.sub("", name or ""))
+        if not key:
+            return None
+
+        candidates = self._candidates(key)
+        if candidates:
+            return self._pick(candidates, key)
+
+        mentions, _ = self.find_mentions(name)
+        if len(mentions) == 1:
+            return mentions[0]
+
+        return self._fuzzy(key)
+
+    def get(self, name: str) -> Optional[Product]:
+        return self.resolve(name)
+
+    def find_mentions(self, text: str) -> Tuple[List[Product], bool]:
+        """Препараты, явно названные в тексте, и признак того, что какое-то упоминание неоднозначно"""
+        tokens = name_tokens(text)
+        found, ambiguous = [], False
+        i = 0
+        while i < len(tokens):
+            for length in range(min(MAX_ALIAS_TOKENS, len(tokens) - i), 0, -1):
+                key = "".join(tokens[i:i + length])
+                if key == BRAND or not _LATIN_OR_DIGIT_RE.search(key):
+                    continue
+                candidates = self._candidates(key)
+                if not candidates:
+                    continue
+                if len(candidates) > 1:
+                    ambiguous = True
+                elif candidates[0] not in found:
+                    found.append(candidates[0])
+                i += length
+                break
+            else:
+                i += 1
+        return found, ambiguous
+
+    @staticmethod
+    def needs_product_rules(text: str, mentioned: List[Product]) -> bool:
+        """Сработало бы правило PRODUCTS_PROMPT, которое поиск упоминаний не применяет: набор «N в 1»
+        раскладывается на препараты, к pH Minus добавляется pH Plus, препаратов не больше MAX_STEP1_PRODUCTS"""
+        if len(mentioned) > MAX_STEP1_PRODUCTS:
+            return True
+        if _KIT_RE.search(text) or any(_KIT_RE.search(p.name) for p in mentioned):
+            return True
+        keys = [name_key(p.name) for p in mentioned]
+        return any("phminus" in key for key in keys) and not any("phplus" in key for key in keys)
+
+    def normalize_names(self, names: List[str]) -> List[str]:
+        """Названия из STEP 1 → канонические названия каталога.
+
+        Название, которое каталог не узнал, остаётся как есть: дозировку для него STEP 2 найдёт через LLM.
+        """
+        if not self.products:
+            return names
+        resolved = []
+        for name in names:
+            product = self.resolve(name)
+            if product is None:
+                logger.info(f"Product '{name}' not found in catalog, keeping it for the LLM lookup")
+            name = product.name if product is not None else _LIST_MARKER_RE.sub("", name).strip()
+            if name not in resolved:
+                resolved.append(name)
+        return resolved
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, PRODUCTS_FILE_NAME), "w", encoding="utf-8") as f:
+            json.dump([p._asdict() for p in self.products], f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["ProductCatalog"]:
+        path = os.path.join(directory, PRODUCTS_FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls([Product(**item) for item in json.load(f)])
+        except Exception as e:
+            logger.warning(f"Failed to load product catalog from {path}: {e}")
+            return None
+
+    @classmethod
+    def from_csv(cls, path: str) -> "ProductCatalog":
+        return cls(read_products_csv(path))
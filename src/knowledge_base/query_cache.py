@@ -0,0 +1,267 @@
+import re
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+_SPACES_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def normalize_query(text: str) -> str:
+    """Регистр, пунктуация и пробелы не влияют на ключ кэша"""
+    text = _PUNCTUATION_RE.sub(" ", (text or "").casefold())
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def _numbers(text: str) -> Tuple[str, ...]:
+    return tuple(sorted(n.replace(",", ".") for n in _NUMBER_RE.findall(text or "")))
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера, необязательным TTL и счётчиками попаданий.
+
+    on_evict(key) вызывается вне блокировки для записей, вытесненных по размеру или TTL.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evicted(self, keys: List[Hashable]) -> None:
+        if self.on_evict is not None:
+            for key in keys:
+                self.on_evict(key)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        expired = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                expired = self._entries.pop(key, None) is not None
+                self.misses += 1
+                value = None
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[1]
+        if expired:
+            self._evicted([key])
+        return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Значение без учёта в статистике и без сдвига в LRU-порядке"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                return None
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        evicted = []
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+        self._evicted(evicted)
+
+    def values(self) -> List[Any]:
+        now = time.monotonic()
+        with self._lock:
+            return [value for expires_at, value in self._entries.values() if expires_at is None or expires_at >= now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class _VectorIndex:
+    """Нормированные эмбеддинги запросов построчно в одной матрице.
+
+    Строка пишется при store и освобождается при вытеснении записи, поэтому поиск ближайшего —
+    одно умножение матрицы на вектор без пересборки на каждый запрос.
+    """
+
+    INITIAL_ROWS = 64
+
+    def __init__(self):
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[Optional[Hashable]] = []
+        self._slots: Dict[Hashable, int] = {}
+        self._free: List[int] = []
+
+    def add(self, key: Hashable, vector: np.ndarray) -> None:
+        self.remove(key)
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._keys)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.INITIAL_ROWS, len(vector)), dtype=np.float32)
+            elif slot >= len(self._matrix):
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+            self._keys.append(None)
+        self._matrix[slot] = vector
+        self._keys[slot] = key
+        self._slots[key] = slot
+
+    def remove(self, key: Hashable) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._matrix[slot] = 0.0
+            self._keys[slot] = None
+            self._free.append(slot)
+
+    def search(self, q: np.ndarray, threshold: float) -> List[Tuple[float, Hashable]]:
+        """(близость, ключ) не ниже threshold, по убыванию близости"""
+        if not self._slots:
+            return []
+        scores = self._matrix[:len(self._keys)] @ q
+        above = np.flatnonzero(scores >= threshold)
+        above = above[np.argsort(-scores[above])]
+        return [(float(scores[i]), self._keys[i]) for i in above if self._keys[i] is not None]
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+
+class SemanticAnswerCache:
+    """Кэш готовых ответов для запросов без истории.
+
+    Сначала ищется точное совпадение нормализованного запроса, затем — ближайший по
+    эмбеддингу запрос с косинусной близостью не ниже threshold и теми же числами
+    (объём басейну тощо). Поколение (чексумма базы знаний, версия промта) меняется —
+    кэш очищается.
+    """
+
+    def __init__(self, embeddings: Optional[Embeddings], max_size: int, ttl: float, threshold: float):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self._entries = LRUCache(max_size, ttl, on_evict=self._on_evict)
+        self._index = _VectorIndex()
+        self._generation = None
+        self._lock = Lock()
+        self.semantic_hits = 0
+
+    def _on_evict(self, key: Hashable) -> None:
+        with self._lock:
+            self._index.remove(key)
+
+    def _check_generation(self, generation: Hashable) -> None:
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None:
+                    logger.info(f"Answer cache generation changed to {generation}, clearing {len(self._entries)} entries")
+                self._entries.clear()
+                self._index.clear()
+                self._generation = generation
+
+    def _semantic_enabled(self) -> bool:
+        return self.embeddings is not None and self.threshold < 1.0
+
+    def _nearest(self, query: str, vector: List[float]) -> Optional[str]:
+        q = np.asarray(vector, dtype=np.float32)
+        q /= (np.linalg.norm(q) or 1.0)
+        with self._lock:
+            matches = self._index.search(q, self.threshold)
+        numbers = _numbers(query)
+        for score, key in matches:
+            entry = self._entries.peek(key)
+            if entry is None:
+                # Истёк TTL, а до get() по этому ключу дело не дошло
+                self._on_evict(key)
+                continue
+            if entry["numbers"] == numbers:
+                with self._lock:
+                    self.semantic_hits += 1
+                logger.info(f"Semantic answer cache hit (score={score:.3f}): {entry['query'][:100]}")
+                return entry["answer"]
+        return None
+
+    def _entry(self, query: str, answer: str, vector: Optional[List[float]]) -> dict:
+        if vector is not None:
+            v = np.asarray(vector, dtype=np.float32)
+            vector = v / (np.linalg.norm(v) or 1.0)
+        return {"query": query, "answer": answer, "vector": vector, "numbers": _numbers(query)}
+
+    def lookup(self, query: str, generation: Hashable) -> Tuple[Optional[str], Optional[List[float]]]:
+        """Возвращает (ответ или None, эмбеддинг запроса для последующего store)"""
+        self._check_generation(generation)
+        entry = self._entries.get(normalize_query(query))
+        if entry is not None:
+            return entry["answer"], entry["vector"]
+        if not self._semantic_enabled():
+            return None, None
+        try:
+            vector = self.embeddings.embed_query(query)
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed: {e}")
+            return None, None
+        return self._nearest(query, vector), vector
+
+    async def alookup(self, query: str, generation: Hashable) -> Tuple[Optional[str], Optional[List[float]]]:
+        self._check_generation(generation)
+        entry = self._entries.get(normalize_query(query))
+        if entry is not None:
+            return entry["answer"], entry["vector"]
+        if not self._semantic_enabled():
+            return None, None
+        try:
+            vector = await self.embeddings.aembed_query(query)
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed: {e}")
+            return None, None
+        return self._nearest(query, vector), vector
+
+    def store(self, query: str, answer: str, generation: Hashable, vector: Optional[List[float]] = None) -> None:
+        # Ответ, посчитанный до смены базы знаний или промта, не сохраняем
+        if not answer or generation != self._generation:
+            return
+        key = normalize_query(query)
+        entry = self._entry(query, answer, vector)
+        self._entries.set(key, entry)
+        if entry["vector"] is not None:
+            with self._lock:
+                self._index.add(key, entry["vector"])
+
+    def clear(self) -> None:
+        self._entries.clear()
+        with self._lock:
+            self._index.clear()
+
+    def stats(self) -> dict:
+        stats = self._entries.stats()
+        stats["semantic_hits"] = self.semantic_hits
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + self.semantic_hits) / lookups, 4) if lookups else 0.0
+        return stats
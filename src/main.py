@@ -5,6 +5,8 @@ from src.config.settings import settings
 from src.knowledge_base.knowledge_service import ColabKnowledgeService
 from src.auth.auth_service import PostgresAuthService
 from src.prompt.prompt_service import PostgresPromptService
+from src.tracing.tracer import setup_tracing
+from src.tracing.langchain_handler import install_langchain_tracing
 
 logger = logging.getLogger(__name__)
 
@@ -27,15 +29,18 @@ def ensure_directories_exist():
 def main():
     ensure_directories_exist()
 
+    if setup_tracing():
+        install_langchain_tracing()
+
     prompt_service = PostgresPromptService()
 
     if not prompt_service.sync_initial_prompt():
         logger.error("Failed to sync initial prompt.")
         return
 
-    knowledge_service = ColabKnowledgeService()
+    knowledge_service = ColabKnowledgeService(prompt_service)
     auth_service = PostgresAuthService()
-    bot = TelegramBot(settings.TELEGRAM_TOKEN, knowledge_service, auth_service)
+    bot = TelegramBot(settings.TELEGRAM_TOKEN, knowledge_service, auth_service, prompt_service)
     bot.run()
 
 
@@ -1,10 +1,25 @@
 import logging
 from abc import ABC, abstractmethod
-from src.database.db_connection import DatabaseConnection
+from threading import Lock
+from typing import Callable, List, Optional
+from src.database.db_connection import get_pool, get_async_pool
+from src.database.notifications import get_listener
 from src.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+PROMPT_CHANNEL = "system_prompts_changed"
+
+CURRENT_PROMPT_SQL = "SELECT id, prompt_text FROM system_prompts ORDER BY updated_at DESC LIMIT 1"
+
+NOTIFY_SQL = "SELECT pg_notify(%s, %s)"
+
+INSERT_PROMPT_SQL = """
+    INSERT INTO system_prompts (prompt_text, updated_at)
+    VALUES (%s, CURRENT_TIMESTAMP)
+    RETURNING id
+"""
+
 
 class PromptService(ABC):
     @abstractmethod
@@ -19,33 +34,121 @@ class PromptService(ABC):
     def validate_prompt(self, prompt: str) -> bool:
         pass
 
+    @abstractmethod
+    def get_current_version(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def add_change_listener(self, listener: Callable[[Optional[int], str], None]):
+        pass
+
+    @abstractmethod
+    async def aget_current_prompt(self) -> str:
+        pass
+
+    @abstractmethod
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        pass
+
 
 class PostgresPromptService(PromptService):
+    """Промт кэшируется в памяти вместе с версией (id строки system_prompts).
+
+    Другие процессы узнают о новом промте через NOTIFY на канале PROMPT_CHANNEL
+    и перечитывают его только если версия действительно изменилась.
+    """
+
     def __init__(self):
-        self.db = DatabaseConnection()
+        self.pool = get_pool()
+        self.async_pool = get_async_pool()
+        self._lock = Lock()
+        self._version: Optional[int] = None
+        self._prompt: Optional[str] = None
+        self._listeners: List[Callable[[Optional[int], str], None]] = []
+
+        listener = get_listener()
+        listener.subscribe(PROMPT_CHANNEL, self._on_notify)
+        listener.on_reconnect(self.arefresh)
+
+    def add_change_listener(self, listener: Callable[[Optional[int], str], None]):
+        """listener(version, prompt) вызывается при смене версии промта"""
+        self._listeners.append(listener)
+
+    def get_current_version(self) -> Optional[int]:
+        return self._version
+
+    def _set_current(self, version: Optional[int], prompt: str) -> bool:
+        with self._lock:
+            changed = self._prompt is None or version != self._version
+            self._version = version
+            self._prompt = prompt
+        if changed:
+            logger.info(f"Current prompt version: {version}")
+            for listener in self._listeners:
+                try:
+                    listener(version, prompt)
+                except Exception as e:
+                    logger.error(f"Prompt change listener failed: {e}")
+        return changed
+
+    def _prompt_from_row(self, result) -> str:
+        if result:
+            prompt = result['prompt_text']
+            logger.info(f"Retrieved prompt: {prompt[:100]}... (length: {len(prompt)})")
+            self._set_current(result['id'], prompt)
+            return prompt
+        logger.info("No prompt found in database, returning INITIAL_SYSTEM_PROMPT")
+        # Кэшируется без версии: первый сохранённый промт придёт через NOTIFY
+        self._set_current(None, settings.INITIAL_SYSTEM_PROMPT)
+        return settings.INITIAL_SYSTEM_PROMPT
+
+    def _inserted(self, result) -> bool:
+        if result:
+            logger.info(f"Prompt successfully inserted, ID: {result['id']}")
+            return True
+        logger.error("No ID returned after inserting prompt")
+        return False
 
     def get_current_prompt(self) -> str:
+        if self._prompt is not None:
+            return self._prompt
+        return self.refresh()
+
+    async def aget_current_prompt(self) -> str:
+        if self._prompt is not None:
+            return self._prompt
+        return await self.arefresh()
+
+    async def _on_notify(self, payload: str):
+        if payload and payload == str(self._version):
+            return
+        await self.arefresh()
+
+    def refresh(self) -> str:
+        logger.info("Fetching current prompt from database")
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    logger.debug(f"Executing SQL: {CURRENT_PROMPT_SQL}")
+                    cur.execute(CURRENT_PROMPT_SQL)
+                    return self._prompt_from_row(cur.fetchone())
+        except Exception as e:
+            logger.error(f"Error retrieving prompt: {e}")
+            logger.info("Returning INITIAL_SYSTEM_PROMPT due to error")
+            return settings.INITIAL_SYSTEM_PROMPT
+
+    async def arefresh(self) -> str:
         logger.info("Fetching current prompt from database")
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                logger.debug("Executing SQL: SELECT prompt_text FROM system_prompts ORDER BY updated_at DESC LIMIT 1")
-                cur.execute(
-                    "SELECT prompt_text FROM system_prompts ORDER BY updated_at DESC LIMIT 1"
-                )
-                result = cur.fetchone()
-                if result:
-                    prompt = result['prompt_text']
-                    logger.info(f"Retrieved prompt: {prompt[:100]}... (length: {len(prompt)})")
-                    return prompt
-                logger.info("No prompt found in database, returning INITIAL_SYSTEM_PROMPT")
-                return settings.INITIAL_SYSTEM_PROMPT
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    logger.debug(f"Executing SQL: {CURRENT_PROMPT_SQL}")
+                    await cur.execute(CURRENT_PROMPT_SQL)
+                    return self._prompt_from_row(await cur.fetchone())
         except Exception as e:
             logger.error(f"Error retrieving prompt: {e}")
             logger.info("Returning INITIAL_SYSTEM_PROMPT due to error")
             return settings.INITIAL_SYSTEM_PROMPT
-        finally:
-            self.db.close()
 
     def update_prompt(self, new_prompt: str) -> bool:
         logger.info(f"Updating prompt: {new_prompt[:100]}... (length: {len(new_prompt)})")
@@ -54,30 +157,44 @@ class PostgresPromptService(PromptService):
                 logger.error("Prompt validation failed")
                 return False
 
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                logger.debug(
-                    "Executing SQL: INSERT INTO system_prompts (prompt_text, updated_at) VALUES (%s, CURRENT_TIMESTAMP) RETURNING id")
-                cur.execute(
-                    """
-                    INSERT INTO system_prompts (prompt_text, updated_at)
-                    VALUES (%s, CURRENT_TIMESTAMP)
-                    RETURNING id
-                    """,
-                    (new_prompt,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                if result:
-                    logger.info(f"Prompt successfully inserted, ID: {result['id']}")
-                    return True
-                logger.error("No ID returned after inserting prompt")
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    logger.debug(
+                        "Executing SQL: INSERT INTO system_prompts (prompt_text, updated_at) VALUES (%s, CURRENT_TIMESTAMP) RETURNING id")
+                    cur.execute(INSERT_PROMPT_SQL, (new_prompt,))
+                    result = cur.fetchone()
+                    if result:
+                        cur.execute(NOTIFY_SQL, (PROMPT_CHANNEL, str(result['id'])))
+                    conn.commit()
+                    if result:
+                        self._set_current(result['id'], new_prompt)
+                    return self._inserted(result)
+        except Exception as e:
+            logger.error(f"Error updating prompt: {e}")
+            return False
+
+    async def aupdate_prompt(self, new_prompt: str) -> bool:
+        logger.info(f"Updating prompt: {new_prompt[:100]}... (length: {len(new_prompt)})")
+        try:
+            if not self.validate_prompt(new_prompt):
+                logger.error("Prompt validation failed")
                 return False
+
+            async with self.async_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    logger.debug(
+                        "Executing SQL: INSERT INTO system_prompts (prompt_text, updated_at) VALUES (%s, CURRENT_TIMESTAMP) RETURNING id")
+                    await cur.execute(INSERT_PROMPT_SQL, (new_prompt,))
+                    result = await cur.fetchone()
+                    if result:
+                        await cur.execute(NOTIFY_SQL, (PROMPT_CHANNEL, str(result['id'])))
+                    await conn.commit()
+                    if result:
+                        self._set_current(result['id'], new_prompt)
+                    return self._inserted(result)
         except Exception as e:
             logger.error(f"Error updating prompt: {e}")
             return False
-        finally:
-            self.db.close()
 
     def validate_prompt(self, prompt: str) -> bool:
         if not prompt or prompt.strip() == '"""':
@@ -96,30 +213,31 @@ class PostgresPromptService(PromptService):
     def sync_initial_prompt(self) -> bool:
         logger.info("Syncing initial system prompt to database")
         try:
-            conn = self.db.connect()
-            with conn.cursor() as cur:
-                logger.debug("Executing SQL: INSERT INTO system_prompts (prompt_text, created_at, updated_at) ...")
-                cur.execute(
-                    """
-                    INSERT INTO system_prompts (prompt_text, created_at, updated_at)
-                    VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT (id)
-                    DO UPDATE SET
-                        prompt_text = EXCLUDED.prompt_text,
-                        updated_at = CURRENT_TIMESTAMP
-                    RETURNING id
-                    """,
-                    (settings.INITIAL_SYSTEM_PROMPT,)
-                )
-                result = cur.fetchone()
-                conn.commit()
-                if result:
-                    logger.info(f"Initial system prompt synced, ID: {result['id']}")
-                    return True
-                logger.error("No ID returned after syncing initial prompt")
-                return False
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    logger.debug("Executing SQL: INSERT INTO system_prompts (prompt_text, created_at, updated_at) ...")
+                    cur.execute(
+                        """
+                        INSERT INTO system_prompts (prompt_text, created_at, updated_at)
+                        VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                        ON CONFLICT (id)
+                        DO UPDATE SET
+                            prompt_text = EXCLUDED.prompt_text,
+                            updated_at = CURRENT_TIMESTAMP
+                        RETURNING id
+                        """,
+                        (settings.INITIAL_SYSTEM_PROMPT,)
+                    )
+                    result = cur.fetchone()
+                    if result:
+                        cur.execute(NOTIFY_SQL, (PROMPT_CHANNEL, str(result['id'])))
+                    conn.commit()
+                    if result:
+                        logger.info(f"Initial system prompt synced, ID: {result['id']}")
+                        self._set_current(result['id'], settings.INITIAL_SYSTEM_PROMPT)
+                        return True
+                    logger.error("No ID returned after syncing initial prompt")
+                    return False
         except Exception as e:
             logger.error(f"Error syncing initial prompt: {e}")
             return False
-        finally:
-            self.db.close()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import os
+import json
+import queue
+import logging
+import threading
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans: List[dict]) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class JsonlSpanExporter(SpanExporter):
+    """Одна строка JSON на span — удобно читать jq или грузить в pandas"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: List[dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> List[dict]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """OTLP/HTTP с JSON-кодированием (коллектор OpenTelemetry, Jaeger, Tempo — порт 4318)"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def _payload(self, spans: List[dict]) -> dict:
+        otlp_spans = []
+        for span in spans:
+            item = {
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span["start_ns"]),
+                "endTimeUnixNano": str(span["end_ns"]),
+                "attributes": _otlp_attributes(span["attributes"]),
+                "status": {"code": 2, "message": span.get("error") or ""} if span["status"] == "error" else {"code": 1},
+            }
+            if span.get("parent_id"):
+                item["parentSpanId"] = span["parent_id"]
+            otlp_spans.append(item)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": self.service_name}, "spans": otlp_spans}],
+            }]
+        }
+
+    def export(self, spans: List[dict]) -> None:
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(self._payload(spans), default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class BatchSpanProcessor:
+    """Завершённые span'ы копятся в очереди и выгружаются фоновым потоком пачками"""
+
+    def __init__(self, exporters: List[SpanExporter], flush_interval: float = 2.0,
+                 max_batch: int = 256, max_queue: int = 10000):
+        self.exporters = exporters
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        self.dropped = 0
+
+    def on_end(self, span: dict) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Трейсинг не должен тормозить ответы: при переполнении span теряется
+            self.dropped += 1
+
+    def _drain(self) -> List[dict]:
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch: List[dict]) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                logger.warning(f"Span export via {type(exporter).__name__} failed: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            batch = self._drain()
+            while batch:
+                self._export(batch)
+                batch = self._drain()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        batch = self._drain()
+        while batch:
+            self._export(batch)
+            batch = self._drain()
+        for exporter in self.exporters:
+            exporter.shutdown()
@@ -0,0 +1,163 @@
+import time
+import logging
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from src.tracing.tracer import Span, current_span, start_span
+
+logger = logging.getLogger(__name__)
+
+# Цепочки, которые видны в трейсе отдельным span'ом; остальные прозрачны для иерархии
+TRACED_CHAINS = {
+    "RunnableWithMessageHistory": "chain.with_history",
+    # create_retrieval_chain переименовывает history-aware retriever в retrieve_documents
+    "retrieve_documents": "chain.rephrase_and_retrieve",
+    "chat_retriever_chain": "chain.rephrase_and_retrieve",
+    "retrieval_chain": "chain.retrieval",
+    "stuff_documents_chain": "chain.answer_generation",
+}
+
+MAX_ATTRIBUTE_CHARS = 300
+
+
+def _short(text: Any) -> str:
+    text = str(text)
+    return text if len(text) <= MAX_ATTRIBUTE_CHARS else text[:MAX_ATTRIBUTE_CHARS] + "…"
+
+
+def _token_usage(response) -> Dict[str, int]:
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {
+            "llm.input_tokens": usage.get("prompt_tokens"),
+            "llm.output_tokens": usage.get("completion_tokens"),
+            "llm.total_tokens": usage.get("total_tokens"),
+        }
+    # При стриминге счётчики приходят в usage_metadata сообщения
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            input_tokens += metadata.get("input_tokens", 0)
+            output_tokens += metadata.get("output_tokens", 0)
+    if not input_tokens and not output_tokens:
+        return {}
+    return {
+        "llm.input_tokens": input_tokens,
+        "llm.output_tokens": output_tokens,
+        "llm.total_tokens": input_tokens + output_tokens,
+    }
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Span'ы для вызовов LLM (с токенами), ретриверов и ключевых цепочек LangChain"""
+
+    # Вызывается прямо в контексте run'а: родителем становится текущий span хода диалога
+    run_inline = True
+
+    def __init__(self):
+        self._lock = Lock()
+        self._spans: Dict[UUID, Span] = {}
+        self._parents: Dict[UUID, Optional[Span]] = {}
+        self._first_token: Dict[UUID, int] = {}
+
+    def _parent(self, parent_run_id: Optional[UUID]) -> Optional[Span]:
+        with self._lock:
+            if parent_run_id is not None:
+                if parent_run_id in self._spans:
+                    return self._spans[parent_run_id]
+                if parent_run_id in self._parents:
+                    return self._parents[parent_run_id]
+        return current_span()
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, **attributes) -> None:
+        new_span = start_span(name, parent=self._parent(parent_run_id), **attributes)
+        with self._lock:
+            self._spans[run_id] = new_span
+
+    def _end(self, run_id: UUID, error: BaseException = None, **attributes) -> None:
+        with self._lock:
+            finished = self._spans.pop(run_id, None)
+            self._parents.pop(run_id, None)
+            self._first_token.pop(run_id, None)
+        if finished is None:
+            return
+        finished.set_attributes(**attributes)
+        if error is not None:
+            finished.record_exception(error)
+        finished.end()
+
+    # LLM
+
+    def _start_llm(self, serialized, run_id, parent_run_id, kwargs) -> None:
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        model = params.get("model_name") or params.get("model") or metadata.get("ls_model_name")
+        self._start(run_id, parent_run_id, "llm", **{"llm.model": model})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            if run_id not in self._first_token:
+                self._first_token[run_id] = time.time_ns()
+                span_ = self._spans.get(run_id)
+                if span_ is not None and hasattr(span_, "start_ns"):
+                    span_.set_attribute("llm.first_token_ms", round((self._first_token[run_id] - span_.start_ns) / 1e6, 1))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, **_token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # Ретриверы
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "retriever"
+        self._start(run_id, parent_run_id, "retriever", **{"retriever.name": name, "retriever.query": _short(query)})
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, **{"retriever.documents": len(documents)})
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # Цепочки
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        if name in TRACED_CHAINS:
+            self._start(run_id, parent_run_id, TRACED_CHAINS[name])
+        else:
+            parent = self._parent(parent_run_id)
+            with self._lock:
+                self._parents[run_id] = parent
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+_HANDLER_VAR: Optional[ContextVar] = None
+
+
+def install_langchain_tracing() -> TracingCallbackHandler:
+    """Подключает обработчик ко всем run'ам LangChain в процессе (через configure hook)"""
+    global _HANDLER_VAR
+    handler = TracingCallbackHandler()
+    if _HANDLER_VAR is None:
+        _HANDLER_VAR = ContextVar("aqp_tracing_handler", default=handler)
+        register_configure_hook(_HANDLER_VAR, inheritable=True)
+    else:
+        _HANDLER_VAR.set(handler)
+    return handler
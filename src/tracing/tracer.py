@@ -0,0 +1,162 @@
+import time
+import secrets
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from src.config.settings import settings
+from src.tracing.exporters import BatchSpanProcessor, JsonlSpanExporter, OtlpHttpSpanExporter, SpanExporter
+
+logger = logging.getLogger(__name__)
+
+_CURRENT_SPAN: ContextVar[Optional["Span"]] = ContextVar("aqp_current_span", default=None)
+_PROCESSOR: Optional[BatchSpanProcessor] = None
+
+
+class Span:
+    """Интервал работы внутри хода диалога; родитель берётся из текущего контекста (contextvars)"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "ok"
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "error"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self, end_ns: int = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if _PROCESSOR is not None:
+            _PROCESSOR.on_end(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Заглушка, когда трейсинг выключен: вызовы ничего не стоят"""
+
+    trace_id = span_id = parent_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def tracing_enabled() -> bool:
+    return _PROCESSOR is not None
+
+
+def current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+
+def annotate(**attributes) -> None:
+    """Атрибуты для текущего span'а, если он есть"""
+    current = _CURRENT_SPAN.get()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes):
+    """Span без смены текущего контекста; завершить нужно вызовом end()"""
+    if _PROCESSOR is None:
+        return NOOP_SPAN
+    parent = parent or _CURRENT_SPAN.get()
+    trace_id = parent.trace_id if parent else secrets.token_hex(16)
+    return Span(name, trace_id, parent.span_id if parent else None, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Дочерний span текущего; исключение помечает span ошибкой и пробрасывается дальше"""
+    if _PROCESSOR is None:
+        yield NOOP_SPAN
+        return
+    current = start_span(name, **attributes)
+    token = _CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except asyncio.CancelledError:
+        current.set_attribute("cancelled", True)
+        raise
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        try:
+            _CURRENT_SPAN.reset(token)
+        except ValueError:
+            # Async-генератор закрыт из другого контекста
+            pass
+        current.end()
+
+
+def setup_tracing(exporters: List[SpanExporter] = None) -> bool:
+    """Включает экспорт span'ов по настройкам TRACING_EXPORTERS (jsonl, otlp) или в переданные exporters"""
+    global _PROCESSOR
+    if _PROCESSOR is not None:
+        return True
+
+    if exporters is None:
+        exporters = []
+        for name in settings.TRACING_EXPORTERS:
+            if name == "jsonl":
+                exporters.append(JsonlSpanExporter(settings.TRACING_JSONL_PATH))
+            elif name == "otlp":
+                exporters.append(OtlpHttpSpanExporter(settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME))
+            elif name and name != "none":
+                logger.warning(f"Unknown tracing exporter '{name}', ignored")
+    if not exporters:
+        return False
+
+    _PROCESSOR = BatchSpanProcessor(exporters, flush_interval=settings.TRACING_FLUSH_INTERVAL)
+    logger.info(f"Tracing enabled, exporters: {[type(e).__name__ for e in exporters]}")
+    return True
+
+
+def shutdown_tracing() -> None:
+    global _PROCESSOR
+    if _PROCESSOR is not None:
+        processor, _PROCESSOR = _PROCESSOR, None
+        processor.shutdown()
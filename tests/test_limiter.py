@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+import pytest
+from src.admission.limiter import AdmissionRejected, Priority, RateLimiter
+
+
+def _wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition was not reached in time"
+        time.sleep(0.01)
+
+
+def test_disabled_limiter_never_waits():
+    limiter = RateLimiter("llm", rpm=0, tpm=0, max_wait=1)
+    assert not limiter.enabled
+    for _ in range(100):
+        limiter.acquire(tokens=10_000)
+    assert limiter.estimated_wait() == 0.0
+    assert limiter.stats()["granted"] == 0
+
+
+def test_grants_within_budget():
+    limiter = RateLimiter("llm", rpm=10, tpm=1000, max_wait=0)
+    for _ in range(10):
+        limiter.acquire(tokens=100)
+
+    stats = limiter.stats()
+    assert stats["granted"] == 10 and stats["waited"] == 0
+    assert stats["requests_available"] < 1 and stats["tokens_available"] < 1
+    assert limiter.estimated_wait(requests=1) == pytest.approx(6.0, abs=0.1)
+
+
+def test_interactive_request_rejected_when_wait_exceeds_limit():
+    limiter = RateLimiter("llm", rpm=6, tpm=0, max_wait=1)
+    for _ in range(6):
+        limiter.acquire()
+
+    assert limiter.overloaded()
+    with pytest.raises(AdmissionRejected) as exc:
+        limiter.acquire()
+    assert exc.value.resource == "llm" and exc.value.wait > 1
+    stats = limiter.stats()
+    assert stats["rejected"] == 1 and stats["queued"] == 0
+
+
+def test_oversized_request_waits_for_full_bucket_only():
+    limiter = RateLimiter("llm", rpm=0, tpm=6000, max_wait=0)
+    limiter.acquire(tokens=10_000)
+    # Запрос больше ёмкости проходит при полном ведре и уводит его в минус
+    assert limiter.stats()["tokens_available"] == pytest.approx(-4000, abs=1)
+
+
+def test_settle_corrects_token_budget():
+    limiter = RateLimiter("llm", rpm=0, tpm=6000, max_wait=0)
+    limiter.acquire(tokens=1000)
+    limiter.settle(estimated_tokens=1000, actual_tokens=3000)
+    assert limiter.stats()["tokens_available"] == pytest.approx(3000, abs=1)
+    limiter.settle(estimated_tokens=3000, actual_tokens=0)
+    assert limiter.stats()["tokens_available"] == 6000
+
+
+def test_interactive_overtakes_queued_background():
+    # 2 запроса в секунду: после опустошения ведра каждый следующий ждёт ~0.5 с
+    limiter = RateLimiter("embeddings", rpm=120, tpm=0, max_wait=0)
+    limiter.acquire(requests=120)
+    order = []
+
+    def run(priority):
+        limiter.acquire(priority)
+        order.append(priority)
+
+    background = threading.Thread(target=run, args=(Priority.BACKGROUND,))
+    background.start()
+    _wait_until(lambda: limiter.stats()["queued"] == 1)
+    interactive = threading.Thread(target=run, args=(Priority.INTERACTIVE,))
+    interactive.start()
+    background.join(5)
+    interactive.join(5)
+
+    assert order == [Priority.INTERACTIVE, Priority.BACKGROUND]
+    assert limiter.stats()["waited"] == 2
+
+
+def test_background_is_never_rejected_and_interactive_counts_queue_ahead():
+    limiter = RateLimiter("llm", rpm=600, tpm=0, max_wait=2)
+    limiter.acquire(requests=600)
+    thread = threading.Thread(target=limiter.acquire, args=(Priority.BACKGROUND, 3))
+    thread.start()
+    _wait_until(lambda: limiter.stats()["queued"] == 1)
+
+    # Фоновый запрос впереди не мешает интерактивному, интерактивные впереди — мешают
+    assert limiter.estimated_wait(Priority.INTERACTIVE) == pytest.approx(0.1, abs=0.05)
+    assert limiter.estimated_wait(Priority.BACKGROUND) == pytest.approx(0.4, abs=0.05)
+    thread.join(5)
+    assert limiter.stats()["rejected"] == 0
+
+
+def test_async_acquire_cancel_leaves_queue():
+    limiter = RateLimiter("llm", rpm=60, tpm=0, max_wait=0)
+    limiter.acquire(requests=60)
+
+    async def scenario():
+        task = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.1)
+        assert limiter.stats()["queued"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(limiter.aacquire(), 5)
+
+    asyncio.run(scenario())
+    stats = limiter.stats()
+    assert stats["queued"] == 0 and stats["granted"] == 2
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from src.knowledge_base.mmr_retriever import mmr_select, normalize_rows
+
+
+def _langchain_mmr(vectors: np.ndarray, query: np.ndarray, k: int, fetch_k: int, lambda_mult: float):
+    # Как FAISS.max_marginal_relevance_search: fetch_k ближайших, затем MMR среди них
+    similarity = normalize_rows(vectors) @ (query / np.linalg.norm(query))
+    candidates = np.argsort(-similarity, kind="stable")[:fetch_k]
+    selected = maximal_marginal_relevance(query, [vectors[i] for i in candidates], lambda_mult=lambda_mult, k=k)
+    return [int(candidates[i]) for i in selected]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.25, 0.5, 1.0])
+def test_mmr_select_matches_langchain(seed, lambda_mult):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(50, 16)).astype(np.float32)
+    query = rng.normal(size=16).astype(np.float32)
+
+    expected = _langchain_mmr(vectors, query, k=10, fetch_k=20, lambda_mult=lambda_mult)
+    assert mmr_select(normalize_rows(vectors), query, 10, 20, lambda_mult) == expected
+
+
+def test_mmr_select_ignores_vector_scale():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(20, 8)).astype(np.float32)
+    query = rng.normal(size=8).astype(np.float32)
+    matrix = normalize_rows(vectors)
+
+    assert mmr_select(matrix, query, 5, 10, 0.25) == mmr_select(matrix, query * 10, 5, 10, 0.25)
+
+
+def test_mmr_select_limits():
+    rng = np.random.default_rng(1)
+    matrix = normalize_rows(rng.normal(size=(3, 4)))
+    query = rng.normal(size=4).astype(np.float32)
+
+    assert mmr_select(matrix, query, 0, 20, 0.5) == []
+    assert mmr_select(np.zeros((0, 4), dtype=np.float32), query, 5, 20, 0.5) == []
+    assert sorted(mmr_select(matrix, query, 10, 20, 0.5)) == [0, 1, 2]
+
+
+def test_mmr_select_starts_with_nearest_and_skips_duplicates():
+    matrix = normalize_rows(np.array([[1, 0], [1, 0.01], [0, 1]], dtype=np.float32))
+    query = np.array([1, 0.1], dtype=np.float32)
+
+    # Почти копия ближайшего документа уступает далёкому, если разнообразие важнее близости
+    assert mmr_select(matrix, query, 2, 3, 0.25) == [1, 2]
+
+
+def test_normalize_rows_keeps_zero_rows():
+    rows = normalize_rows(np.array([[3, 4], [0, 0]]))
+
+    assert rows.dtype == np.float32
+    assert rows.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(rows, [[0.6, 0.8], [0, 0]])
@@ -0,0 +1,115 @@
+import pytest
+from src.knowledge_base.product_catalog import Product, ProductCatalog, name_tokens, read_products_csv
+
+NAMES = [
+    "AquaDoctor C-90Т в таблетках 200 г",
+    "Набір хімії для басейну AquaDoctor Super Kit 5 в 1",
+    "AquaDoctor pH Minus в гранулах",
+    "AquaDoctor C-60T в таблетках",
+    "AquaDoctor C-60 в гранулах",
+    "Засіб для підвищення рівня pH AquaDoctor pH Plus в гранулах",
+    "Коагулюючий засіб в гранулах AquaDoctor FL",
+    "Рідкий засіб для зниження pH AquaDoctor pH Minus (Сірчана 35%)",
+    "Рідкий засіб для зниження pH AquaDoctor pH Minus HL (Соляна 14%)",
+    "Дезінфектант на основі активного кисню AquaDoctor Water Shock О2",
+    "Рідкий коагулюючий засіб AquaDoctor FL",
+    "Засіб для очищення ватерлінії басейну і СПА AquaDoctor CW CleanWaterline Крок 1",
+    "Засіб для очищення ватерлінії басейну і СПА AquaDoctor CW CleanWaterline Крок 2",
+    "Засіб для видалення металів AquaDoctor SMe StopMetal",
+    "Тестер AquaDoctor Test Kit O2/pH",
+    "Тестер AquaDoctor 5 в 1",
+    "Засіб для консервації AquaDoctor Winter Care",
+]
+
+
+@pytest.fixture
+def catalog():
+    return ProductCatalog([Product(name) for name in NAMES])
+
+
+def _name(product):
+    return product.name if product is not None else None
+
+
+def test_name_tokens_normalizes_codes():
+    # Кирилиця в латинському коді, регістр і дефіс не важливі
+    assert name_tokens("С-60Т") == name_tokens("c-60t") == ["c", "60t"]
+    assert name_tokens("рН-") == ["ph", "minus"]
+    assert name_tokens("мс") == ["мс"]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("AquaDoctor C-60T в таблетках", "AquaDoctor C-60T в таблетках"),
+    ("С-60Т", "AquaDoctor C-60T в таблетках"),
+    ("c 60", "AquaDoctor C-60 в гранулах"),
+    ("Aquadocter C60T", "AquaDoctor C-60T в таблетках"),
+    ("1. SMe", "Засіб для видалення металів AquaDoctor SMe StopMetal"),
+    ("pH-HL", "Рідкий засіб для зниження pH AquaDoctor pH Minus HL (Соляна 14%)"),
+    ("CW2", "Засіб для очищення ватерлінії басейну і СПА AquaDoctor CW CleanWaterline Крок 2"),
+    ("Water Shock O2", "Дезінфектант на основі активного кисню AquaDoctor Water Shock О2"),
+    ("WC", "Засіб для консервації AquaDoctor Winter Care"),
+])
+def test_resolve(catalog, query, expected):
+    assert _name(catalog.resolve(query)) == expected
+
+
+@pytest.mark.parametrize("query", ["Aquadoctor", "щось невідоме", "", "pH"])
+def test_resolve_unknown(catalog, query):
+    assert catalog.resolve(query) is None
+
+
+def test_resolve_ambiguous_picks_closest_then_shortest(catalog):
+    # «pH Minus» — гранули і рідкий засіб; коротша назва гранул ближча до запиту
+    assert _name(catalog.resolve("AquaDoctor pH Minus")) == "AquaDoctor pH Minus в гранулах"
+    assert _name(catalog.resolve("FL")) == "Рідкий коагулюючий засіб AquaDoctor FL"
+
+
+def test_resolve_tie_goes_to_catalog_order():
+    first, second = Product("Сухий AquaDoctor XL"), Product("Рідкі AquaDoctor XL")
+    assert ProductCatalog([first, second]).resolve("XL") == first
+    assert ProductCatalog([second, first]).resolve("XL") == second
+
+
+def test_find_mentions(catalog):
+    found, ambiguous = catalog.find_mentions("Скільки додати C-60T і SMe на 20 м3?")
+    assert [p.name for p in found] == [
+        "AquaDoctor C-60T в таблетках",
+        "Засіб для видалення металів AquaDoctor SMe StopMetal",
+    ]
+    assert not ambiguous
+
+    found, ambiguous = catalog.find_mentions("Чим краще знизити pH Minus?")
+    assert found == [] and ambiguous
+
+
+def test_needs_product_rules(catalog):
+    c60t = catalog.resolve("C-60T")
+    ph_minus = catalog.resolve("AquaDoctor pH Minus")
+    ph_plus = catalog.resolve("pH Plus")
+
+    assert not ProductCatalog.needs_product_rules("C-60T", [c60t])
+    assert ProductCatalog.needs_product_rules("Super Kit 5 в 1", [catalog.resolve("Super Kit")])
+    assert ProductCatalog.needs_product_rules("pH Minus", [ph_minus])
+    assert not ProductCatalog.needs_product_rules("pH Minus і pH Plus", [ph_minus, ph_plus])
+    assert ProductCatalog.needs_product_rules("", catalog.products[:5])
+
+
+def test_normalize_names_keeps_unknown_names(catalog):
+    assert catalog.normalize_names(["- С-60Т", "AquaDoctor C-60T в таблетках", "2. Хлор Bayrol"]) == [
+        "AquaDoctor C-60T в таблетках",
+        "Хлор Bayrol",
+    ]
+    assert ProductCatalog([]).normalize_names(["будь-що"]) == ["будь-що"]
+
+
+def test_save_load_and_csv(catalog, tmp_path):
+    catalog.save(str(tmp_path))
+    assert ProductCatalog.load(str(tmp_path)).products == catalog.products
+    assert ProductCatalog.load(str(tmp_path / "missing")) is None
+
+    path = tmp_path / "products.csv"
+    path.write_text("Препарат,Дозування\nAquaDoctor C-60T в таблетках,1 таблетка на 2 м³\n,\n", encoding="utf-8")
+    assert read_products_csv(str(path)) == [Product("AquaDoctor C-60T в таблетках", dosage="1 таблетка на 2 м³")]
+
+    path.write_text("Назва,Ціна\nщось,1\n", encoding="utf-8")
+    assert read_products_csv(str(path)) == []
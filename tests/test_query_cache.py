@@ -0,0 +1,112 @@
+import numpy as np
+from src.knowledge_base import query_cache
+from src.knowledge_base.query_cache import LRUCache, SemanticAnswerCache, normalize_query
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_normalize_query():
+    assert normalize_query("  Скільки  pH-Minus додати?! ") == "скільки ph minus додати"
+    assert normalize_query("C-60T,  20 м3") == normalize_query("c 60t 20 М3")
+    assert normalize_query(None) == ""
+
+
+def test_lru_evicts_least_recently_used():
+    evicted = []
+    cache = LRUCache(2, on_evict=evicted.append)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert evicted == ["b"]
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_lru_ttl_expiry(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(query_cache.time, "monotonic", clock)
+    evicted = []
+    cache = LRUCache(10, ttl=60, on_evict=evicted.append)
+    cache.set("a", 1)
+
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.peek("a") is None
+    assert cache.values() == []
+    assert cache.get("a") is None
+    assert evicted == ["a"]
+    assert len(cache) == 0
+
+
+def test_lru_peek_does_not_touch_order_or_stats():
+    evicted = []
+    cache = LRUCache(2, on_evict=evicted.append)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.peek("a") == 1
+    cache.set("c", 3)
+
+    assert evicted == ["a"]
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 0
+
+
+def test_lru_clear_does_not_report_evictions():
+    evicted = []
+    cache = LRUCache(2, on_evict=evicted.append)
+    cache.set("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0 and evicted == []
+
+
+class FakeEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def test_semantic_cache_matches_close_queries_with_same_numbers():
+    embeddings = FakeEmbeddings({
+        "скільки хлору на 10 м3": [1.0, 0.0],
+        "скільки хлору треба на 10 м3": [0.99, 0.05],
+        "скільки хлору треба на 20 м3": [0.99, 0.05],
+        "як знизити ph": [0.0, 1.0],
+    })
+    cache = SemanticAnswerCache(embeddings, max_size=10, ttl=3600, threshold=0.95)
+
+    answer, vector = cache.lookup("скільки хлору на 10 м3", "gen-1")
+    assert answer is None
+    cache.store("скільки хлору на 10 м3", "1 таблетка", "gen-1", vector)
+
+    assert cache.lookup("Скільки хлору на 10 м3?", "gen-1")[0] == "1 таблетка"
+    assert cache.lookup("скільки хлору треба на 10 м3", "gen-1")[0] == "1 таблетка"
+    assert cache.lookup("скільки хлору треба на 20 м3", "gen-1")[0] is None
+    assert cache.lookup("як знизити ph", "gen-1")[0] is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_semantic_cache_forgets_evicted_and_previous_generation():
+    embeddings = FakeEmbeddings({"a": [1.0, 0.0], "b": [0.0, 1.0], "a2": [0.99, 0.05]})
+    cache = SemanticAnswerCache(embeddings, max_size=1, ttl=3600, threshold=0.95)
+    cache.lookup("a", "gen-1")
+    cache.store("a", "answer a", "gen-1", np.array([1.0, 0.0]))
+    cache.store("b", "answer b", "gen-1", np.array([0.0, 1.0]))
+
+    # «a» вытеснена по размеру — её вектор не должен находиться
+    assert cache.lookup("a2", "gen-1")[0] is None
+
+    assert cache.lookup("b", "gen-2")[0] is None
+    cache.store("b", "stale answer", "gen-1", np.array([0.0, 1.0]))
+    assert cache.lookup("b", "gen-2")[0] is None
@@ -0,0 +1,91 @@
+import asyncio
+from src.bot.session_scheduler import SessionScheduler
+
+
+class Recorder:
+    """runner для планировщика: запоминает ходы и может задержать ход до release()"""
+
+    def __init__(self):
+        self.turns = []
+        self.started = asyncio.Event()
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, session_id, turn):
+        self.turns.append((session_id, turn.text, turn.update))
+        self.started.set()
+        await self.gate.wait()
+
+
+def test_messages_before_turn_starts_are_coalesced():
+    async def scenario():
+        runner = Recorder()
+        scheduler = SessionScheduler(runner, coalesce_window=10, max_messages=5)
+        assert scheduler.submit("s1", "скільки хлору", "u1", None) is False
+        assert scheduler.submit("s1", "на 20 м3", "u2", None) is True
+        await scheduler.wait_idle("s1")
+        return runner, scheduler
+
+    runner, scheduler = asyncio.run(scenario())
+    # Відповідь іде на останнє повідомлення пачки
+    assert runner.turns == [("s1", "скільки хлору\nна 20 м3", "u2")]
+    assert scheduler.stats() == {"active_sessions": 0, "queued_turns": 0, "turns": 1, "coalesced_messages": 1}
+
+
+def test_running_turn_is_not_extended():
+    async def scenario():
+        runner = Recorder()
+        runner.gate.clear()
+        scheduler = SessionScheduler(runner, coalesce_window=10, max_messages=5)
+        scheduler.submit("s1", "a", None, None)
+        await runner.started.wait()
+        scheduler.submit("s1", "b", None, None)
+        scheduler.submit("s1", "c", None, None)
+        assert scheduler.stats()["queued_turns"] == 1
+        runner.gate.set()
+        await scheduler.wait_idle("s1")
+        return runner.turns
+
+    assert asyncio.run(scenario()) == [("s1", "a", None), ("s1", "b\nc", None)]
+
+
+def test_coalescing_limits():
+    async def scenario(window, max_messages):
+        runner = Recorder()
+        scheduler = SessionScheduler(runner, coalesce_window=window, max_messages=max_messages)
+        for text in "abc":
+            scheduler.submit("s1", text, None, None)
+        await scheduler.wait_idle("s1")
+        return [text for _, text, _ in runner.turns]
+
+    assert asyncio.run(scenario(10, 2)) == ["a\nb", "c"]
+    assert asyncio.run(scenario(-1, 5)) == ["a", "b", "c"]
+
+
+def test_sessions_run_in_parallel_and_failures_do_not_stop_queue():
+    async def scenario():
+        done = []
+        blocked = asyncio.Event()
+
+        async def runner(session_id, turn):
+            if turn.text == "boom":
+                raise RuntimeError("LLM failed")
+            if session_id == "slow":
+                await blocked.wait()
+            done.append((session_id, turn.text))
+
+        scheduler = SessionScheduler(runner, coalesce_window=10, max_messages=1)
+        scheduler.submit("slow", "1", None, None)
+        scheduler.submit("fast", "boom", None, None)
+        scheduler.submit("fast", "2", None, None)
+        await scheduler.wait_idle("fast")
+        # «slow» ещё ждёт, а «fast» уже обслужена до конца
+        assert done == [("fast", "2")]
+        assert scheduler.stats()["active_sessions"] == 1
+        blocked.set()
+        await scheduler.wait_idle("slow")
+        return done, scheduler.stats()
+
+    done, stats = asyncio.run(scenario())
+    assert done == [("fast", "2"), ("slow", "1")]
+    assert stats["active_sessions"] == 0 and stats["turns"] == 3